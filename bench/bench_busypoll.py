@@ -0,0 +1,71 @@
+"""
+忙轮询延迟测试: 在tap-veth0上用raw socket发送icmp echo请求, 统计往返时间的p50/p99,
+比较阻塞的select和不同忙轮询预算的结果。每种配置在单独的进程中运行(tap设备不能重复创建)。
+需要root权限(创建tap设备和raw socket)。
+
+usage: sudo python3 bench/bench_busypoll.py [budget_us ...]
+"""
+import os
+import sys
+import time
+import socket
+import struct
+import subprocess
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from src.checksum import checksum
+
+BUDGETS = [0, 50, 200, 1000]
+PINGS = 2000
+ETH_P_ALL = 3
+
+def icmp_echo(dst_hwaddr: bytes, src_hwaddr: bytes, seq: int) -> bytes:
+    icmp = struct.pack("!BBHHH", 8, 0, 0, 0x1234, seq) + b"x" * 56
+    icmp = icmp[:2] + struct.pack("!H", checksum(icmp)) + icmp[4:]
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(icmp), seq, 0, 64, 1, 0,
+        socket.inet_aton("10.0.0.2"), socket.inet_aton("10.0.0.1"))
+    ip = ip[:10] + struct.pack("!H", checksum(ip)) + ip[12:]
+    return dst_hwaddr + src_hwaddr + b"\x08\x00" + ip + icmp
+
+def run(budget: int) -> None:
+    from src.stack import TeeceepeeStack
+    stack = TeeceepeeStack(busy_poll=budget)
+    time.sleep(0.5)
+    veth0 = stack.netdev_manager.veth_devices[0]
+    s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    s.bind((veth0.tap.name, 0))
+    s.settimeout(1)
+    src_hwaddr = s.getsockname()[4]
+    rtts = []
+    for i in range(PINGS):
+        seq = i & 0xffff
+        start = time.perf_counter()
+        s.send(icmp_echo(veth0.hwaddr.to_bytes(), src_hwaddr, seq))
+        while True:
+            try:
+                data = s.recv(2048)
+            except socket.timeout:
+                break
+            # 只统计对应的echo reply
+            if len(data) >= 42 and data[12:14] == b"\x08\x00" and data[23] == 1 and data[34] == 0 and \
+                struct.unpack("!H", data[40:42])[0] == seq:
+                rtts.append(time.perf_counter() - start)
+                break
+        time.sleep(0.001) # 模拟稀疏的请求, 每次都要等待唤醒
+    rtts.sort()
+    p50 = rtts[len(rtts) // 2] * 1e6 if rtts else 0
+    p99 = rtts[min(len(rtts) - 1, len(rtts) * 99 // 100)] * 1e6 if rtts else 0
+    print("%-12s%-10d%-12.0f%-12.0f" % ("select" if budget == 0 else "%d us" % budget, len(rtts), p50, p99))
+    sys.stdout.flush()
+    os._exit(0)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--run":
+        run(int(sys.argv[2]))
+    if os.geteuid() != 0:
+        print("must be run as root")
+        sys.exit(1)
+    budgets = [int(arg) for arg in sys.argv[1:]] or BUDGETS
+    print("%-12s%-10s%-12s%-12s" % ("busy poll", "replies", "p50 (us)", "p99 (us)"))
+    for budget in budgets:
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--run", str(budget)], stderr=subprocess.DEVNULL)
@@ -0,0 +1,51 @@
+"""
+校验和性能测试: 比较逐个16位字累加的旧实现和checksum模块, 以及批量计算的吞吐量
+
+usage: python3 bench/bench_checksum.py
+"""
+import os
+import sys
+import time
+import struct
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from src import checksum as csum
+
+SIZES = [20, 64, 576, 1500, 9000, 65535]
+BATCH = 1024
+
+def checksum_loop(data: bytes) -> int:
+    # 旧的实现: 每次解析一个16位字
+    if len(data) % 2 == 1:
+        data += b'\x00'
+    sum = 0
+    for i in range(0, len(data), 2):
+        sum += struct.unpack("!H", data[i:i+2])[0]
+        if sum > 0xffff:
+            sum = (sum & 0xffff) + 1
+    return sum ^ 0xffff
+
+def bench(func, data, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        func(data)
+    return (time.perf_counter() - start) / count * 1e6
+
+def bench_batch(buffers) -> float:
+    start = time.perf_counter()
+    csum.checksum_batch(buffers)
+    return (time.perf_counter() - start) / len(buffers) * 1e6
+
+if __name__ == "__main__":
+    print("numpy: %s" % ("yes" if csum.np is not None else "no"))
+    print("%-10s%-16s%-16s%-16s%-16s" % ("size", "loop us", "checksum us", "batch us", "checksum MB/s"))
+    for size in SIZES:
+        data = os.urandom(size)
+        assert checksum_loop(data) == csum.checksum(data)
+        count = max(10, 200000 // size)
+        loop = bench(checksum_loop, data, max(3, count // 100))
+        fast = bench(csum.checksum, data, count)
+        buffers = [os.urandom(size) for _ in range(min(BATCH, 64 * 1024 * 1024 // size))]
+        assert csum.checksum_batch(buffers) == [csum.checksum(buf) for buf in buffers]
+        batch = bench_batch(buffers)
+        print("%-10d%-16.2f%-16.2f%-16.2f%-16.0f" % (size, loop, fast, batch, size / fast))
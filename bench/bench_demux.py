@@ -0,0 +1,92 @@
+"""
+tcp套接字查找性能测试: 建立N个established连接和一个监听0.0.0.0的套接字,
+统计按四元组查找(命中established表)和查找新连接(回退到监听表)的每秒次数。
+旧的实现(sha256哈希 + 64个桶线性查找)太慢, 只查找少量的次数。
+
+usage: python3 bench/bench_demux.py
+"""
+import os
+import sys
+import time
+import random
+import hashlib
+from typing import Any, Dict, List
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from src.ip import IPAddress
+from src.socket import SockAddr
+from src.tcp import TCPState
+from src.tcp.sock import TCPSockManager
+
+CONNECTIONS = [1000, 10000, 100000]
+LOOKUPS = 200000
+OLD_LOOKUPS = 200
+
+class OldHashBucket(object):
+    # 旧的实现(已经从src中删除), 只用于比较
+    def __init__(self, size: int) -> None:
+        self.hash_bucket_size = size
+        self.hash_bucket: Dict[int, List[Any]] = {}
+
+    def hash(self, *args: Any) -> int:
+        key = "".join(str(arg) for arg in args)
+        return int(hashlib.sha256(key.encode('utf-8')).hexdigest(), 16) % self.hash_bucket_size
+
+    def get(self, hash_key: int) -> List[Any]:
+        return self.hash_bucket.get(hash_key, [])
+
+    def set(self, hash_key: int, value: Any) -> None:
+        self.hash_bucket.setdefault(hash_key, []).append(value)
+
+class BenchSock(object):
+    # 只有查找需要的属性, 创建100k个TCPSock需要完整的协议栈
+    def __init__(self, src_ipaddr: IPAddress, src_port: int, dst_ipaddr: IPAddress, dst_port: int, state: TCPState) -> None:
+        self.addr = SockAddr()
+        self.addr.src_ipaddr = src_ipaddr
+        self.addr.src_port = src_port
+        self.addr.dst_ipaddr = dst_ipaddr
+        self.addr.dst_port = dst_port
+        self.state = state
+        self.hash_key = None
+
+def bench(n: int) -> None:
+    manager = TCPSockManager(None) # type: ignore
+    old = OldHashBucket(0x40)
+    local = IPAddress("10.0.0.1")
+    listen = BenchSock(IPAddress("0.0.0.0"), 80, IPAddress("0.0.0.0"), 0, TCPState.LISTEN)
+    manager.hash(listen) # type: ignore
+    tuples = []
+    for i in range(n):
+        remote = IPAddress(0x0a000000 + random.getrandbits(24))
+        port = 1024 + i % 60000
+        sock = BenchSock(local, 80, remote, port, TCPState.ESTABLISHED)
+        if manager.hash(sock): # type: ignore
+            tuples.append((local, remote, 80, port))
+            old.set(old.hash(local, 80, remote, port), sock)
+    queries = [random.choice(tuples) for _ in range(LOOKUPS)]
+    misses = [(local, IPAddress(0x0b000000 + random.getrandbits(24)), 80, 1024) for _ in range(LOOKUPS)]
+
+    lookup = manager.lookup
+    start = time.perf_counter()
+    for src, dst, sport, dport in queries:
+        lookup(src, dst, sport, dport)
+    hit = LOOKUPS / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for src, dst, sport, dport in misses:
+        lookup(src, dst, sport, dport)
+    miss = LOOKUPS / (time.perf_counter() - start)
+
+    # 旧的实现: sha256计算桶号, 然后线性查找桶
+    start = time.perf_counter()
+    for src, dst, sport, dport in queries[:OLD_LOOKUPS]:
+        for sock in old.get(old.hash(src, sport, dst, dport)):
+            if sock.addr.src_ipaddr == src and sock.addr.src_port == sport and sock.addr.dst_ipaddr == dst and sock.addr.dst_port == dport:
+                break
+    old_rate = OLD_LOOKUPS / (time.perf_counter() - start)
+    print("%-14d%-20.0f%-20.0f%-20.0f" % (len(tuples), hit, miss, old_rate))
+
+if __name__ == "__main__":
+    random.seed(0)
+    print("%-14s%-20s%-20s%-20s" % ("connections", "established/s", "listen/s", "old established/s"))
+    for n in CONNECTIONS:
+        bench(n)
@@ -0,0 +1,57 @@
+"""
+路由查找性能测试: 随机生成不同规模的路由表, 统计每秒查找次数(lookups/s)
+
+usage: python3 bench/bench_route.py
+"""
+import os
+import sys
+import time
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from src.ip import IPAddress, IPNetwork
+from src.ip.route import RouteEntry, RouteFlags
+from src.ip.route.table import RouteTable
+
+TABLE_SIZES = [10, 1000, 10000, 100000, 500000]
+LOOKUPS = 200000
+
+def random_routes(n: int):
+    routes = {}
+    while len(routes) < n:
+        plen = random.randint(8, 32)
+        net = IPNetwork((random.getrandbits(32), plen), strict=False)
+        routes[net] = RouteEntry(net, None, RouteFlags.NONE, 0, None) # type: ignore
+    return list(routes.values())
+
+def bench(table: RouteTable, addrs) -> float:
+    lookup = table.lookup
+    start = time.perf_counter()
+    for addr in addrs:
+        lookup(addr)
+    return len(addrs) / (time.perf_counter() - start)
+
+def bench_linear(entries, addrs) -> float:
+    # 旧的实现: 按插入顺序线性查找
+    start = time.perf_counter()
+    for addr in addrs:
+        for entry in entries:
+            if addr in entry.net:
+                break
+    return len(addrs) / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    random.seed(0)
+    addrs = [random.getrandbits(32) for _ in range(LOOKUPS)]
+    print("%-12s%-20s%-20s" % ("routes", "lpm lookups/s", "linear lookups/s"))
+    for size in TABLE_SIZES:
+        entries = random_routes(size)
+        table = RouteTable()
+        for entry in entries:
+            table.insert(entry)
+        lpm = bench(table, addrs)
+        linear = "-"
+        if size <= 1000:
+            ip_addrs = [IPAddress(addr) for addr in addrs[:LOOKUPS // size]]
+            linear = "%.0f" % bench_linear(entries, ip_addrs)
+        print("%-12d%-20.0f%-20s" % (size, lpm, linear))
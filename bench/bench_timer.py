@@ -0,0 +1,62 @@
+"""
+tcp定时器性能测试: N个套接字各有一个keepalive定时器(2小时), 其中10%还有一个TIME_WAIT定时器(2秒),
+统计设置和取消定时器的开销, 以及时间轮推进1秒(1000个tick)的开销。
+旧的实现(列表 + 每200毫秒遍历所有定时器)每次遍历的开销和定时器的总数成正比。
+
+usage: python3 bench/bench_timer.py
+"""
+import os
+import sys
+import time
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from src.timer.wheel import TimingWheel, WheelTimer
+
+SOCKETS = [1000, 10000, 100000]
+KEEPALIVE = 2 * 60 * 60
+TIMEWAIT = 2
+
+def callback(*args) -> None:
+    pass
+
+def bench(n: int) -> None:
+    wheel = TimingWheel() # 不启动线程, 直接调用_advance模拟时间的流逝
+    timers = [WheelTimer(callback, i) for i in range(n)]
+    timewait = [WheelTimer(callback, i) for i in range(n // 10)]
+
+    start = time.perf_counter()
+    for timer in timers:
+        wheel.add(timer, KEEPALIVE * random.uniform(0.5, 1))
+    for timer in timewait:
+        wheel.add(timer, TIMEWAIT * random.uniform(0.5, 1))
+    arm = (time.perf_counter() - start) / (n + len(timewait)) * 1e6
+
+    # 推进3秒, TIME_WAIT定时器全部到期
+    start = time.perf_counter()
+    fired = 0
+    for second in range(1, 4):
+        fired += len(wheel._advance(wheel.current + 999))
+    advance = (time.perf_counter() - start) / 3 * 1000
+
+    start = time.perf_counter()
+    for timer in timers:
+        wheel.cancel(timer)
+    cancel = (time.perf_counter() - start) / n * 1e6
+
+    # 旧的实现: 每200毫秒遍历一次所有的定时器
+    old = [[timer, KEEPALIVE] for timer in timers] + [[timer, TIMEWAIT] for timer in timewait]
+    start = time.perf_counter()
+    for entry in old:
+        entry[1] -= 0.2
+        if entry[1] <= 0:
+            pass
+    old_scan = (time.perf_counter() - start) * 5 * 1000
+
+    print("%-10d%-14.2f%-14.2f%-18.2f%-10d%-18.2f" % (n, arm, cancel, advance, fired, old_scan))
+
+if __name__ == "__main__":
+    random.seed(0)
+    print("%-10s%-14s%-14s%-18s%-10s%-18s" % ("sockets", "arm (us)", "cancel (us)", "ms per second", "fired", "old ms per second"))
+    for n in SOCKETS:
+        bench(n)
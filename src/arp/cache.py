@@ -14,10 +14,13 @@ class ArpCache(object):
         self.arp_table: list[ArpEntry] = []
         self.arp_cache_lock = Lock()
         self.arp_cache_manager = arp_cache_manager
+        # 表项的增删和mac地址的变化都会使generation加1, 缓存了邻居mac地址的地方(比如转发流表)据此判断是否失效
+        self.generation: int = 0
 
     def insert_entry(self, entry: ArpEntry) -> None:
         with self.arp_cache_lock:
             self.arp_table.append(entry)
+            self.generation += 1
     
     def lookup_entry(self, pro:EtherType, ipaddr: IPAddress) -> Union[ArpEntry, None]:
         with self.arp_cache_lock:
@@ -40,6 +43,7 @@ class ArpCache(object):
                 if entry.state == ArpEntryState.WAITING:
                     if entry.retry_count <= 0: # 表示此条目arp请求已经超过重试次数
                         new_arp_table.remove(entry)
+                        self.generation += 1
                     else:
                         entry.retry_count -= 1
                         entry.ttl = ArpEntry.MAX_TTL
@@ -49,6 +53,7 @@ class ArpCache(object):
                     entry.ttl -= delta
                     if entry.ttl <= 0: # 表示此条目已经超超时
                         new_arp_table.remove(entry)
+                        self.generation += 1
             self.arp_table = new_arp_table
 
     def show(self):
@@ -139,6 +139,8 @@ class ArpCacheManager():
             ))
 
         if arp_entry is not None:
+            if arp_entry.hwaddr != arp_ipv4_hdr.src_hwaddr or arp_entry.state != ArpEntryState.RESOLVED:
+                self.arp_cache.generation += 1
             arp_entry.hwaddr = arp_ipv4_hdr.src_hwaddr # update hwaddr
             if arp_entry.state == ArpEntryState.WAITING: # if waiting, send pending packet
                 try:
@@ -0,0 +1,81 @@
+from typing import List, Sequence, Union
+try:
+    import numpy as np # type: ignore
+except ImportError:
+    np = None
+
+"""
+Internet校验和(RFC 1071)
+
+16位反码求和等价于把整个数据看成一个大整数对0xffff取模(因为 2^16 ≡ 1 mod 0xffff),
+所以不需要按16位逐个累加, int.from_bytes一次把数据转换成整数, 取模就得到了反码和,
+整个计算在C代码里完成。安装了numpy时, 较大的数据直接用numpy按16位字求和, 还要更快一些。
+
+唯一的区别是反码和不会是0(除非数据全为0), 取模的结果为0时, 反码和实际上是0xffff。
+
+    csum_partial: 计算数据的反码和(未取反), 可以累加多段数据, 比如tcp伪头部和tcp报文
+    csum_fold:    把反码和取反, 得到校验和
+    checksum:     计算一段数据的校验和, 接收方校验时结果为0表示校验通过
+    checksum_batch: 批量计算多段数据的校验和, 安装了numpy时对等长的数据使用向量化计算
+    csum_replace2/csum_replace4: 报文中16位/32位的字段被修改后, 增量更新校验和(RFC 1624),
+                  不需要重新计算整个报文
+"""
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+def csum_add(sum1: int, sum2: int) -> int:
+    # 两个反码和相加
+    sum = sum1 + sum2
+    return sum - 0xffff if sum > 0xffff else sum
+
+NUMPY_MIN_SIZE = 4096 # 数据较大时, numpy按16位字求和比大整数取模快
+
+def csum_partial(data: BytesLike, sum: int = 0) -> int:
+    if np is not None and len(data) >= NUMPY_MIN_SIZE:
+        even = len(data) & ~1
+        n = int(np.frombuffer(data, dtype=">u2", count=even // 2).sum(dtype=np.uint64))
+        if even != len(data):
+            n += data[-1] << 8
+    else:
+        n = int.from_bytes(data, "big")
+        if len(data) % 2 == 1:
+            n <<= 8 # 奇数长度, 最后一个字节后面补0
+    s = n % 0xffff
+    if s == 0 and n != 0:
+        s = 0xffff
+    return csum_add(s, sum) if sum != 0 else s
+
+def csum_fold(sum: int) -> int:
+    return ~sum & 0xffff
+
+def checksum(data: BytesLike) -> int:
+    return csum_fold(csum_partial(data))
+
+BATCH_MIN_SIZE = 16 # 数据段太少时, 转换成numpy数组的开销比计算本身还大
+
+def checksum_batch(buffers: Sequence[BytesLike]) -> List[int]:
+    if np is None or len(buffers) < BATCH_MIN_SIZE:
+        return [checksum(buf) for buf in buffers]
+    length = len(buffers[0])
+    if length == 0 or length % 2 == 1 or any(len(buf) != length for buf in buffers):
+        return [checksum(buf) for buf in buffers]
+    words = np.frombuffer(b"".join(buffers), dtype=">u2").reshape(len(buffers), length // 2)
+    sums = words.sum(axis=1, dtype=np.uint64)
+    # 折叠进位: 数据长度不超过64KB时, 两次折叠就够了
+    sums = (sums & 0xffff) + (sums >> 16)
+    sums = (sums & 0xffff) + (sums >> 16)
+    return [int(s) for s in (~sums.astype(np.uint16))]
+
+def csum_replace2(check: int, old: int, new: int) -> int:
+    # RFC 1624 eqn. 3: HC' = ~(~HC + ~m + m')
+    sum = (~check & 0xffff) + (~old & 0xffff) + new
+    sum = (sum & 0xffff) + (sum >> 16)
+    sum = (sum & 0xffff) + (sum >> 16)
+    return ~sum & 0xffff
+
+def csum_replace4(check: int, old: int, new: int) -> int:
+    # 32位的字段(比如ip地址)看成两个16位字
+    sum = (~check & 0xffff) + (~(old >> 16) & 0xffff) + (~old & 0xffff) + (new >> 16) + (new & 0xffff)
+    sum = (sum & 0xffff) + (sum >> 16)
+    sum = (sum & 0xffff) + (sum >> 16)
+    return ~sum & 0xffff
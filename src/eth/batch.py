@@ -0,0 +1,156 @@
+from typing import Dict, List, Tuple, TYPE_CHECKING
+try:
+    import numpy as np # type: ignore
+except ImportError:
+    np = None
+from . import EtherHdr, EtherType, MacAddressType
+from ..ip import IPHdr, IPProto
+from ..tcp import TCPHdr
+from ..pkb import Packetbuffer
+if TYPE_CHECKING:
+    from .ether import EthernetThread
+
+"""
+向量模式下批量解析和分类报文:
+  把一批报文的前SNAP_LEN个字节拷贝到一个固定步长的二维数组中(不足的补0), 每一行是一个报文,
+  用结构化的dtype按列取出以太网/ipv4/tcp头部的字段, 然后用numpy一次完成所有报文的:
+    1. 目的mac地址分类(广播/组播/本机/其他主机)
+    2. 以太网类型分类(ip/arp)
+    3. ipv4头部检查: 版本和头部长度, 头部校验和, 总长度
+    4. tcp报文的四元组: 没有分片, 头部长度合法, 不带SYN/RST的tcp报文, 按列取出地址和端口,
+       填入pkb.flow, tcp按流分组, 每个流只查找一次socket(见TCP.tcp_recv_batch)
+  python只需要按分类结果把报文分发到ip和arp的列表中。
+
+  numpy只处理没有ip选项的报文, 向量化检查不通过的ip报文(包括带选项的报文)再交给ip_validate逐个检查,
+  由它记录丢弃的原因, 所以两条路径的结果是一样的。
+  没有安装numpy或者报文太少时, 逐个调用classify_packet和ip_validate。
+"""
+
+SNAP_LEN = EtherHdr.ETH_HDR_SIZE + IPHdr.IP_HDR_SIZE + TCPHdr.TCP_HDR_LEN # 以太网头部 + 没有选项的ipv4头部 + tcp头部
+BATCH_MIN_SIZE = 16 # 报文太少时, 拷贝到numpy数组的开销比逐个处理还大
+
+ETH_P_IP = EtherType.IP.value
+ETH_P_ARP = EtherType.ARP.value
+IPPROTO_TCP = IPProto.TCP.value
+TCP_FLAGS_SLOW = 0x06 # SYN|RST: 会改变socket的状态, 逐个查找socket
+
+if np is not None:
+    # 字段的偏移和EtherHdr/IPHdr/TCPHdr的布局一致, tcp字段只对没有ip选项的报文有意义
+    HDR_DTYPE = np.dtype({
+        "names": ["dst_hwaddr", "src_hwaddr", "eth_type",
+                  "ver_hlen", "tos", "total_len", "id", "frag_off", "ttl", "proto", "cksum", "src_ipaddr", "dst_ipaddr",
+                  "src_port", "dst_port", "seqn", "ackn", "data_offset", "flags"],
+        "formats": [("u1", 6), ("u1", 6), ">u2",
+                    "u1", "u1", ">u2", ">u2", ">u2", "u1", "u1", ">u2", ">u4", ">u4",
+                    ">u2", ">u2", ">u4", ">u4", "u1", "u1"],
+        "offsets": [0, 6, 12,
+                    14, 15, 16, 18, 20, 22, 23, 24, 26, 30,
+                    34, 36, 38, 42, 46, 47],
+        "itemsize": SNAP_LEN,
+    })
+
+# classify的分类结果
+KIND_OTHER = 0
+KIND_IP = 1       # 向量化检查已经通过的ip报文
+KIND_IP_CHECK = 2 # 需要ip_validate检查的ip报文
+KIND_ARP = 3
+
+MAC_TYPES = [MacAddressType.NONE, MacAddressType.LOCALHOST, MacAddressType.OTHERHOST,
+             MacAddressType.MULTICAST, MacAddressType.BROADCAST]
+
+class BatchClassifier(object):
+
+    def __init__(self, ether: 'EthernetThread') -> None:
+        self.ether = ether
+        self.vector_pkts: int = 0   # numpy处理的报文数
+        self.fallback_pkts: int = 0 # 逐个处理的报文数
+
+    def decode(self, pkbs: List[Packetbuffer]) -> Tuple[bytes, 'np.ndarray']:
+        # 拷贝到固定步长的缓冲区, 每SNAP_LEN个字节是一个报文
+        buf = b"".join([bytes(pkb.data[:SNAP_LEN]).ljust(SNAP_LEN, b"\x00") for pkb in pkbs])
+        return buf, np.frombuffer(buf, dtype=HDR_DTYPE, count=len(pkbs))
+
+    def classify(self, pkbs: List[Packetbuffer]) -> Tuple[List[Packetbuffer], List[Packetbuffer]]:
+        """
+        设置每个报文的mac_type和protocol, 返回(ip报文, arp报文)。
+        返回的ip报文都已经通过了ip头部检查, 目的mac地址是其他主机的ip报文被丢弃。
+        """
+        if np is None or len(pkbs) < BATCH_MIN_SIZE:
+            return self.classify_slow(pkbs)
+        self.vector_pkts += len(pkbs)
+        n = len(pkbs)
+        buf, hdrs = self.decode(pkbs)
+        lens = np.fromiter([len(pkb.data) for pkb in pkbs], dtype=np.int64, count=n)
+
+        # 目的mac地址
+        hwaddrs: Dict[object, bytes] = {}
+        for pkb in pkbs:
+            if pkb.indev not in hwaddrs:
+                hwaddrs[pkb.indev] = pkb.indev.hwaddr.to_bytes() if pkb.indev != None else b"\x00" * 6
+        local_hwaddr = np.frombuffer(b"".join([hwaddrs[pkb.indev] for pkb in pkbs]), dtype=np.uint8).reshape(n, 6)
+        dst_hwaddr = hdrs["dst_hwaddr"]
+        broadcast = (dst_hwaddr == 0xff).all(axis=1)
+        multicast = (dst_hwaddr[:, 0] & 0x01) != 0
+        localhost = (dst_hwaddr == local_hwaddr).all(axis=1)
+        mac_types = np.select([broadcast, multicast, localhost],
+            [MacAddressType.BROADCAST.value, MacAddressType.MULTICAST.value, MacAddressType.LOCALHOST.value],
+            MacAddressType.OTHERHOST.value)
+
+        # ipv4头部: 没有选项, 校验和正确, 总长度和报文长度一致
+        eth_type = hdrs["eth_type"]
+        is_ip = (eth_type == ETH_P_IP) & (mac_types != MacAddressType.OTHERHOST.value) & (lens >= EtherHdr.ETH_HDR_SIZE)
+        ip = EtherHdr.ETH_HDR_SIZE // 2
+        words = np.frombuffer(buf, dtype=">u2").reshape(n, SNAP_LEN // 2)[:, ip:ip + IPHdr.IP_HDR_SIZE // 2]
+        sums = words.sum(axis=1, dtype=np.uint32)
+        sums = (sums & 0xffff) + (sums >> 16)
+        sums = (sums & 0xffff) + (sums >> 16)
+        total_len = hdrs["total_len"].astype(np.int64)
+        valid = is_ip & (hdrs["ver_hlen"] == 0x45) & (sums == 0xffff) & \
+            (total_len >= IPHdr.IP_HDR_SIZE) & (total_len == lens - EtherHdr.ETH_HDR_SIZE)
+
+        kinds = np.where(valid, KIND_IP, np.where(is_ip, KIND_IP_CHECK,
+            np.where((eth_type == ETH_P_ARP) & (lens >= EtherHdr.ETH_HDR_SIZE), KIND_ARP, KIND_OTHER)))
+
+        # tcp四元组(本端地址, 本端端口, 对端地址, 对端端口), 和TCPSockManager的established表的键一致
+        doff = (hdrs["data_offset"] >> 4).astype(np.int64) * 4
+        is_flow = valid & (hdrs["proto"] == IPPROTO_TCP) & ((hdrs["frag_off"] & 0x3fff) == 0) & \
+            (doff >= TCPHdr.TCP_HDR_LEN) & (total_len >= IPHdr.IP_HDR_SIZE + doff) & ((hdrs["flags"] & TCP_FLAGS_SLOW) == 0)
+        flow_idx = np.flatnonzero(is_flow)
+        flows: List[object] = [None] * n
+        for i, key in zip(flow_idx.tolist(), zip(hdrs["dst_ipaddr"][flow_idx].tolist(), hdrs["dst_port"][flow_idx].tolist(),
+                                                 hdrs["src_ipaddr"][flow_idx].tolist(), hdrs["src_port"][flow_idx].tolist())):
+            flows[i] = key
+
+        # 只有分发报文需要回到python
+        ip_pkbs: List[Packetbuffer] = []
+        arp_pkbs: List[Packetbuffer] = []
+        validate = self.ether.ip.ip_validate
+        for pkb, mac_type, kind, flow in zip(pkbs, mac_types.tolist(), kinds.tolist(), flows):
+            pkb.mac_type = MAC_TYPES[mac_type]
+            if kind == KIND_IP:
+                pkb.protocol = EtherType.IP
+                pkb.flow = flow
+                ip_pkbs.append(pkb)
+            elif kind == KIND_IP_CHECK:
+                pkb.protocol = EtherType.IP
+                if validate(pkb):
+                    ip_pkbs.append(pkb)
+            elif kind == KIND_ARP:
+                pkb.protocol = EtherType.ARP
+                arp_pkbs.append(pkb)
+        return ip_pkbs, arp_pkbs
+
+    def classify_slow(self, pkbs: List[Packetbuffer]) -> Tuple[List[Packetbuffer], List[Packetbuffer]]:
+        self.fallback_pkts += len(pkbs)
+        ip_pkbs: List[Packetbuffer] = []
+        arp_pkbs: List[Packetbuffer] = []
+        classify = self.ether.classify_packet
+        validate = self.ether.ip.ip_validate
+        for pkb in pkbs:
+            eth_type = classify(pkb)
+            if eth_type == EtherType.IP:
+                if pkb.mac_type != MacAddressType.OTHERHOST and validate(pkb):
+                    ip_pkbs.append(pkb)
+            elif eth_type == EtherType.ARP:
+                arp_pkbs.append(pkb)
+        return ip_pkbs, arp_pkbs
@@ -1,17 +1,20 @@
 from threading import Thread
+from queue import Empty
 
 from ..logger_manager import Logger
 from ..ip.route.cache import RouteCacheManager
 from ..netdev.dev_manager import NetDeviceManageThread
 from . import EtherHdr, MacAddressType, EtherType
 from ..pkb import Packetbuffer
-from typing import Union
+from typing import List, Union
 from ..arp.cache_manager import ArpCacheManager
 from ..ip.ip import IP
+from .batch import BatchClassifier
+from ..pipeline import Pipeline
 
 class EthernetThread(Thread):
 
-    def __init__(self,arp_cache_manager: ArpCacheManager, netdev_manager: NetDeviceManageThread, route_cache_manager: RouteCacheManager, logger_manager: Logger) -> None:
+    def __init__(self,arp_cache_manager: ArpCacheManager, netdev_manager: NetDeviceManageThread, route_cache_manager: RouteCacheManager, logger_manager: Logger, vector_size: int = 0, pipelined: bool = False) -> None:
         super().__init__()
         self.setDaemon(True)
         self.logger_manager = logger_manager
@@ -21,6 +24,13 @@ class EthernetThread(Thread):
         self.route_cache_manager = route_cache_manager      
         self.ip = IP(self, arp_cache_manager, route_cache_manager, logger_manager)
         self.rcvd_pkb_queue = self.netdev_manager.rcvd_pkb_queue
+        # 大于1时开启向量模式, 每次从接收队列中最多取出vector_size个报文一起处理
+        self.vector_size = vector_size
+        self.classifier = BatchClassifier(self)
+        # 流水线模式: 接收, 协议处理和发送分别在不同的线程中完成, 见pipeline.py
+        self.pipeline: Union[Pipeline, None] = None
+        if pipelined:
+            self.pipeline = Pipeline(self, netdev_manager, logger_manager, vector_size if vector_size > 1 else Pipeline.BATCH_SIZE)
 
     def parse_packet(self, pkb: Packetbuffer) -> Union[EtherHdr, None]:
         eth_hdr = EtherHdr.from_bytes(pkb.data)
@@ -40,8 +50,66 @@ class EthernetThread(Thread):
         pkb.protocol = eth_hdr.eth_type
         return eth_hdr
     
+    BROADCAST_HWADDR = b"\xff" * 6
+    ETH_TYPE_IP = EtherType.IP.to_bytes()
+    ETH_TYPE_ARP = EtherType.ARP.to_bytes()
+
+    def classify_packet(self, pkb: Packetbuffer) -> EtherType:
+        # 和parse_packet一样设置mac_type和protocol, 但是直接比较报文中的字节, 不生成EtherHdr和MacAddress对象
+        data = pkb.data
+        if len(data) < EtherHdr.ETH_HDR_SIZE:
+            return EtherType.UNKNOWN
+        dst_hwaddr = data[0:6]
+        if dst_hwaddr[0] & 0x01:
+            if dst_hwaddr == self.BROADCAST_HWADDR:
+                pkb.mac_type = MacAddressType.BROADCAST
+            else:
+                pkb.mac_type = MacAddressType.MULTICAST
+        elif pkb.indev != None and dst_hwaddr == pkb.indev.hwaddr.to_bytes():
+            pkb.mac_type = MacAddressType.LOCALHOST
+        else:
+            pkb.mac_type = MacAddressType.OTHERHOST
+
+        eth_type = data[12:14]
+        if eth_type == self.ETH_TYPE_IP:
+            pkb.protocol = EtherType.IP
+        elif eth_type == self.ETH_TYPE_ARP:
+            pkb.protocol = EtherType.ARP
+        else:
+            pkb.protocol = EtherType.from_bytes(eth_type)
+        return pkb.protocol
+
+    def process_batch(self, pkbs: List[Packetbuffer]) -> None:
+        ip_pkbs, arp_pkbs = self.classifier.classify(pkbs)
+        for pkb in arp_pkbs:
+            assert pkb.indev != None
+            self.arp_cache_manager.arp_recv(pkb.indev, pkb)
+        if len(ip_pkbs) != 0:
+            self.ip.ip_recv_batch(ip_pkbs, validated=True)
+
+    def run_vector(self) -> None:
+        queue = self.rcvd_pkb_queue
+        while True:
+            pkbs = [queue.get()] # 阻塞等待第一个报文, 然后取走队列中已有的报文
+            try:
+                while len(pkbs) < self.vector_size:
+                    pkbs.append(queue.get_nowait())
+            except Empty:
+                pass
+            self.process_batch(pkbs)
+
     def run(self) -> None:
+        if self.pipeline != None:
+            self.pipeline.start() # 由流水线的接收线程代替netdev_manager读取网卡
+            return
+        if self.netdev_manager.busy_poll != None:
+            # 忙轮询: 在本线程中轮询网卡并处理报文, 不启动netdev_manager的接收线程
+            self.netdev_manager.busy_poll_loop(self.process_batch)
+            return
         self.netdev_manager.start()
+        if self.vector_size > 1:
+            self.run_vector()
+            return
         while True:
             pkb = self.rcvd_pkb_queue.get()
             indev = pkb.indev
@@ -12,6 +12,13 @@ class ICMP_TYPE(Enum):
     DESTUNREACH = 3
     ECHOREQ = 8
 
+class ICMP_UNREACH_CODE(Enum):
+    NET = 0
+    HOST = 1
+    PROTO = 2
+    PORT = 3
+    FRAG_NEEDED = 4
+
 class ICMPDesc(object):
     def __init__(self, cb: Callable[['IP', 'ICMPDesc', Packetbuffer, Logger], None], error_code: int, info: str) -> None:
         self.cb = cb
@@ -20,6 +27,7 @@ class ICMPDesc(object):
 
 class ICMPHdr(object):
     ICMP_HDR_SZIE = 8 + 8 + 16 + 32
+    ICMP_DEFAULT_TTL = 64
 
     def __init__(self, type: ICMP_TYPE, code: int, checksum: int, data: bytes) -> None:
         self.type = type
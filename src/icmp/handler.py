@@ -1,6 +1,8 @@
+import struct
 from ..ip import IPHdr
+from ..checksum import csum_replace2
 from typing import Callable, Dict, Union, TYPE_CHECKING
-from . import ICMP_TYPE, ICMPDesc, ICMPHdr
+from . import ICMP_TYPE, ICMP_UNREACH_CODE, ICMPDesc, ICMPHdr
 from ..pkb import Packetbuffer
 from ..eth import EtherHdr, MacAddressType
 from logging import Logger
@@ -33,27 +35,34 @@ def icmp_cb_reply(ip: 'IP', handler: ICMPDesc, pkb: Packetbuffer, logger: Logger
 @ICMPHandler.register_handler(ICMP_TYPE.ECHOREQ, 1, "Destination Unreachable")
 def icmp_cb_request(ip: 'IP', handler: ICMPDesc, pkb: Packetbuffer, logger: Logger) -> None:
     logger.debug("icmp request")
-    eth_hdr = EtherHdr.from_bytes(pkb.data)
-    assert eth_hdr is not None
-    ip_hdr = IPHdr.from_bytes(eth_hdr.data)
-    if ip_hdr == None:
+    data = bytearray(pkb.data)
+    ip_off = EtherHdr.ETH_HDR_SIZE
+    icmp = ip_off + (data[ip_off] & 0x0f) * 4
+    if data[icmp + 1] != 0:
+        logger.warning("code of icmp echo&reply must be 0") 
         return
 
-    icmp_hdr = ICMPHdr.from_bytes(ip_hdr.data)
-    if icmp_hdr == None:
-        return
+    # 直接在请求报文上修改, 校验和增量更新(RFC 1624), 和数据的长度无关:
+    # 1. 交换源地址和目的地址, 反码和不变, ip头部的校验和不需要修改
+    # 2. ttl改为默认值, 更新ip头部的校验和
+    # 3. 类型改为echo reply, 更新icmp的校验和
+    src = ip_off + IPHdr.SRC_ADDR_OFFSET
+    dst = ip_off + IPHdr.DST_ADDR_OFFSET
+    data[src:src + 4], data[dst:dst + 4] = data[dst:dst + 4], data[src:src + 4]
 
-    if icmp_hdr.code != 0:
-        logger.warning("code of icmp echo&reply must be 0") 
-        return
+    ttl = ip_off + IPHdr.TTL_OFFSET
+    old_word = data[ttl] << 8 | data[ttl + 1]
+    data[ttl] = ICMPHdr.ICMP_DEFAULT_TTL
+    cksum = int.from_bytes(data[ip_off + IPHdr.CKSUM_OFFSET:ip_off + IPHdr.CKSUM_OFFSET + 2], "big")
+    struct.pack_into("!H", data, ip_off + IPHdr.CKSUM_OFFSET, csum_replace2(cksum, old_word, data[ttl] << 8 | data[ttl + 1]))
 
-    icmp_hdr.type = ICMP_TYPE.ECHORLY
-    ip_hdr.dst_ipaddr = ip_hdr.src_ipaddr
-    ip_hdr.data = icmp_hdr.to_bytes()
-    data = ip_hdr.to_bytes()
-    pkb.data = pkb.data[:EtherHdr.ETH_HDR_SIZE] + data
-    ip_hdr = IPHdr.from_bytes(data)
+    old_word = data[icmp] << 8 | data[icmp + 1]
+    data[icmp] = ICMP_TYPE.ECHORLY.value
+    cksum = int.from_bytes(data[icmp + 2:icmp + 4], "big")
+    struct.pack_into("!H", data, icmp + 2, csum_replace2(cksum, old_word, data[icmp] << 8 | data[icmp + 1]))
+    pkb.data = bytes(data)
     pkb.rtdst = None
+    pkb.dst_entry = None
     pkb.indev = None
     pkb.mac_type = MacAddressType.NONE
     ip.ip_send_out(pkb)
@@ -61,4 +70,23 @@ def icmp_cb_request(ip: 'IP', handler: ICMPDesc, pkb: Packetbuffer, logger: Logg
 @ICMPHandler.register_handler(ICMP_TYPE.DESTUNREACH, 1, "Echo Request")
 def icmp_cb_dst_unreach(ip: 'IP', handler: ICMPDesc, pkb: Packetbuffer, logger: Logger) -> None:
     logger.debug("icmp dst unreach")
-    pass
+    ip_hdr = IPHdr.from_bytes(pkb.data[EtherHdr.ETH_HDR_SIZE:])
+    if ip_hdr == None:
+        return
+    icmp_hdr = ICMPHdr.from_bytes(ip_hdr.data)
+    if icmp_hdr == None or icmp_hdr.code != ICMP_UNREACH_CODE.FRAG_NEEDED.value:
+        return
+
+    # 差错报文中携带的是我们发出去的报文的ip头部
+    inner_ip_hdr = IPHdr.from_bytes(icmp_hdr.data[4:])
+    if inner_ip_hdr == None or inner_ip_hdr.hdr_len < IPHdr.IP_HDR_SIZE:
+        return
+    if not ip.ether.netdev_manager.local_ip_addr(inner_ip_hdr.src_ipaddr):
+        logger.warning("icmp frag needed: %s is not a local address" % inner_ip_hdr.src_ipaddr)
+        return
+    mtu = int.from_bytes(icmp_hdr.data[2:4], "big") # 下一跳MTU(RFC 1191)
+    if mtu == 0 or mtu >= inner_ip_hdr.total_len:
+        # 老的路由器不会填写下一跳MTU, 根据原报文的长度估计(RFC 1191 section 5)
+        mtu = ip.route_cache_manager.pmtu_cache.next_plateau(inner_ip_hdr.total_len)
+    if ip.route_cache_manager.update_pmtu(int(inner_ip_hdr.dst_ipaddr), mtu):
+        logger.debug("icmp frag needed: pmtu of %s is %d" % (inner_ip_hdr.dst_ipaddr, mtu))
@@ -1,12 +1,12 @@
 from typing import TYPE_CHECKING
 
 from ..logger_manager import Logger
-from ..ip import IPHdr
+from ..ip import IPHdr, IPProtoVer, IPTOS, IPProto
 
 from ..pkb import Packetbuffer
-from ..eth import EtherHdr
+from ..eth import EtherHdr, EtherType, MacAddress
 from .handler import ICMPHandler
-from . import ICMPHdr
+from . import ICMP_TYPE, ICMPHdr
 
 if TYPE_CHECKING:
     from ..ip.ip import IP
@@ -17,6 +17,31 @@ class ICMP(object):
         self.logger = logger_manager.get_logger("icmp")
         self.ip = ip
 
+    def icmp_send(self, type: ICMP_TYPE, code: int, info: int, pkb: Packetbuffer) -> None:
+        """
+        发送ICMP差错报文, pkb是引起差错的报文。
+        差错报文携带原报文的ip头部和前8个字节的数据(RFC 792), info是第二个32位字的内容,
+        比如Fragmentation Needed时的下一跳MTU(RFC 1191)。
+        """
+        ip_hdr = IPHdr.from_bytes(pkb.data[EtherHdr.ETH_HDR_SIZE:])
+        if ip_hdr == None:
+            return
+        # 不对分片中的非第一个分片和ICMP差错报文发送差错报文(RFC 1122)
+        if ip_hdr.frag_off != 0:
+            return
+        if ip_hdr.proto == IPProto.ICMP:
+            icmp_hdr = ICMPHdr.from_bytes(ip_hdr.data)
+            if icmp_hdr == None or icmp_hdr.type not in (ICMP_TYPE.ECHOREQ, ICMP_TYPE.ECHORLY):
+                return
+        orig_data = pkb.data[EtherHdr.ETH_HDR_SIZE:EtherHdr.ETH_HDR_SIZE + ip_hdr.hdr_len + 8]
+        icmp_hdr = ICMPHdr(type, code, 0, info.to_bytes(4, "big") + orig_data)
+        data = icmp_hdr.to_bytes()
+        # 源地址由route_output填为出口网卡的地址
+        out_ip_hdr = IPHdr(IPHdr.IP_HDR_SIZE, IPProtoVer.IPV4, IPTOS.IPIOS_ROUTINE, IPHdr.IP_HDR_SIZE + len(data), 0, False, False, 0, ICMPHdr.ICMP_DEFAULT_TTL, IPProto.ICMP,
+            ip_hdr.dst_ipaddr, ip_hdr.src_ipaddr, b'', data, 0)
+        eth_hdr = EtherHdr(MacAddress(), MacAddress(), EtherType.IP, out_ip_hdr.to_bytes())
+        self.ip.ip_send_out(Packetbuffer(eth_hdr.to_bytes()))
+
     def icmp_recv(self, pkb: Packetbuffer) -> None:
         self.logger.debug("icmp recv")
         ip_hdr = IPHdr.from_bytes(pkb.data[EtherHdr.ETH_HDR_SIZE:])
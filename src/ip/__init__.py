@@ -3,6 +3,7 @@ from ipaddress import IPv4Address, IPv4Network
 import struct
 import socket
 from typing import Union
+from ..checksum import checksum
 
 class IPAddress(IPv4Address):
     def __init__(self, address: object) -> None:
@@ -80,6 +81,12 @@ class IPProto(Enum):
 class IPHdr(object):
 
     IP_HDR_SIZE = 20
+    IP_MAX_HDR_SIZE = 60
+    # 各字段在ip头部中的偏移
+    TTL_OFFSET = 8
+    CKSUM_OFFSET = 10
+    SRC_ADDR_OFFSET = 12
+    DST_ADDR_OFFSET = 16
 
     def __init__(self, hdr_len:int, version: IPProtoVer, tos: IPTOS, total_len: int, id: int, dont_frag: bool, more_frag: bool, frag_off: int, ttl: int, proto: IPProto, src_ipaddr: IPAddress, dst_ipaddr: IPAddress, options: bytes, data: bytes, cksum:int = 0) -> None:
         self.hdr_len = hdr_len
@@ -100,16 +107,7 @@ class IPHdr(object):
     
     @classmethod
     def checksum(cls, data:bytes) -> int:
-        if len(data) < 2:
-            return 0
-        if len(data) % 2 == 1:
-            data += b'\x00'
-        sum = 0
-        for i in range(0, len(data), 2):
-            sum += struct.unpack("!H", data[i:i+2])[0]
-            if sum > 0xffff:
-                sum = (sum & 0xffff) + 1
-        return sum ^ 0xffff
+        return checksum(data)
     
     @classmethod
     def from_bytes(cls, data: bytes) -> Union['IPHdr', None]:
@@ -142,7 +140,7 @@ class IPHdr(object):
         id = struct.pack("!H", self.id)
         dont_frag =  0x40 if self.dont_frag else 0x00
         more_frag = 0x20 if self.more_frag else 0x00
-        frag_off = struct.pack("!H", self.frag_off + (dont_frag << 8) + (more_frag << 8))
+        frag_off = struct.pack("!H", (self.frag_off >> 3) + (dont_frag << 8) + (more_frag << 8))
         ttl = struct.pack("!B", self.ttl)
         proto = struct.pack("!B", self.proto.value)
         checksum = b"\x00\x00"
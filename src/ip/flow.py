@@ -0,0 +1,69 @@
+from typing import Any, Dict, Tuple, Union, TYPE_CHECKING
+from ..eth import EtherHdr
+from . import IPHdr, IPProto
+if TYPE_CHECKING:
+    from ..netdev.dev import NetDevice
+    from .route import RouteEntry
+
+"""
+转发流表: (入网卡, proto, src+dst, 端口) -> FlowEntry(出网卡, 二层头部, 路由, MTU)
+
+慢路径(ip_forward)转发成功以后, 把查路由和arp的结果缓存下来。同一条流后续的报文在ip_recv一开始
+就能命中流表, 只需要校验ip头部, 修改ttl和校验和, 加上二层头部以后直接写到出网卡。
+
+流表不逐条删除表项, 和目的地址缓存一样通过generation判断是否失效:
+  route_generation: 路由表(包括路径MTU)的变化, 即dst_cache.generation
+  arp_generation:   arp表的变化, 即arp_cache.generation
+只缓存没有ip选项的报文, 这样所有字段的偏移都是固定的。
+"""
+
+FlowKey = Tuple[Any, int, bytes, bytes]
+
+class FlowEntry(object):
+    def __init__(self, outdev: 'NetDevice', l2hdr: bytes, route: 'RouteEntry', mtu: int, route_generation: int, arp_generation: int) -> None:
+        self.outdev = outdev
+        self.l2hdr = l2hdr
+        self.route = route
+        self.mtu = mtu
+        self.route_generation = route_generation
+        self.arp_generation = arp_generation
+
+class FlowCache(object):
+    MAX_FLOW_CACHE_SIZE = 65536
+
+    def __init__(self) -> None:
+        self.entries: Dict[FlowKey, FlowEntry] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @staticmethod
+    def flow_key(indev: 'NetDevice', data: bytes) -> Union[FlowKey, None]:
+        ip = EtherHdr.ETH_HDR_SIZE
+        if len(data) < ip + IPHdr.IP_HDR_SIZE or data[ip] != 0x45: # ipv4, 没有选项
+            return None
+        proto = data[ip + 9]
+        ports = b""
+        # 分片报文只有第一个分片带端口号, 和多路径选路一样只用三元组
+        if (proto == IPProto.TCP.value or proto == IPProto.UDP.value) and \
+            (data[ip + 6] & 0x3f) == 0 and data[ip + 7] == 0:
+            ports = data[ip + IPHdr.IP_HDR_SIZE:ip + IPHdr.IP_HDR_SIZE + 4]
+        return (indev, proto, data[ip + IPHdr.SRC_ADDR_OFFSET:ip + IPHdr.DST_ADDR_OFFSET + 4], ports)
+
+    def lookup(self, key: FlowKey, route_generation: int, arp_generation: int) -> Union[FlowEntry, None]:
+        entry = self.entries.get(key)
+        if entry is None or entry.route_generation != route_generation or entry.arp_generation != arp_generation:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def insert(self, key: FlowKey, entry: FlowEntry) -> None:
+        if len(self.entries) >= self.MAX_FLOW_CACHE_SIZE:
+            self.entries = {}
+        self.entries[key] = entry
+
+    def invalidate(self) -> None:
+        self.entries = {}
+
+    def show(self) -> None:
+        print("flows: %d, hits: %d, misses: %d" % (len(self.entries), self.hits, self.misses))
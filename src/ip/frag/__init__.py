@@ -1,5 +1,6 @@
+from bisect import bisect_right
 from .. import IPAddress
-from typing import List, Union
+from typing import List, Tuple, Union
 from .. import IPProto, IPHdr
 from ...eth import EtherHdr, EtherType
 from ...pkb import Packetbuffer
@@ -11,9 +12,28 @@ class FragFlags():
     LAST_IN = 0x0004
     FL_IN = FIRST_IN & LAST_IN
 
+class FragResult():
+    OK = 0
+    DUPLICATE = 1 # 重复的分片, 丢弃该分片
+    INVALID = 2   # 重叠或者长度不合法的分片, 整个报文都要丢弃
+
+"""
+分片重组(RFC 815):
+  分片的数据直接拷贝到报文缓冲区buf中对应偏移的位置, holes记录还没有收到的数据区间[first, last),
+  初始时只有一个空洞[0, INFINITY), 收到最后一个分片以后, 报文长度确定, 最后一个空洞被截断。
+  holes为空时表示报文收齐了。
+
+  holes按first排序, 插入分片时二分查找分片起始位置所在的空洞:
+    1. 分片完全落在一个空洞内: 拷贝数据, 把空洞拆成前后两个(可能为空的)空洞
+    2. 分片和任何空洞都不相交: 重复的分片, 直接丢弃
+    3. 其他情况是和已经收到的数据部分重叠, 和linux一样丢弃整个报文
+"""
+
 class IPFrag(object):
 
     MAX_FRAG_TTL = 30
+    INFINITY = 0xffff + 1
+    FRAG_OVERHEAD = 256 # 每个分片额外计算的内存, 防止大量很小的分片绕过内存限制
 
     def __init__(self, id: int, src_ipaddr: IPAddress, dst_ipaddr: IPAddress, proto: IPProto, ttl: int, logger_manager: Logger) -> None:
         self.id = id
@@ -22,42 +42,112 @@ class IPFrag(object):
         self.proto = proto
         self.ttl = ttl
         self.hlen: int = 0
-        self.size: int = 0 # 整个ip报文重组后的的大小，若收到最后一个人报文，则可以计算出整个报文的大小
-        self.rszie: int = 0 # 表示收到的报文的大小，每次收到一个报文，则累加该报文的大小
+        self.size: int = 0 # 整个ip报文重组后的数据大小，收到最后一个分片后才能确定
         self.flags: int = 0
-        self.pkb_list: List[Packetbuffer] = []
+        self.header: bytes = b"" # 第一个分片的以太网头部和ip头部, 重组后的报文使用它
+        self.buf = bytearray()
+        self.holes: List[Tuple[int, int]] = [(0, self.INFINITY)]
+        self.nfrags: int = 0
         self.logger_manager = logger_manager
         self.logger = self.logger_manager.get_logger("ip")
-    
+
     def is_complete(self) -> bool:
         return self.flags & FragFlags.COMPLETE == FragFlags.COMPLETE
-    
+
+    def insert(self, pkb: Packetbuffer, ip_hdr: IPHdr) -> int:
+        start = ip_hdr.frag_off
+        end = start + ip_hdr.total_len - ip_hdr.hdr_len
+        if end > self.INFINITY - IPHdr.IP_HDR_SIZE:
+            return FragResult.INVALID
+        last_in = False
+        if ip_hdr.more_frag == False:
+            # 最后一个分片确定了报文的长度
+            if self.flags & FragFlags.LAST_IN:
+                if end != self.size:
+                    return FragResult.INVALID
+            elif len(self.buf) > end:
+                return FragResult.INVALID # 已经收到了超过报文末尾的数据
+            else:
+                self._set_last(end)
+                last_in = True
+        elif (end - start) % 8 != 0 or end == start:
+            return FragResult.INVALID # 非最后一个分片的长度必须是8的倍数
+        elif self.flags & FragFlags.LAST_IN and end > self.size:
+            return FragResult.INVALID
+
+        if start == end:
+            return FragResult.OK if last_in else FragResult.DUPLICATE
+        holes = self.holes
+        i = bisect_right(holes, (start, self.INFINITY)) - 1
+        if i < 0 or holes[i][1] <= start:
+            # 起始位置不在空洞内, 和下一个空洞相交就是部分重叠, 否则就是重复的分片
+            if i + 1 < len(holes) and holes[i + 1][0] < end:
+                return FragResult.INVALID
+            return FragResult.OK if last_in else FragResult.DUPLICATE
+        first, last = holes[i]
+        if end > last:
+            return FragResult.INVALID
+
+        if start == 0:
+            self.flags |= FragFlags.FIRST_IN
+            self.hlen = ip_hdr.hdr_len
+            self.header = bytes(pkb.data[:EtherHdr.ETH_HDR_SIZE + ip_hdr.hdr_len])
+        if len(self.buf) < end:
+            self.buf.extend(bytes(end - len(self.buf)))
+        self.buf[start:end] = ip_hdr.data[:end - start]
+
+        new_holes = []
+        if first < start:
+            new_holes.append((first, start))
+        if end < last:
+            new_holes.append((end, last))
+        holes[i:i + 1] = new_holes
+        self.nfrags += 1
+        if len(holes) == 0:
+            self.flags |= FragFlags.COMPLETE
+        return FragResult.OK
+
+    def mem(self) -> int:
+        return len(self.buf) + len(self.header) + self.nfrags * self.FRAG_OVERHEAD
+
+    def _set_last(self, end: int) -> None:
+        # 截断最后一个空洞[first, INFINITY)
+        self.flags |= FragFlags.LAST_IN
+        self.size = end
+        if len(self.buf) < end: # 报文长度确定以后一次分配好缓冲区
+            self.buf.extend(bytes(end - len(self.buf)))
+        first, _ = self.holes[-1]
+        if first < end:
+            self.holes[-1] = (first, end)
+        else:
+            self.holes.pop()
+        if len(self.holes) == 0:
+            self.flags |= FragFlags.COMPLETE
+
     # 分片报文重组
-    def reassemble(self) -> Union[Packetbuffer, None]:
+    def reassemble(self, pkb: Packetbuffer) -> Union[Packetbuffer, None]:
         if not self.is_complete():
             self.logger.debug("Fragment is not complete, drop it")
             return None
-        
+
         total_len = self.hlen + self.size
         if total_len > 65535:
             self.logger.warning("Fragment is too large, drop it")
             return None
-        
-        frist_pkb = self.pkb_list[0]
-        pkb = Packetbuffer(frist_pkb.data)
-        for p in self.pkb_list[1:]:
-            pkb.data += p.data[(EtherHdr.ETH_HDR_SIZE + self.hlen):]
-        pkb.protocol = EtherType.IP
-        ip_hdr = IPHdr.from_bytes(pkb.data[EtherHdr.ETH_HDR_SIZE:])
-        if ip_hdr == None:
-            return None
-        ip_hdr.total_len = total_len
-        ip_hdr.hdr_len = self.hlen
-        ip_hdr.frag_off = 0
-        ip_hdr.more_frag = False
-        ip_hdr.dont_frag = True
-        ip_hdr.frag_off = 0
-        ip_hdr.id = 0
-        data = ip_hdr.to_bytes()
-        pkb.data = pkb.data[:EtherHdr.ETH_HDR_SIZE] + data
-        return pkb
\ No newline at end of file
+
+        # 使用第一个分片的头部, 修改总长度和分片字段后重新计算校验和
+        header = bytearray(self.header)
+        ip = EtherHdr.ETH_HDR_SIZE
+        header[ip + 2:ip + 4] = total_len.to_bytes(2, "big")
+        header[ip + 6:ip + 8] = b"\x00\x00"
+        header[ip + IPHdr.CKSUM_OFFSET:ip + IPHdr.CKSUM_OFFSET + 2] = b"\x00\x00"
+        cksum = IPHdr.checksum(bytes(header[ip:]))
+        header[ip + IPHdr.CKSUM_OFFSET:ip + IPHdr.CKSUM_OFFSET + 2] = cksum.to_bytes(2, "big")
+
+        new_pkb = Packetbuffer(bytes(header) + self.buf)
+        new_pkb.protocol = EtherType.IP
+        new_pkb.mac_type = pkb.mac_type
+        new_pkb.indev = pkb.indev
+        new_pkb.rtdst = pkb.rtdst
+        new_pkb.dst_entry = pkb.dst_entry
+        return new_pkb
@@ -1,122 +1,153 @@
 from ...logger_manager import Logger
 from . import IPFrag, IPHdr
-from typing import List, Union
+from typing import Dict, Tuple, Union
 from threading import Lock
-from ..ip import IPAddress
-from . import FragFlags
-from .. import IPProto
-from ...eth import EtherHdr
+from . import FragFlags, FragResult
 from ...pkb import Packetbuffer
 from ...timer.timer import ReapeatingTimer
 
+class IPFragStats(object):
+    def __init__(self) -> None:
+        self.reasm_reqds = 0  # 收到的分片数
+        self.reasm_oks = 0    # 重组成功的报文数
+        self.reasm_fails = 0  # 重组失败的报文数(重叠, 超时, 被淘汰, 超过限制)
+        self.duplicates = 0   # 重复的分片数
+        self.timeouts = 0     # 超时的报文数
+        self.evictions = 0    # 内存超过高水位时被淘汰的报文数
+        self.src_limits = 0   # 超过单个源地址的报文数限制而丢弃的分片数
+
 class IPFragCache(object):
+    """
+    内存限制和linux的ipfrag_high_thresh/ipfrag_low_thresh一样:
+    所有未完成报文占用的内存超过HIGH_THRESH时, 从最老的报文开始淘汰, 直到低于LOW_THRESH。
+    dict保持插入顺序, 最先插入的就是最老的报文。
+    """
+    HIGH_THRESH = 4 * 1024 * 1024
+    LOW_THRESH = 3 * 1024 * 1024
+    MAX_DATAGRAMS_PER_SRC = 64
 
     def __init__(self, logger_manager: Logger) -> None:
+        self.logger_manager = logger_manager
         self.logger = logger_manager.get_logger("ip")
-        self.ipv4_frag_list: List[IPFrag] = []
-        self.ipv4_frag_list_lock: Lock = Lock()
+        # (id, proto, src, dst) -> IPFrag
+        self.ipv4_frags: Dict[Tuple[int, int, int, int], IPFrag] = {}
+        self.ipv4_frags_lock: Lock = Lock()
+        self.mem: int = 0
+        self.src_count: Dict[int, int] = {} # 每个源地址未完成的报文数
+        self.stats = IPFragStats()
         self.frag_timer = ReapeatingTimer(1, self.timer)
         self.frag_timer.start()
 
-    def lookup(self, id: int, proto: IPProto, src_ipaddr: IPAddress, dst_ipaddr: IPAddress) -> Union[IPFrag, None]:
-        with self.ipv4_frag_list_lock:
-            for frag in self.ipv4_frag_list:
-                if frag.id == id and frag.proto == proto and frag.src_ipaddr == src_ipaddr and frag.dst_ipaddr == dst_ipaddr:
-                    return frag
-            return None
+    @staticmethod
+    def frag_key(ip_hdr: IPHdr) -> Tuple[int, int, int, int]:
+        return (ip_hdr.id, ip_hdr.proto.value, int(ip_hdr.src_ipaddr), int(ip_hdr.dst_ipaddr))
+
+    def lookup(self, ip_hdr: IPHdr) -> Union[IPFrag, None]:
+        return self.ipv4_frags.get(self.frag_key(ip_hdr))
 
-    def new_fragment(self, pkb: Packetbuffer) -> IPFrag:
-        with self.ipv4_frag_list_lock:
-            ip_hdr = IPHdr.from_bytes(pkb.data[EtherHdr.ETH_HDR_SIZE:])
-            assert ip_hdr != None
-            frag_id = ip_hdr.id
-            frag_src = ip_hdr.src_ipaddr
-            frag_dst = ip_hdr.dst_ipaddr
-            frag_pro = ip_hdr.proto
-            ttl = IPFrag.MAX_FRAG_TTL
+    def new_fragment(self, ip_hdr: IPHdr) -> Union[IPFrag, None]:
+        with self.ipv4_frags_lock:
+            return self._new_fragment(self.frag_key(ip_hdr), ip_hdr)
 
-            frag = IPFrag(frag_id, frag_src, frag_dst, frag_pro, ttl, self.logger_manager)
-            self.ipv4_frag_list.append(frag)
-            return frag
+    def _new_fragment(self, key: Tuple[int, int, int, int], ip_hdr: IPHdr) -> Union[IPFrag, None]:
+        # 调用者持有ipv4_frags_lock
+        frag = self.ipv4_frags.get(key)
+        if frag is None:
+            src = key[2]
+            if self.src_count.get(src, 0) >= self.MAX_DATAGRAMS_PER_SRC:
+                self.stats.src_limits += 1
+                self.logger.debug("Too many fragmented datagrams from %s, drop it" % ip_hdr.src_ipaddr)
+                return None
+            frag = IPFrag(ip_hdr.id, ip_hdr.src_ipaddr, ip_hdr.dst_ipaddr, ip_hdr.proto, IPFrag.MAX_FRAG_TTL, self.logger_manager)
+            self.ipv4_frags[key] = frag
+            self.src_count[src] = self.src_count.get(src, 0) + 1
+        return frag
 
-    # 收集分片报文
-    def insert_fragment(self, pkb: Packetbuffer, frag: IPFrag) -> bool:
-        with self.ipv4_frag_list_lock:
+    # 收集分片报文, 分片收齐了时返回重组用的IPFrag(不一定是传入的frag), 否则返回None
+    def insert_fragment(self, pkb: Packetbuffer, ip_hdr: IPHdr, frag: IPFrag) -> Union[IPFrag, None]:
+        with self.ipv4_frags_lock:
+            self.stats.reasm_reqds += 1
+            # frag是在锁外查到的, 这期间可能已经被定时器或者_evict移出了缓存, 这时它占用的内存不再计入mem,
+            # 不能再往里面插入, 重新查找或者创建
+            key = self.frag_key(ip_hdr)
+            if self.ipv4_frags.get(key) is not frag:
+                new_frag = self._new_fragment(key, ip_hdr)
+                if new_frag is None:
+                    return None
+                frag = new_frag
             if frag.is_complete():
                 self.logger.debug("Fragment is complete, this is retransmission packet, drop it")
-                return False
-
-            ip_hdr = IPHdr.from_bytes(pkb.data[EtherHdr.ETH_HDR_SIZE:])
-            assert ip_hdr != None
-
-            index = -1
-            if ip_hdr.more_frag == False: # 表示最后一个分片
-                if frag.flags & FragFlags.LAST_IN: # 表示重传了最后一个分片
-                    self.logger.debug("Fragment is duplicate, this is retransmission packet, drop it") # 
-                    return False
-                frag.flags |= FragFlags.LAST_IN
-                frag.size = ip_hdr.frag_off + ip_hdr.total_len - ip_hdr.hdr_len
-                index = len(frag.pkb_list)
-                
-            else:
-                index = len(frag.pkb_list)# 从最大开始找该报文的插入位置，如果该报文最大，就插入到最后一个位置
-                next_pkb_ip_hdr :Union[IPHdr, None] = None
-                for tmp_pkb in reversed(frag.pkb_list):
-                    tmp_pkb_ip_hdr = IPHdr.from_bytes(tmp_pkb.data[EtherHdr.ETH_HDR_SIZE:])
-                    assert tmp_pkb_ip_hdr != None
-                    if tmp_pkb_ip_hdr.frag_off == ip_hdr.frag_off:
-                        self.logger.debug("Fragment is duplicate, this is retransmission packet, drop it")
-                        return False
-                    """
-                        <----------------------------|
-                    [0]  [X]  [200]  [300]  [400]  [500]
-                    find X = 100 < 200, insert [100] before [200]
-                    """
-                    if tmp_pkb_ip_hdr.frag_off < ip_hdr.frag_off:
-                        index = frag.pkb_list.index(tmp_pkb) + 1
-                        next_pkb_ip_hdr = tmp_pkb_ip_hdr
-                        break
-                # 要求每个报文的报文头部都是相同长度的
-                if frag.hlen != 0 and frag.hlen != ip_hdr.hdr_len:
-                    self.logger.warning("Fragment header length is not equal, drop it")
-                    return False
-                else:
-                    frag.hlen = ip_hdr.hdr_len
-                
-                # 要求上一个分片报文的偏移 + 上一个报文的data长度 <= 收到的报文的偏移: 
-                # 100 + len([100].data) <= 200. 小于表示中间还有分片没有收到，等于表示[100]和[200]之间没有分片了
-                if next_pkb_ip_hdr and next_pkb_ip_hdr.frag_off + next_pkb_ip_hdr.total_len - next_pkb_ip_hdr.hdr_len > ip_hdr.frag_off:
-                    self.logger.warning("Fragment is overlap, drop it")
-                    return False
+                self.stats.duplicates += 1
+                return None
 
-                # 第一个分片报文
-                if ip_hdr.frag_off == 0:
-                    frag.flags |= FragFlags.FIRST_IN
+            mem = frag.mem()
+            result = frag.insert(pkb, ip_hdr)
+            self.mem += frag.mem() - mem
+            if result == FragResult.DUPLICATE:
+                self.logger.debug("Fragment is duplicate, this is retransmission packet, drop it")
+                self.stats.duplicates += 1
+                return None
+            if result == FragResult.INVALID:
+                self.logger.warning("Fragment is overlap or invalid, drop the datagram")
+                self._unlink(key, frag)
+                self.stats.reasm_fails += 1
+                return None
 
-            frag.pkb_list.insert(index, pkb)   
-            frag.rszie += ip_hdr.total_len - ip_hdr.hdr_len
-            self.logger.debug("flag: first in: %s, last in: %s, frag_size:%d, frag_rsize:%d", 
+            self.logger.debug("flag: first in: %s, last in: %s, frag_size:%d, holes:%d",
                         "true" if frag.flags & FragFlags.FIRST_IN else "false",
                         "true" if frag.flags & FragFlags.LAST_IN else "false",
-                        frag.size, frag.rszie)
-            # 表示分片收齐了
-            if frag.flags & FragFlags.FIRST_IN and frag.flags & FragFlags.LAST_IN and frag.rszie == frag.size:
-                frag.flags |= FragFlags.COMPLETE
-                return True
-            
-            return False
+                        frag.size, len(frag.holes))
+            if frag.is_complete():
+                self.stats.reasm_oks += 1
+                return frag
+            if self.mem > self.HIGH_THRESH:
+                self._evict()
+            return None
+
+    def _unlink(self, key: Tuple[int, int, int, int], frag: IPFrag) -> None:
+        # 调用者持有ipv4_frags_lock
+        if self.ipv4_frags.get(key) is not frag:
+            return
+        del self.ipv4_frags[key]
+        self.mem -= frag.mem()
+        src = key[2]
+        count = self.src_count.get(src, 0) - 1
+        if count > 0:
+            self.src_count[src] = count
+        else:
+            self.src_count.pop(src, None)
+
+    def _evict(self) -> None:
+        for key, frag in list(self.ipv4_frags.items()):
+            if self.mem <= self.LOW_THRESH:
+                break
+            if frag.flags & FragFlags.COMPLETE:
+                continue
+            self._unlink(key, frag)
+            self.stats.evictions += 1
+            self.stats.reasm_fails += 1
+        self.logger.debug("Fragment cache over high threshold, evicted to %d bytes" % self.mem)
 
     def remove_fragment(self, frag: IPFrag):
-        with self.ipv4_frag_list_lock:
-            self.ipv4_frag_list.remove(frag)
+        with self.ipv4_frags_lock:
+            self._unlink((frag.id, frag.proto.value, int(frag.src_ipaddr), int(frag.dst_ipaddr)), frag)
 
     def timer(self, delta: int = 1):
-        with self.ipv4_frag_list_lock:
-            for frag in self.ipv4_frag_list:
+        with self.ipv4_frags_lock:
+            for key, frag in list(self.ipv4_frags.items()):
                 if frag.flags & FragFlags.COMPLETE:
                     continue
                 frag.ttl -= delta
                 if frag.ttl <= 0:
-                    self.ipv4_frag_list.remove(frag)
+                    self._unlink(key, frag)
+                    self.stats.timeouts += 1
+                    self.stats.reasm_fails += 1
                     # TODO: icmp time exceeded
-                    self.logger.debug("Fragment timeout, drop it")
\ No newline at end of file
+                    self.logger.debug("Fragment timeout, drop it")
+
+    def show(self) -> None:
+        stats = self.stats
+        print("datagrams: %d, memory: %d (high %d, low %d)" % (len(self.ipv4_frags), self.mem, self.HIGH_THRESH, self.LOW_THRESH))
+        print("%-12s%-12s%-12s%-12s%-12s%-12s%-12s" % ("ReasmReqds", "ReasmOKs", "ReasmFails", "Duplicates", "Timeouts", "Evictions", "SrcLimits"))
+        print("%-12d%-12d%-12d%-12d%-12d%-12d%-12d" % (stats.reasm_reqds, stats.reasm_oks, stats.reasm_fails,
+            stats.duplicates, stats.timeouts, stats.evictions, stats.src_limits))
@@ -1,19 +1,22 @@
-from typing import Union, TYPE_CHECKING
+from typing import Dict, List, Tuple, Union, TYPE_CHECKING
+import struct
 from . import IPAddress
-from copy import deepcopy
 
+from ..icmp import ICMP_TYPE, ICMP_UNREACH_CODE
 from ..icmp.icmp import ICMP
 from .frag.cache import IPFragCache
-from .route import RouteFlags
+from .flow import FlowCache, FlowEntry
+from .route import RouteEntry, RouteFlags
 from .route.cache import RouteCacheManager
 from ..eth import MacAddress, MacAddressType, EtherHdr, EtherType
 from ..netdev.dev import NetDevice
 from ..pkb import Packetbuffer
-from ..ip import IPHdr, IPProto
+from ..ip import IPHdr, IPProto, IPProtoVer
 from ..arp.entry import ArpEntry, ArpEntryState
 from ..arp.cache_manager import ArpCacheManager
 from ..tcp.tcp import TCP
 from ..logger_manager import Logger
+from ..checksum import checksum, csum_replace2
 from logging import DEBUG
 
 if TYPE_CHECKING:
@@ -24,6 +27,7 @@ class IP(object):
     def __init__(self, ether: 'EthernetThread', arp_cache_manager: ArpCacheManager, route_cache_manager: RouteCacheManager, logger_manager: Logger) -> None:
         self.logger = logger_manager.get_logger("ip")
         self.frag_cache = IPFragCache(logger_manager)
+        self.flow_cache = FlowCache()
         self.ether = ether
         self.arp_cache_manager = arp_cache_manager
         self.route_cache_manager = route_cache_manager
@@ -36,37 +40,11 @@ class IP(object):
         if pkb.mac_type == MacAddressType.OTHERHOST:
             self.logger.warning("ip_recv: to other host")
             return
-        
-        if len(pkb.data) < EtherHdr.ETH_HDR_SIZE + IPHdr.IP_HDR_SIZE:
-            self.logger.warning("ip_recv: packet too short")
-            return
 
-        ether_hdr = EtherHdr.from_bytes(pkb.data)
-        if ether_hdr == None:
-            self.logger.warning("ip_recv: ether_hdr error")
+        if self.ip_forward_fast(netdev, pkb): # 命中转发流表
             return
 
-        ip_hdr = IPHdr.from_bytes(ether_hdr.data)
-        if ip_hdr == None:
-            self.logger.warning("ip_recv: ip_hdr error")
-            return
-        
-        if ip_hdr.hdr_len < IPHdr.IP_HDR_SIZE:
-            self.logger.warning("ip_recv: invalid ip header length")
-            return
-        
-        # ipv4 header checksum check
-        if IPHdr.checksum(ether_hdr.data[:ip_hdr.hdr_len]) != 0:
-            self.logger.warning("ip_recv: invalid checksum")
-            return
-        
-        if ip_hdr.total_len < ip_hdr.hdr_len or \
-            len(pkb.data) < EtherHdr.ETH_HDR_SIZE + ip_hdr.total_len:
-            self.logger.warning("ip_recv: invalid total length")
-            return
-        
-        if len(pkb.data) > EtherHdr.ETH_HDR_SIZE + ip_hdr.total_len:
-            self.logger.warning("ip_recv: packet too long")
+        if not self.ip_validate(pkb):
             return
 
         if self.route_cache_manager.route_input(pkb) == False: # route entry not found
@@ -79,6 +57,89 @@ class IP(object):
         else:
             self.ip_forward(pkb)
 
+    def ip_recv_batch(self, pkbs: List[Packetbuffer], validated: bool = False) -> None:
+        """
+        向量模式(参考VPP): 一批报文作为一个列表依次经过每个处理阶段,
+        每个阶段的函数调用和属性查找的开销由整批报文分摊。
+            1. 转发流表: 命中的报文按出网卡分组, 每个网卡一次突发发送
+            2. ip头部校验
+            3. 查路由
+            4. 本地接收或者转发(慢路径), BatchClassifier填写了tcp四元组的本地报文按流分组交给tcp
+        validated为True表示报文已经通过了ip头部检查(比如BatchClassifier), 跳过第2步和快速路径中的校验和检查。
+        """
+        pkbs = [pkb for pkb in pkbs if pkb.mac_type != MacAddressType.OTHERHOST]
+
+        tx_bursts: Dict[NetDevice, List[List[Union[bytes, memoryview]]]] = {}
+        forward_fast = self.ip_forward_fast
+        pkbs = [pkb for pkb in pkbs if not forward_fast(pkb.indev, pkb, tx_bursts, validated)] # type: ignore
+        # 先发送快速路径的报文, 同一条流的报文不会乱序(流表只会在慢路径中插入)
+        for dev, frames in tx_bursts.items():
+            dev.send_burst(frames)
+
+        if not validated:
+            validate = self.ip_validate
+            pkbs = [pkb for pkb in pkbs if validate(pkb)]
+
+        route_input = self.route_cache_manager.route_input
+        local_pkbs: List[Packetbuffer] = []
+        forward_pkbs: List[Packetbuffer] = []
+        for pkb in pkbs:
+            if not route_input(pkb):
+                self.logger.warning("ip_recv: route entry not found")
+                continue
+            assert pkb.rtdst != None
+            if pkb.rtdst.flags == RouteFlags.LOCALHOST:
+                local_pkbs.append(pkb)
+            else:
+                forward_pkbs.append(pkb)
+
+        # 连续的带四元组的tcp报文一起交给tcp, 其他报文按原来的顺序逐个处理, 同一个流的报文不会乱序
+        tcp_pkbs: List[Packetbuffer] = []
+        for pkb in local_pkbs:
+            if pkb.flow != None:
+                self.debug_send_recv(pkb)
+                tcp_pkbs.append(pkb)
+                continue
+            if len(tcp_pkbs) != 0:
+                self.tcp.tcp_recv_batch(tcp_pkbs)
+                tcp_pkbs = []
+            self.ip_recv_local(pkb)
+        if len(tcp_pkbs) != 0:
+            self.tcp.tcp_recv_batch(tcp_pkbs)
+        for pkb in forward_pkbs:
+            self.ip_forward(pkb)
+
+    def ip_validate(self, pkb: Packetbuffer) -> bool:
+        # 直接检查报文中的字段, 不解析整个ip头部
+        data = pkb.data
+        ip = EtherHdr.ETH_HDR_SIZE
+        if len(data) < ip + IPHdr.IP_HDR_SIZE:
+            self.logger.warning("ip_recv: packet too short")
+            return False
+
+        if data[ip] >> 4 != IPProtoVer.IPV4.value:
+            self.logger.warning("ip_recv: ip_hdr error")
+            return False
+
+        hdr_len = (data[ip] & 0x0f) * 4
+        if hdr_len < IPHdr.IP_HDR_SIZE:
+            self.logger.warning("ip_recv: invalid ip header length")
+            return False
+
+        # ipv4 header checksum check
+        if checksum(data[ip:ip + hdr_len]) != 0:
+            self.logger.warning("ip_recv: invalid checksum")
+            return False
+
+        total_len = int.from_bytes(data[ip + 2:ip + 4], "big")
+        if total_len < hdr_len or len(data) < ip + total_len:
+            self.logger.warning("ip_recv: invalid total length")
+            return False
+
+        if len(data) > ip + total_len:
+            self.logger.warning("ip_recv: packet too long")
+            return False
+        return True
 
     def ip_recv_local(self, pkb: Packetbuffer) -> None:
         assert pkb.rtdst != None
@@ -91,7 +152,7 @@ class IP(object):
                 self.logger.warning("ip_recv_local: fragment packet but dont_frag is set")
                 return
         
-            new_pkb = self.ip_reassemble(pkb) # 和之前的ip分片报文们一起组装成一个完整的报文
+            new_pkb = self.ip_reassemble(pkb, ip_hdr) # 和之前的ip分片报文们一起组装成一个完整的报文
             if new_pkb == None:
                 return
             pkb = new_pkb
@@ -100,11 +161,7 @@ class IP(object):
             assert ip_hdr != None
             self.logger.debug("reassemble success")
 
-        # ipv4 header checksum check
-        if IPHdr.checksum(pkb.data[EtherHdr.ETH_HDR_SIZE:EtherHdr.ETH_HDR_SIZE + ip_hdr.hdr_len]) != 0:
-            self.logger.warning("ip_recv: invalid checksum")
-            return
-
+        # 头部校验和已经在ip_validate(或者BatchClassifier)中检查过, 重组后的头部校验和是重新计算的, 这里不再检查
         self.debug_send_recv(pkb)
         if ip_hdr.proto == IPProto.ICMP:
             self.icmp.icmp_recv(pkb)
@@ -121,7 +178,9 @@ class IP(object):
 
 
     def ip_forward(self, pkb:Packetbuffer) -> None:
-        ip_hdr = IPHdr.from_bytes(pkb.data[EtherHdr.ETH_HDR_SIZE:])
+        # 只解析ip头部, 不拷贝数据部分
+        ip = EtherHdr.ETH_HDR_SIZE
+        ip_hdr = IPHdr.from_bytes(pkb.data[ip:ip + IPHdr.IP_MAX_HDR_SIZE])
         assert ip_hdr != None
         route_entry = pkb.rtdst
         assert route_entry != None
@@ -132,7 +191,16 @@ class IP(object):
             # TODO: send icmp time exceeded
             return
 
+        # ttl减1, 增量更新校验和(RFC 1624), ttl和proto在同一个16位字中
+        data = bytearray(pkb.data)
+        old_word = data[ip + IPHdr.TTL_OFFSET] << 8 | data[ip + IPHdr.TTL_OFFSET + 1]
+        data[ip + IPHdr.TTL_OFFSET] -= 1
+        cksum = int.from_bytes(data[ip + IPHdr.CKSUM_OFFSET:ip + IPHdr.CKSUM_OFFSET + 2], "big")
+        struct.pack_into("!H", data, ip + IPHdr.CKSUM_OFFSET, csum_replace2(cksum, old_word, old_word - 0x100))
+        pkb.data = bytes(data)
         ip_hdr.ttl -= 1
+        route_entry.packets += 1
+        route_entry.bytes += ip_hdr.total_len
 
         if route_entry.flags == RouteFlags.DEFAULT or route_entry.metric > 0:
             dst = route_entry.gateway
@@ -180,16 +248,74 @@ class IP(object):
                 self.logger.debug("ip_forward: send icmp redirect")
                 # TODO: send icmp redirect
         
-        if ip_hdr.hdr_len > route_entry.netdev.mtu: # 如果需要分片
+        mtu = self.route_cache_manager.path_mtu(int(ip_hdr.dst_ipaddr), route_entry)
+        if ip_hdr.total_len > mtu: # 如果需要分片
             if ip_hdr.dont_frag == True:
-                # 表示需要支持分片才行
-                self.logger.debug("ip_forward: send icmp fragmentation needed")
-                # TODO: send icmp fragmentation needed
+                # 不允许分片, 通知源主机下一跳的MTU, 源主机据此更新路径MTU(RFC 1191)
+                self.logger.debug("ip_forward: send icmp fragmentation needed, mtu %d" % mtu)
+                self.icmp.icmp_send(ICMP_TYPE.DESTUNREACH, ICMP_UNREACH_CODE.FRAG_NEEDED.value, mtu, pkb)
                 return
-            self.ip_send_fragment(route_entry.netdev, pkb)
+            self.ip_send_fragment(route_entry.netdev, pkb, mtu)
         else: # 如果不需要分片 
+            if netdev != None and netdev != route_entry.netdev:
+                self.ip_flow_insert(pkb, route_entry, mtu)
             self.ip_send_to_dev(route_entry.netdev, pkb)
 
+    def ip_flow_insert(self, pkb: Packetbuffer, route_entry: RouteEntry, mtu: int) -> None:
+        # 下一跳已经解析好时, 把这条流的转发结果加入流表
+        assert pkb.indev != None
+        if pkb.dst_entry == None:
+            return
+        key = FlowCache.flow_key(pkb.indev, pkb.data)
+        if key == None:
+            return
+        arp_generation = self.arp_cache_manager.arp_cache.generation
+        _, arp_entry = self.ip_lookup_neigh(pkb)
+        if arp_entry == None or arp_entry.state != ArpEntryState.RESOLVED or arp_entry.hwaddr == None:
+            return
+        l2hdr = arp_entry.hwaddr.to_bytes() + route_entry.netdev.hwaddr.to_bytes() + EtherType.IP.to_bytes()
+        # 路由的generation使用目的地址缓存表项的, 它和route_input查到的路由是一致的
+        self.flow_cache.insert(key, FlowEntry(route_entry.netdev, l2hdr, route_entry, mtu, pkb.dst_entry.generation, arp_generation))
+
+    def ip_forward_fast(self, netdev: NetDevice, pkb: Packetbuffer,
+        tx_bursts: Union[Dict[NetDevice, List[List[Union[bytes, memoryview]]]], None] = None, validated: bool = False) -> bool:
+        """
+        转发流表的快速路径: 不解析报文, 不查路由和arp表, 只做必要的检查, 然后修改ttl和校验和,
+        加上缓存的二层头部直接写到出网卡。任何检查不通过都返回False, 交给慢路径处理(包括丢弃和记录日志)。
+        向量模式下传入tx_bursts, 报文按出网卡分组, 由调用者统一发送。
+        """
+        data = pkb.data
+        key = FlowCache.flow_key(netdev, data)
+        if key == None:
+            return False
+        entry = self.flow_cache.lookup(key, self.route_cache_manager.dst_cache.generation, self.arp_cache_manager.arp_cache.generation)
+        if entry == None:
+            return False
+        ip = EtherHdr.ETH_HDR_SIZE
+        total_len = int.from_bytes(data[ip + 2:ip + 4], "big")
+        ttl = data[ip + IPHdr.TTL_OFFSET]
+        if total_len != len(data) - ip or total_len > entry.mtu or ttl <= 1:
+            return False
+        hdr = bytearray(data[ip:ip + IPHdr.IP_HDR_SIZE])
+        if not validated and checksum(hdr) != 0:
+            return False
+
+        old_word = ttl << 8 | hdr[IPHdr.TTL_OFFSET + 1]
+        hdr[IPHdr.TTL_OFFSET] = ttl - 1
+        cksum = int.from_bytes(hdr[IPHdr.CKSUM_OFFSET:IPHdr.CKSUM_OFFSET + 2], "big")
+        struct.pack_into("!H", hdr, IPHdr.CKSUM_OFFSET, csum_replace2(cksum, old_word, old_word - 0x100))
+        entry.route.packets += 1
+        entry.route.bytes += total_len
+        iov = [entry.l2hdr, hdr, memoryview(data)[ip + IPHdr.IP_HDR_SIZE:]]
+        if tx_bursts is None:
+            entry.outdev.sendv(iov)
+        else:
+            frames = tx_bursts.get(entry.outdev)
+            if frames is None:
+                frames = tx_bursts[entry.outdev] = []
+            frames.append(iov)
+        return True
+
     def ip_send_out(self, pkb: Packetbuffer) ->None:
         self.logger.debug("ip_send_out")
         ip_hdr = IPHdr.from_bytes(pkb.data[EtherHdr.ETH_HDR_SIZE:])
@@ -199,50 +325,70 @@ class IP(object):
                 self.logger.debug("route not found")
                 return
         assert pkb.rtdst != None # assigned by route_output
-        if ip_hdr.total_len < pkb.rtdst.netdev.mtu:
+        pkb.rtdst.packets += 1
+        pkb.rtdst.bytes += ip_hdr.total_len
+        mtu = self.route_cache_manager.path_mtu(int(ip_hdr.dst_ipaddr), pkb.rtdst)
+        if ip_hdr.total_len <= mtu:
             self.ip_send_to_dev(pkb.rtdst.netdev, pkb)
         else:
-            self.ip_send_fragment(pkb.rtdst.netdev, pkb)
+            self.ip_send_fragment(pkb.rtdst.netdev, pkb, mtu)
 
             
-    def ip_send_fragment(self, netdev:NetDevice, pkb:Packetbuffer) -> None:
+    def ip_send_fragment(self, netdev:NetDevice, pkb:Packetbuffer, mtu: int) -> None:
+        """
+        所有分片共用一个头部模板(以太网头部 + ip头部), 每个分片只修改总长度, 分片偏移/MF和校验和,
+        数据部分是原报文的memoryview切片, 和头部一起通过sendv写到网卡, 不拷贝数据。
+        邻居还没有解析好时, 退回到逐个生成完整的分片报文, 交给ip_send_to_dev缓存到arp表项中。
+        """
         self.logger.debug("ip_send_fragment")
-        ip_hdr = IPHdr.from_bytes(pkb.data[EtherHdr.ETH_HDR_SIZE:])
-        assert ip_hdr != None
-        hdr_len = ip_hdr.hdr_len
-        data_len = ip_hdr.total_len - hdr_len
-        max_len = (netdev.mtu - hdr_len) & ~7
+        ip = EtherHdr.ETH_HDR_SIZE
+        data = memoryview(pkb.data)
+        hdr_len = (data[ip] & 0x0f) * 4
+        total_len = int.from_bytes(data[ip + 2:ip + 4], "big")
+        frag_field = int.from_bytes(data[ip + 6:ip + 8], "big")
+        cksum = int.from_bytes(data[ip + IPHdr.CKSUM_OFFSET:ip + IPHdr.CKSUM_OFFSET + 2], "big")
+        # 转发的报文本身可能就是一个分片, 新分片的偏移在原偏移的基础上累加, 最后一个分片保留原来的MF
+        base_off = (frag_field & 0x1fff) * 8
+        last_mf = frag_field & 0x2000
+        payload = data[ip + hdr_len:ip + total_len]
+        data_len = len(payload)
+        max_len = (mtu - hdr_len) & ~7
         # 当mtu等于1500时, data_len = 1500 - 20 = 1480 (10111001000), 后三位置为0，就是每个分片的最大长度1480（10111001000）
+
+        header = bytearray(data[:ip + hdr_len])
+        arp_entry = None
+        assert pkb.rtdst != None
+        if pkb.rtdst.flags != RouteFlags.LOCALHOST:
+            _, arp_entry = self.ip_lookup_neigh(pkb)
+        fast_path = arp_entry != None and arp_entry.state == ArpEntryState.RESOLVED and arp_entry.hwaddr != None
+        if fast_path:
+            assert arp_entry != None and arp_entry.hwaddr != None
+            header[0:6] = arp_entry.hwaddr.to_bytes()
+            header[6:12] = netdev.hwaddr.to_bytes()
+
         frag_offset = 0
-        while (data_len > max_len):
-            frag_pkb = self.ip_fragment(pkb, ip_hdr, hdr_len, max_len, frag_offset, True)
-            self.ip_send_to_dev(netdev, frag_pkb)
-            data_len -= max_len
-            frag_offset += max_len
-        
-        # 最后一个分片
-        if data_len > 0:
-            frag_pkb = self.ip_fragment(pkb, ip_hdr, hdr_len, max_len, frag_offset, False)
-            self.ip_send_to_dev(netdev, pkb)
-    
-    def ip_fragment(self, pkb: Packetbuffer, ip_hdr: IPHdr, hdr_len: int, frag_data_len: int, frag_offset: int, more_frag: bool):
-        frag_pkb = Packetbuffer()
-        frag_pkb.protocol = pkb.protocol
-        frag_pkb.mac_type = pkb.mac_type
-        frag_pkb.indev = pkb.indev
-        frag_pkb.rtdst = pkb.rtdst
-
-        frag_ip_hdr = deepcopy(ip_hdr)
-        data_start = hdr_len + frag_offset
-        data_end = hdr_len + frag_offset + frag_data_len
-        frag_ip_hdr.data = ip_hdr.data[data_start:data_end]
-        frag_ip_hdr.more_frag = more_frag
-        frag_ip_hdr.dont_frag = False
-        data = frag_ip_hdr.to_bytes()
-        eth_hdr_data = EtherHdr(MacAddress(), MacAddress(), EtherType.IP, b"").to_bytes()
-        frag_pkb.data = eth_hdr_data + data
-        return frag_pkb
-    
+        while frag_offset < data_len:
+            frag_len = min(max_len, data_len - frag_offset)
+            more_frag = 0x2000 if frag_offset + frag_len < data_len else last_mf
+            new_field = more_frag | ((base_off + frag_offset) >> 3)
+            struct.pack_into("!H", header, ip + 2, hdr_len + frag_len)
+            struct.pack_into("!H", header, ip + 6, new_field)
+            # 相对于原报文头部只修改了总长度和分片字段, 增量更新校验和
+            frag_cksum = csum_replace2(csum_replace2(cksum, total_len, hdr_len + frag_len), frag_field, new_field)
+            struct.pack_into("!H", header, ip + IPHdr.CKSUM_OFFSET, frag_cksum)
+            frag_data = payload[frag_offset:frag_offset + frag_len]
+            if fast_path:
+                netdev.sendv([bytes(header), frag_data])
+            else:
+                frag_pkb = Packetbuffer(bytes(header) + frag_data)
+                frag_pkb.protocol = pkb.protocol
+                frag_pkb.mac_type = pkb.mac_type
+                frag_pkb.indev = pkb.indev
+                frag_pkb.rtdst = pkb.rtdst
+                frag_pkb.dst_entry = pkb.dst_entry
+                self.ip_send_to_dev(netdev, frag_pkb)
+            frag_offset += frag_len
+
     def debug_send_recv(self, pkb: Packetbuffer, send: bool = True):
         try:
             if self.logger.level == DEBUG:
@@ -259,14 +405,40 @@ class IP(object):
         except:
             self.logger.warning("debug: %s error" % pkb)
 
+    def ip_lookup_neigh(self, pkb: Packetbuffer) -> Tuple[IPAddress, Union[ArpEntry, None]]:
+        """
+        返回报文的下一跳地址和下一跳的arp表项(可能还在解析中, 也可能不存在)
+        """
+        route_enrty = pkb.rtdst
+        assert route_enrty != None
+        # 目的地址缓存中保存了下一跳和已经解析好的邻居, 命中时不用再查arp表
+        # 多路径路由选出的下一跳和缓存中的路由不是同一个, 不能使用缓存的邻居
+        dst_entry = pkb.dst_entry
+        if dst_entry != None and dst_entry.route is not route_enrty:
+            dst_entry = None
+        arp_entry: Union[ArpEntry, None] = None
+        if dst_entry != None:
+            dst = dst_entry.nexthop
+            arp_entry = dst_entry.neigh
+            if arp_entry != None and (arp_entry.state != ArpEntryState.RESOLVED or arp_entry.ttl <= 0):
+                arp_entry = dst_entry.neigh = None
+        elif route_enrty.gateway != None: # 网关路由
+            dst = route_enrty.gateway
+        else:
+            offset = EtherHdr.ETH_HDR_SIZE + IPHdr.DST_ADDR_OFFSET
+            dst = IPAddress(pkb.data[offset:offset + 4])
+
+        if arp_entry == None:
+            arp_entry = self.arp_cache_manager.arp_cache.lookup_entry(EtherType.IP, dst)
+            if dst_entry != None and arp_entry != None and arp_entry.state == ArpEntryState.RESOLVED:
+                dst_entry.neigh = arp_entry
+        return dst, arp_entry
+
     def ip_send_to_dev(self, netdev: NetDevice, pkb: Packetbuffer) -> None:
         route_enrty = pkb.rtdst
         assert route_enrty != None
-        dst: Union[IPAddress, None] = None
         eth_hdr = EtherHdr.from_bytes(pkb.data)
         assert eth_hdr != None
-        ip_hdr = IPHdr.from_bytes(eth_hdr.data)
-        assert ip_hdr != None
 
         # 环回
         if route_enrty.flags == RouteFlags.LOCALHOST:
@@ -276,16 +448,10 @@ class IP(object):
             pkb.data = eth_hdr.to_bytes()
             self.debug_send_recv(pkb, False)
             netdev.send(pkb)
+            return
 
-        # 默认路由
-        if route_enrty.flags == RouteFlags.DEFAULT and route_enrty.metric > 0:
-            dst = route_enrty.gateway
-        else:
-            dst = ip_hdr.dst_ipaddr
-        assert dst != None
-        
+        dst, arp_entry = self.ip_lookup_neigh(pkb)
         arp_cache_manager = self.arp_cache_manager.arp_cache
-        arp_entry = arp_cache_manager.lookup_entry(eth_hdr.eth_type, dst)
         if arp_entry == None:
             arp_entry = ArpEntry(
                 ipaddr = dst,
@@ -308,28 +474,18 @@ class IP(object):
             self.debug_send_recv(pkb, False)
             netdev.send(pkb)
 
-    def ip_reassemble(self, pkb:Packetbuffer) -> Union[Packetbuffer,None]:
-        ip_hdr = IPHdr.from_bytes(pkb.data[EtherHdr.ETH_HDR_SIZE:])
-        assert ip_hdr != None
-        frag = self.frag_cache.lookup(ip_hdr.id, ip_hdr.proto, ip_hdr.src_ipaddr, ip_hdr.dst_ipaddr)
+    def ip_reassemble(self, pkb:Packetbuffer, ip_hdr: IPHdr) -> Union[Packetbuffer,None]:
+        frag = self.frag_cache.lookup(ip_hdr)
+        if frag == None:
+            frag = self.frag_cache.new_fragment(ip_hdr)
+            if frag == None:
+                return None
+        frag = self.frag_cache.insert_fragment(pkb, ip_hdr, frag)
         if frag == None:
-            frag = self.frag_cache.new_fragment(pkb)
-        if self.frag_cache.insert_fragment(pkb, frag) == False:
             self.logger.debug("ip_reassemble: fragment not complete")
-            return
-        
-        if frag.is_complete():
-            self.logger.debug("reassemble pbk")
-            new_pkb = frag.reassemble()
-            assert new_pkb != None
-            self.frag_cache.remove_fragment(frag)
-            return new_pkb
-        else:
             return None
-        
-        
-
-
-
-        
 
+        self.logger.debug("reassemble pbk")
+        new_pkb = frag.reassemble(pkb)
+        self.frag_cache.remove_fragment(frag)
+        return new_pkb
@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import Union
+from typing import List, Union
 from ...netdev.dev import NetDevice
 from ...ip import IPAddress, IPNetwork
 
@@ -8,10 +8,53 @@ class RouteFlags(Enum):
     LOCALHOST = 1
     DEFAULT = 2
 
+class RouteProto(Enum):
+    KERNEL = 0 # 协议栈根据网卡地址自动生成的路由
+    STATIC = 1 # 手动添加或者批量加载的路由
+
 class RouteEntry(object):
-    def __init__(self, net: IPNetwork, gateway: Union[IPAddress, None], flags: RouteFlags, metric:int, netdev: NetDevice) -> None:
+    def __init__(self, net: IPNetwork, gateway: Union[IPAddress, None], flags: RouteFlags, metric:int, netdev: NetDevice, proto: RouteProto = RouteProto.STATIC) -> None:
         self.net: IPNetwork = net
         self.gateway: Union[IPAddress, None] = gateway
         self.flags: RouteFlags = flags
         self.metric: int = metric
-        self.netdev: NetDevice = netdev # output net device or local net device
\ No newline at end of file
+        self.netdev: NetDevice = netdev # output net device or local net device
+        self.proto: RouteProto = proto
+        # 等价多路径(ECMP): 为空表示单路径路由
+        self.nexthops: List['RouteNextHop'] = []
+        self.slots: List['RouteNextHop'] = [] # 按权重展开的下一跳, 用流哈希取模选择
+        # 通过该路由发送的报文统计
+        self.packets: int = 0
+        self.bytes: int = 0
+
+    def add_nexthop(self, gateway: Union[IPAddress, None], netdev: NetDevice, weight: int = 1) -> 'RouteNextHop':
+        if weight < 1 or weight > RouteNextHop.MAX_WEIGHT:
+            raise ValueError("invalid nexthop weight: %d" % weight)
+        nexthop = RouteNextHop(self, gateway, netdev, weight)
+        nexthops = self.nexthops + [nexthop]
+        slots: List[RouteNextHop] = []
+        for nh in nexthops:
+            slots += [nh] * nh.weight
+        # 先发布新的slots再发布nexthops, 查找路径不需要加锁
+        self.slots = slots
+        self.nexthops = nexthops
+        if len(nexthops) == 1:
+            self.gateway, self.netdev = gateway, netdev
+        return nexthop
+
+    def select(self, flow_hash: int) -> 'RouteEntry':
+        """
+        根据流的哈希值选择下一跳: 同一个流的哈希值不变, 总是走同一个下一跳, 保证报文不乱序
+        """
+        slots = self.slots
+        if len(slots) == 0:
+            return self
+        return slots[flow_hash % len(slots)]
+
+class RouteNextHop(RouteEntry):
+    MAX_WEIGHT = 256
+
+    def __init__(self, route: RouteEntry, gateway: Union[IPAddress, None], netdev: NetDevice, weight: int) -> None:
+        super().__init__(route.net, gateway, route.flags, route.metric, netdev, route.proto)
+        self.route = route
+        self.weight = weight
@@ -1,11 +1,18 @@
-from typing import Union, List, TYPE_CHECKING
+from typing import Any, Iterable, Iterator, List, Union, TYPE_CHECKING
+import socket
+import struct
+import zlib
 from threading import Lock
-from . import RouteEntry, RouteFlags
+from . import RouteEntry, RouteFlags, RouteProto
+from .table import RouteTable
+from .dst import DstCache, DstEntry
+from .pmtu import PMTUCache
 from .. import IPAddress, IPNetwork
-from .. import IPHdr
+from .. import IPHdr, IPProto
 from ...pkb import Packetbuffer
 from ...logger_manager import Logger
 from ...eth import EtherHdr
+from ...checksum import csum_replace4
 if TYPE_CHECKING:
     from ...netdev.dev_manager import NetDeviceManageThread
     from ...netdev.dev import NetDevice
@@ -13,8 +20,10 @@ if TYPE_CHECKING:
 class RouteCacheManager(object):
 
     def __init__(self, netdev_manager: 'NetDeviceManageThread', logger_manager: Logger) -> None:
-        self.entries: List[RouteEntry] = []
+        self.table = RouteTable() # 查找不加锁, entries_lock只用于串行化写操作
         self.entries_lock = Lock()
+        self.dst_cache = DstCache()
+        self.pmtu_cache = PMTUCache()
         self.loop_device = netdev_manager.loop_device
         self.veth_devices = netdev_manager.veth_devices
         netdev_manager.route_cache_manager = self
@@ -25,23 +34,26 @@ class RouteCacheManager(object):
     
     def add_entry(self, entry:RouteEntry) -> None:
         with self.entries_lock:
-            self.entries.append(entry)
+            self.table.insert(entry)
+            self.dst_cache.invalidate()
 
     def remove_entry(self, entry: RouteEntry) -> None:
         with self.entries_lock:
-            self.entries.remove(entry)
+            if not self.table.remove(entry):
+                raise ValueError("route entry not found")
+            self.dst_cache.invalidate()
 
     def lookup_entry(self, addr: Union[IPAddress, IPNetwork]) -> Union[RouteEntry, None]:
-        with self.entries_lock:
-            for entry in self.entries:
-                if addr in entry.net:
-                    return entry
-            return None
+        # 最长前缀匹配; 如果查找的是网段, 返回包含该网段的路由
+        if isinstance(addr, IPNetwork):
+            return self.table.lookup(int(addr.network_address), addr.prefixlen)
+        return self.table.lookup(int(addr))
 
     def show(self) -> None:
         with self.entries_lock:
+            table = self.table
             print("%-20s%-20s%-20s%-10s%-10s" % ("Destination", "Gateway", "Genmask", "Metric", "Iface"))
-            for entry in self.entries:
+            for entry in table:
                 if entry.flags == RouteFlags.LOCALHOST:
                     continue
                 if entry.flags == RouteFlags.DEFAULT:
@@ -56,35 +68,252 @@ class RouteCacheManager(object):
                 print("%-20s" % entry.net.netmask, end="")
                 print("%-10s" % entry.metric, end="")
                 print("%-10s" % entry.netdev.name)
+                for nexthop in entry.nexthops:
+                    print("    nexthop via %-15s dev %-8s weight %-4d packets %-10d bytes %d" % (
+                        nexthop.gateway if nexthop.gateway is not None else "*",
+                        nexthop.netdev.name, nexthop.weight, nexthop.packets, nexthop.bytes))
+
+    def flow_hash(self, pkb: Packetbuffer) -> int:
+        """
+        五元组哈希(src, dst, proto, sport, dport), 用于多路径选路。
+        分片报文只有第一个分片带端口号, 所以分片报文只用三元组。
+        """
+        data = pkb.data
+        ip = EtherHdr.ETH_HDR_SIZE
+        proto = data[ip + 9]
+        key = data[ip + IPHdr.SRC_ADDR_OFFSET:ip + IPHdr.DST_ADDR_OFFSET + 4] + data[ip + 9:ip + 10]
+        if (proto == IPProto.TCP.value or proto == IPProto.UDP.value) and \
+            (data[ip + 6] & 0x3f) == 0 and data[ip + 7] == 0: # 不是分片报文
+            hdr_len = (data[ip] & 0x0f) * 4
+            key += data[ip + hdr_len:ip + hdr_len + 4]
+        return zlib.crc32(key)
+
+    @staticmethod
+    def tuple_hash(src: int, dst: int, proto: int, sport: int, dport: int) -> int:
+        # 和flow_hash的输入布局相同, 同一个五元组两者的结果一样
+        return zlib.crc32(struct.pack("!IIBHH", src, dst, proto, sport, dport))
+
+    def select_output(self, route_entry: RouteEntry, flow_hash: int, src: Union[int, None] = None) -> RouteEntry:
+        """
+        为本地发出的报文选择下一跳。
+        src是已经确定的源地址(socket绑定的地址), 优先选择这个地址所在网卡的下一跳, 源地址和出口保持一致;
+        没有这样的下一跳(或者src为None)时按流哈希选择。
+        """
+        if len(route_entry.slots) == 0:
+            return route_entry
+        if src != None:
+            for nexthop in route_entry.nexthops:
+                if nexthop.netdev.ipaddr != None and int(nexthop.netdev.ipaddr) == src:
+                    return nexthop
+        return route_entry.select(flow_hash)
+
+    def lookup_dst(self, dst: int) -> Union[DstEntry, None]:
+        # 先查目的地址缓存, 没有命中再查路由表
+        dst_entry = self.dst_cache.lookup(dst)
+        if dst_entry is None:
+            generation = self.dst_cache.generation # 必须在查路由表之前读
+            route_entry = self.table.lookup(dst)
+            if route_entry is None:
+                return None
+            dst_entry = self.dst_cache.insert(dst, route_entry, generation)
+        return dst_entry
+
+    def path_mtu(self, dst: int, route_entry: RouteEntry) -> int:
+        # 路径MTU不会超过出口网卡的MTU
+        mtu = route_entry.netdev.mtu
+        pmtu = self.pmtu_cache.lookup(dst)
+        if pmtu is not None and pmtu < mtu:
+            return pmtu
+        return mtu
+
+    def update_pmtu(self, dst: int, mtu: int) -> bool:
+        # 路径MTU变小以后, 缓存了MTU的地方(目的地址缓存, 转发流表)都需要失效
+        if not self.pmtu_cache.update(dst, mtu):
+            return False
+        self.dst_cache.invalidate()
+        return True
 
     def route_input(self, pkb: Packetbuffer) -> bool:
-        ip_hdr = IPHdr.from_bytes(pkb.data[EtherHdr.ETH_HDR_SIZE:])
-        assert ip_hdr != None
-        route_entry = self.lookup_entry(ip_hdr.dst_ipaddr)
-        if route_entry is None:
+        offset = EtherHdr.ETH_HDR_SIZE + IPHdr.DST_ADDR_OFFSET
+        dst_entry = self.lookup_dst(int.from_bytes(pkb.data[offset:offset + 4], "big"))
+        if dst_entry is None:
             # TODO: RFC 1812: send ICMP unreachable
             return False
+        route_entry = dst_entry.route
+        if len(route_entry.slots) != 0:
+            route_entry = route_entry.select(self.flow_hash(pkb))
         pkb.rtdst = route_entry
+        pkb.dst_entry = dst_entry
         return True
     
-    def route_output(self, pkb: Packetbuffer) -> bool:
-        ip_hdr = IPHdr.from_bytes(pkb.data[EtherHdr.ETH_HDR_SIZE:])
-        assert ip_hdr != None
-        route_entry = self.lookup_entry(ip_hdr.dst_ipaddr)
-        if route_entry == None:
-            self.logger.debug("No route entry to {}".format(str(ip_hdr.dst_ipaddr)))
+    def route_output(self, pkb: Packetbuffer, keep_src: bool = False) -> bool:
+        """
+        keep_src为True表示报文的源地址已经确定(比如tcp socket的四元组), 不能改写,
+        否则把源地址改成出口网卡的地址(icmp差错报文等)
+        """
+        ip = EtherHdr.ETH_HDR_SIZE
+        dst = int.from_bytes(pkb.data[ip + IPHdr.DST_ADDR_OFFSET:ip + IPHdr.DST_ADDR_OFFSET + 4], "big")
+        dst_entry = self.lookup_dst(dst)
+        if dst_entry == None:
+            self.logger.debug("No route entry to {}".format(str(IPAddress(dst))))
             return False
+        route_entry = dst_entry.route
+        if len(route_entry.slots) != 0:
+            src = int.from_bytes(pkb.data[ip + IPHdr.SRC_ADDR_OFFSET:ip + IPHdr.SRC_ADDR_OFFSET + 4], "big") if keep_src else None
+            route_entry = self.select_output(route_entry, self.flow_hash(pkb), src)
         pkb.rtdst = route_entry
+        pkb.dst_entry = dst_entry
+        if keep_src:
+            return True
         netdev_addr =  route_entry.netdev.ipaddr
         assert netdev_addr != None
-        ip_hdr.src_ipaddr = netdev_addr
-        pkb.data = pkb.data[:EtherHdr.ETH_HDR_SIZE] + ip_hdr.to_bytes()
+        self.rewrite_src(pkb, int(netdev_addr))
         return True
 
+    def rewrite_src(self, pkb: Packetbuffer, new_src: int) -> None:
+        """
+        把源地址改成出口网卡的地址。源地址没有变化时什么都不做, 否则直接修改报文,
+        增量更新ip头部的校验和, 以及tcp/udp的校验和(伪头部中包含源地址)(RFC 1624)
+        """
+        ip = EtherHdr.ETH_HDR_SIZE
+        src_offset = ip + IPHdr.SRC_ADDR_OFFSET
+        old_src = int.from_bytes(pkb.data[src_offset:src_offset + 4], "big")
+        if old_src == new_src:
+            return
+        data = bytearray(pkb.data)
+        data[src_offset:src_offset + 4] = new_src.to_bytes(4, "big")
+        cksum_offset = ip + IPHdr.CKSUM_OFFSET
+        cksum = int.from_bytes(data[cksum_offset:cksum_offset + 2], "big")
+        struct.pack_into("!H", data, cksum_offset, csum_replace4(cksum, old_src, new_src))
+
+        # 只有第一个分片带有tcp/udp头部
+        if (data[ip + 6] & 0x1f) == 0 and data[ip + 7] == 0:
+            proto = data[ip + 9]
+            l4 = ip + (data[ip] & 0x0f) * 4
+            if proto == IPProto.TCP.value:
+                cksum_offset = l4 + 16
+            elif proto == IPProto.UDP.value:
+                cksum_offset = l4 + 6
+            else:
+                cksum_offset = -1
+            if cksum_offset > 0 and cksum_offset + 2 <= len(data):
+                cksum = int.from_bytes(data[cksum_offset:cksum_offset + 2], "big")
+                if cksum != 0 or proto == IPProto.TCP.value: # udp校验和为0表示没有校验和
+                    cksum = csum_replace4(cksum, old_src, new_src)
+                    if cksum == 0 and proto == IPProto.UDP.value:
+                        cksum = 0xffff
+                    struct.pack_into("!H", data, cksum_offset, cksum)
+        pkb.data = bytes(data)
+
     def route_add(self, route_entry: RouteEntry) -> None:
         with self.entries_lock:
-            self.entries.append(route_entry)
+            self.table.insert(route_entry)
+            self.dst_cache.invalidate()
     
+    def route_load(self, routes: Iterable[RouteEntry], flush: bool = False) -> int:
+        """
+        批量加载路由: 在一张新表上插入所有路由, 最后通过一次引用赋值发布新表。
+        查找路径不加锁, 加载期间查找的一直是旧表, 不会被阻塞。
+        flush为True时丢弃原有的静态路由, 只保留协议栈自动生成的本地/直连路由。
+        """
+        with self.entries_lock:
+            if flush:
+                new_table = RouteTable()
+                for entry in self.table:
+                    if entry.proto == RouteProto.KERNEL:
+                        new_table.insert(entry)
+            else:
+                new_table = self.table.copy()
+            count = 0
+            for entry in routes:
+                new_table.insert(entry)
+                count += 1
+            self.table = new_table
+            self.dst_cache.invalidate()
+        self.logger.debug("route_load: %d routes loaded, %d routes in table" % (count, len(new_table)))
+        return count
+
+    def route_load_file(self, path: str, flush: bool = False) -> int:
+        with open(path) as f:
+            return self.route_load(self.parse_routes(f), flush)
+
+    def parse_routes(self, lines: Iterable[str]) -> Iterator[RouteEntry]:
+        for lineno, line in enumerate(lines, 1):
+            line = line.split("#")[0].strip()
+            if line == "":
+                continue
+            try:
+                yield self.parse_route(line)
+            except ValueError as e:
+                raise ValueError("line %d: %s" % (lineno, e))
+
+    def parse_route(self, line: str) -> RouteEntry:
+        """
+        和ip route的格式一致:
+            <prefix>|default [via <gateway>] [dev <ifname>] [metric <metric>]
+            <prefix>|default [metric <metric>] nexthop [via <gateway>] [dev <ifname>] [weight <weight>] nexthop ...
+        没有指定dev时, 通过网关所在的直连路由找到出口网卡
+        """
+        words = line.split()
+        if words[0] == "default":
+            net = IPNetwork("0.0.0.0/0")
+        else:
+            # 用inet_aton解析地址, 比直接用字符串构造IPNetwork快很多, 加载大路由表时很明显
+            addr, _, prefixlen = words[0].partition("/")
+            try:
+                addr_int = int.from_bytes(socket.inet_aton(addr), "big")
+            except OSError:
+                raise ValueError("invalid prefix: %s" % words[0])
+            net = IPNetwork((addr_int, int(prefixlen) if prefixlen else 32), strict=False)
+        flags = RouteFlags.DEFAULT if net.prefixlen == 0 else RouteFlags.NONE
+        metric = 0
+        # 每个下一跳: [gateway, netdev, weight]
+        nexthops: List[List[Any]] = [[None, None, 1]]
+        i = 1
+        while i < len(words):
+            key = words[i]
+            if key == "nexthop":
+                if nexthops[-1][0] != None or nexthops[-1][1] != None:
+                    nexthops.append([None, None, 1])
+                i += 1
+                continue
+            if i + 1 >= len(words):
+                raise ValueError("invalid route: %s" % line)
+            value = words[i + 1]
+            if key == "via":
+                nexthops[-1][0] = IPAddress(value)
+            elif key == "dev":
+                nexthops[-1][1] = self.get_netdev(value)
+            elif key == "weight":
+                nexthops[-1][2] = int(value)
+            elif key == "metric":
+                metric = int(value)
+            else:
+                raise ValueError("unknown route option: %s" % key)
+            i += 2
+        for nexthop in nexthops:
+            gateway, netdev = nexthop[0], nexthop[1]
+            if netdev == None:
+                if gateway == None:
+                    raise ValueError("route needs a gateway or a device: %s" % line)
+                gw_entry = self.lookup_entry(gateway)
+                if gw_entry == None or gw_entry.gateway != None:
+                    raise ValueError("gateway %s is unreachable" % gateway)
+                nexthop[1] = gw_entry.netdev
+        route_entry = RouteEntry(net, nexthops[0][0], flags, metric, nexthops[0][1])
+        if len(nexthops) > 1:
+            for gateway, netdev, weight in nexthops:
+                route_entry.add_nexthop(gateway, netdev, weight)
+        return route_entry
+
+    def get_netdev(self, name: str) -> 'NetDevice':
+        if name == self.loop_device.name:
+            return self.loop_device
+        for dev in self.veth_devices:
+            if dev.name == name:
+                return dev
+        raise ValueError("device %s not found" % name)
+
     def route_init(self):
         loop_netdev = self.loop_device
         route_entry = RouteEntry(
@@ -92,7 +321,8 @@ class RouteCacheManager(object):
             None,
             RouteFlags.LOCALHOST,
             0,
-            loop_netdev
+            loop_netdev,
+            RouteProto.KERNEL
         )
         self.route_add(route_entry)
     
@@ -104,7 +334,8 @@ class RouteCacheManager(object):
                 None,
                 RouteFlags.LOCALHOST,
                 0,
-                self.loop_device
+                self.loop_device,
+                RouteProto.KERNEL
             )
             self.route_add(route_entry)
 
@@ -114,6 +345,20 @@ class RouteCacheManager(object):
                 None,
                 RouteFlags.NONE,
                 0,
-                dev
+                dev,
+                RouteProto.KERNEL
             )
             self.route_add(route_entry)
+        self.dst_cache.invalidate()
+
+    def remove_veth_routes(self, dev: 'NetDevice') -> None:
+        if dev.ipaddr != None:
+            with self.entries_lock:
+                for net, netdev in [
+                    (IPNetwork(str(dev.ipaddr) + "/" + "32", strict=False), self.loop_device),
+                    (IPNetwork(str(dev.ipaddr) + "/" + str(dev.mask), strict=False), dev)
+                ]:
+                    for entry in self.table.entries(net.prefixlen, int(net.network_address)):
+                        if entry.proto == RouteProto.KERNEL and entry.netdev == netdev:
+                            self.table.remove(entry)
+        self.dst_cache.invalidate()
@@ -0,0 +1,53 @@
+from typing import Dict, Union, TYPE_CHECKING
+from . import RouteEntry
+from .. import IPAddress
+if TYPE_CHECKING:
+    from ...arp.entry import ArpEntry
+
+"""
+目的地址缓存: dst(32位整数) -> DstEntry(路由, 下一跳, 邻居)
+
+路由表发生任何变化(route_add, remove_entry, add_veth_routes, 网卡地址改变)时, 不逐条删除缓存,
+只把全局的generation加1, 之前生成的DstEntry的generation对不上, 就自动失效了。
+socket保存了DstEntry的引用, 同样通过generation判断是否需要重新查路由。
+"""
+
+class DstEntry(object):
+    def __init__(self, dst: int, route: RouteEntry, generation: int) -> None:
+        self.dst = dst
+        self.route = route
+        # 网关路由的下一跳是网关, 直连路由的下一跳就是目的地址本身
+        self.nexthop: IPAddress = route.gateway if route.gateway is not None else IPAddress(dst)
+        self.neigh: Union['ArpEntry', None] = None # 下一跳的arp表项, 解析成功后由ip层填入
+        self.generation = generation
+
+class DstCache(object):
+    MAX_DST_CACHE_SIZE = 65536
+
+    def __init__(self) -> None:
+        self.entries: Dict[int, DstEntry] = {}
+        self.generation: int = 0
+
+    def lookup(self, dst: int) -> Union[DstEntry, None]:
+        entry = self.entries.get(dst)
+        if entry is not None and entry.generation == self.generation:
+            return entry
+        return None
+
+    def insert(self, dst: int, route: RouteEntry, generation: int) -> DstEntry:
+        # generation是查路由表之前读到的, 查表期间路由表变了的话, 查到的路由可能已经过期,
+        # 这时不放进缓存, 返回的DstEntry也是失效的, 调用者下次会重新查路由
+        entry = DstEntry(dst, route, generation)
+        if generation != self.generation:
+            return entry
+        if len(self.entries) >= self.MAX_DST_CACHE_SIZE:
+            self.entries = {}
+        self.entries[dst] = entry
+        return entry
+
+    def valid(self, entry: Union[DstEntry, None]) -> bool:
+        return entry is not None and entry.generation == self.generation
+
+    def invalidate(self) -> None:
+        self.generation += 1
+        self.entries = {}
@@ -0,0 +1,59 @@
+import time
+from typing import Dict, Union
+
+"""
+路径MTU缓存(RFC 1191): dst(32位整数) -> PMTUEntry
+
+收到ICMP Fragmentation Needed报文时记录到目的地址的路径MTU, 发送报文和计算TCP分段大小时取
+min(出口网卡MTU, 路径MTU), 这样经过小MTU链路的报文在本地就不需要分片, 对端也不需要重组。
+路径MTU只会被调小, 表项老化(PMTU_EXPIRES秒)以后重新使用网卡的MTU, 以便发现路径MTU变大。
+"""
+
+class PMTUEntry(object):
+    def __init__(self, mtu: int, expires: float) -> None:
+        self.mtu = mtu
+        self.expires = expires
+
+class PMTUCache(object):
+    PMTU_EXPIRES = 10 * 60
+    MIN_PMTU = 552 # 和linux的ip_rt_min_pmtu一致
+    MAX_PMTU_CACHE_SIZE = 4096
+    # RFC 1191 的MTU平台表, 用于处理不带下一跳MTU的旧式ICMP报文
+    MTU_PLATEAUS = [65535, 32000, 17914, 8166, 4352, 2002, 1492, 1006, 508, 296, 68]
+
+    def __init__(self) -> None:
+        self.entries: Dict[int, PMTUEntry] = {}
+
+    def lookup(self, dst: int) -> Union[int, None]:
+        entry = self.entries.get(dst)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic():
+            self.entries.pop(dst, None)
+            return None
+        return entry.mtu
+
+    def update(self, dst: int, mtu: int) -> bool:
+        mtu = max(mtu, self.MIN_PMTU)
+        old_mtu = self.lookup(dst)
+        if old_mtu is not None and old_mtu <= mtu:
+            return False
+        if len(self.entries) >= self.MAX_PMTU_CACHE_SIZE:
+            self.expire()
+            if len(self.entries) >= self.MAX_PMTU_CACHE_SIZE:
+                self.entries.pop(next(iter(self.entries))) # 删除最早的表项
+        self.entries[dst] = PMTUEntry(mtu, time.monotonic() + self.PMTU_EXPIRES)
+        return True
+
+    def expire(self) -> None:
+        now = time.monotonic()
+        for dst, entry in list(self.entries.items()):
+            if entry.expires < now:
+                self.entries.pop(dst, None)
+
+    @classmethod
+    def next_plateau(cls, total_len: int) -> int:
+        for mtu in cls.MTU_PLATEAUS:
+            if mtu < total_len:
+                return mtu
+        return cls.MIN_PMTU
@@ -0,0 +1,123 @@
+from typing import Dict, Iterator, List, Tuple, Union
+from . import RouteEntry
+
+"""
+最长前缀匹配(LPM)路由表: 按前缀长度分组的哈希表
+
+    levels: ((32, mask32, {net: entry}), (24, mask24, {net: entry}), ..., (0, mask0, {0: entry}))
+
+查找时按前缀长度从长到短依次用 addr & mask 查哈希表, 第一个命中的就是最长前缀匹配的路由。
+查找次数只和前缀长度的种类有关(最多33次)，与路由条目的数量无关。
+
+相同前缀可以有多条路由(不同的metric, 或者自动生成的直连路由和手动添加的静态路由), 都保存在candidates中,
+按(metric, proto)排序: metric小的优先, metric相同时协议栈生成的路由(KERNEL)优先, 都相同时先插入的优先。
+哈希表中只放排在第一个的路由, 删除它以后下一条自动生效, 查找路径不受影响。
+
+写操作(insert/remove)由调用方串行化, 读操作不加锁:
+  1. levels是不可变的tuple, 写者每次都发布一个新的tuple, 读者拿到的永远是一个完整的快照
+  2. 每个前缀长度的dict一旦创建就不会被删除, 读者手里的旧快照依然可以安全地访问
+"""
+
+class RouteTable(object):
+    MAX_PREFIX_LEN = 32
+
+    def __init__(self) -> None:
+        self.tables: Dict[int, Dict[int, RouteEntry]] = {}
+        self.levels: Tuple[Tuple[int, int, Dict[int, RouteEntry]], ...] = ()
+        self.candidates: Dict[Tuple[int, int], List[RouteEntry]] = {} # (前缀长度, 网络地址) -> 排好序的路由
+        self.count: int = 0
+
+    @classmethod
+    def prefix_mask(cls, prefixlen: int) -> int:
+        return (0xffffffff << (cls.MAX_PREFIX_LEN - prefixlen)) & 0xffffffff
+
+    def _publish(self) -> None:
+        # 只发布非空的前缀长度, 按长度从长到短排序
+        self.levels = tuple(
+            (plen, self.prefix_mask(plen), self.tables[plen])
+            for plen in sorted(self.tables, reverse=True) if len(self.tables[plen]) != 0
+        )
+
+    @staticmethod
+    def preference(entry: RouteEntry) -> Tuple[int, int]:
+        return (entry.metric, entry.proto.value)
+
+    def insert(self, entry: RouteEntry) -> None:
+        plen = entry.net.prefixlen
+        key = int(entry.net.network_address)
+        candidates = self.candidates.setdefault((plen, key), [])
+        if any(e is entry for e in candidates):
+            return
+        # 插入到优先级相同的路由之后
+        pref = self.preference(entry)
+        i = 0
+        while i < len(candidates) and self.preference(candidates[i]) <= pref:
+            i += 1
+        candidates.insert(i, entry)
+        self.count += 1
+        if i != 0:
+            return
+        table = self.tables.get(plen)
+        if table is None:
+            table = self.tables[plen] = {}
+        table[key] = entry
+        if len(table) == 1:
+            self._publish()
+
+    def remove(self, entry: RouteEntry) -> bool:
+        plen = entry.net.prefixlen
+        key = int(entry.net.network_address)
+        candidates = self.candidates.get((plen, key))
+        if candidates is None:
+            return False
+        for i, e in enumerate(candidates):
+            if e is entry:
+                break
+        else:
+            return False
+        del candidates[i]
+        self.count -= 1
+        if i != 0:
+            return True
+        table = self.tables[plen]
+        if len(candidates) != 0:
+            table[key] = candidates[0] # 下一条路由生效
+            return True
+        del self.candidates[(plen, key)]
+        del table[key]
+        if len(table) == 0:
+            self._publish()
+        return True
+
+    def entries(self, plen: int, net: int) -> List[RouteEntry]:
+        # 某个前缀的所有路由, 第一个是生效的
+        return list(self.candidates.get((plen, net), []))
+
+    def lookup(self, addr: int, max_prefixlen: int = MAX_PREFIX_LEN) -> Union[RouteEntry, None]:
+        for plen, mask, table in self.levels:
+            if plen > max_prefixlen:
+                continue
+            entry = table.get(addr & mask)
+            if entry is not None:
+                return entry
+        return None
+
+    def copy(self) -> 'RouteTable':
+        new_table = RouteTable()
+        for plen, table in self.tables.items():
+            new_table.tables[plen] = table.copy()
+        for key, candidates in self.candidates.items():
+            new_table.candidates[key] = list(candidates)
+        new_table.count = self.count
+        new_table._publish()
+        return new_table
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[RouteEntry]:
+        # 包括没有生效的路由
+        for plen, _, table in self.levels:
+            for key in list(table.keys()):
+                for entry in self.candidates.get((plen, key), []):
+                    yield entry
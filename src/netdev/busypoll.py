@@ -0,0 +1,39 @@
+import os
+from time import perf_counter
+from typing import Callable
+
+"""
+忙轮询(busy polling), 用于对延迟敏感的场景:
+  没有数据时不马上睡眠(select/条件变量), 先在预算时间内反复检查有没有数据, 每次检查之间sched_yield。
+  这样报文到达时不需要等待线程被唤醒, 代价是空转的cpu。
+
+  预算按报文到达的情况自适应调整(和linux NAPI的思路一样):
+    在预算内等到了数据: 说明报文到达得很频繁, 预算加倍(不超过最大值)
+    预算用完也没有数据: 说明流量稀疏, 空转是浪费, 预算减半(不低于最小值)
+"""
+
+class BusyPoll(object):
+    MIN_BUDGET = 10 # 微秒
+
+    def __init__(self, budget: int) -> None:
+        self.max_budget = budget # 配置的预算, 单位微秒
+        self.budget = budget     # 当前的预算
+        self.hits = 0   # 空转期间等到了数据的次数
+        self.misses = 0 # 预算用完也没有数据的次数
+
+    def spin(self, poll: Callable[[], bool]) -> bool:
+        # 在预算时间内反复调用poll, poll返回True表示有数据
+        deadline = perf_counter() + self.budget / 1e6
+        while True:
+            if poll():
+                self.hits += 1
+                self.budget = min(self.budget * 2, self.max_budget)
+                return True
+            if perf_counter() >= deadline:
+                self.misses += 1
+                self.budget = max(self.budget // 2, self.MIN_BUDGET)
+                return False
+            os.sched_yield() # 同时释放GIL, 让协议栈的线程运行
+
+    def show(self) -> None:
+        print("busy poll: budget %d/%d us, hits: %d, misses: %d" % (self.budget, self.max_budget, self.hits, self.misses))
@@ -1,6 +1,6 @@
 
 from ..ip import IPAddress
-from typing import Union, TYPE_CHECKING
+from typing import List, Union, TYPE_CHECKING
 from abc import ABC, abstractmethod
 from ..eth import MacAddress
 from ..pkb import Packetbuffer
@@ -19,9 +19,14 @@ class NetDeviceStatus(object):
         self.tx_errors = 0
         self.rx_bytes = 0
         self.tx_bytes = 0
+        self.tx_dropped = 0 # 发送环满丢弃的报文数
+        self.rx_dropped = 0 # 协议栈的输入队列满丢弃的报文数
         
 
 class NetDevice(ABC):
+    MIN_MTU = 68    # RFC 791: ipv4最小的MTU
+    MAX_MTU = 65535 # ip报文的最大长度
+
     def __init__(self, name: str, logger_manager: 'Logger') -> None:
         self.mtu: int = 1500
         self.ipaddr: Union[IPAddress, None] = None
@@ -50,6 +55,21 @@ class NetDevice(ABC):
     def send(self, pkb: Packetbuffer) -> int:
         return 0
 
+    def sendv(self, iov: List[Union[bytes, memoryview]]) -> int:
+        """
+        发送由多段数据组成的一个报文(比如分片的头部模板 + 原报文数据的切片),
+        默认拼接成一个报文发送, 支持writev的网卡可以直接写出, 避免拷贝。
+        """
+        return self.send(Packetbuffer(b"".join(iov)))
+
+    def send_burst(self, frames: List[List[Union[bytes, memoryview]]]) -> int:
+        # 一次发送多个报文, 返回发送成功的报文数
+        sent = 0
+        for iov in frames:
+            if self.sendv(iov) >= 0:
+                sent += 1
+        return sent
+
     @abstractmethod
     def recv(self, pkb: Packetbuffer) -> Union[Packetbuffer, None]:
         return pkb
@@ -70,6 +90,14 @@ class NetDevice(ABC):
         self.hwaddr = mac
             
 
+    def change_mtu(self, mtu: int) -> None:
+        if mtu < self.MIN_MTU or mtu > self.MAX_MTU:
+            raise ValueError("invalid mtu %d" % mtu)
+        self.mtu = mtu
+        # 转发流表和目的地址缓存中缓存了MTU, 让它们失效
+        if self.netdev_manager != None and self.netdev_manager.route_cache_manager != None:
+            self.netdev_manager.route_cache_manager.dst_cache.invalidate()
+
     @abstractmethod
     def exit(self) -> None:
         pass
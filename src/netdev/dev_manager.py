@@ -1,17 +1,24 @@
+import os
 from threading import Thread
-from typing import List, Union
+from queue import Empty
+from typing import Callable, List, Union, TYPE_CHECKING
 from select import select
 from ..logger_manager import Logger
 from ..ip.route.cache import RouteCacheManager
 from ..pkb import PKBQueue
 from .loopdev import LoopNetDevice
 from .vethdev import TapDevice, VethNetDevice
+from .busypoll import BusyPoll
 from ..ip import IPAddress, IPNetwork
+from ..pkb import Packetbuffer
+if TYPE_CHECKING:
+    from ..pipeline import BatchQueue
 
 
 class NetDeviceManageThread(Thread):
     MAX_RECV_PKB_CACHE_SIZE = 8192
-    def __init__(self, logger_manager: Logger) -> None:
+    POLL_WEIGHT = 64 # 忙轮询时每个网卡每轮最多读取的报文数(NAPI weight)
+    def __init__(self, logger_manager: Logger, busy_poll: int = 0) -> None:
         super().__init__()
         self.logger = logger_manager.get_logger("netdev")
         self.setDaemon(True)
@@ -19,6 +26,31 @@ class NetDeviceManageThread(Thread):
         self.veth_devices: List[VethNetDevice] = []
         self.rcvd_pkb_queue = PKBQueue(self.MAX_RECV_PKB_CACHE_SIZE) # all pkb which is received by netdev
         self.route_cache_manager: Union[RouteCacheManager, None] = None
+        self.rx_batch_queue: Union['BatchQueue', None] = None # 流水线模式下协议处理线程的输入队列
+        # 忙轮询的预算(微秒), 为0时直接用select睡眠等待
+        self.busy_poll: Union[BusyPoll, None] = None
+        self.wakeup_fds = (-1, -1) # 忙轮询线程睡眠在select上时, 环回报文通过管道唤醒它
+        if busy_poll > 0:
+            self.busy_poll = BusyPoll(busy_poll)
+            self.wakeup_fds = os.pipe()
+            os.set_blocking(self.wakeup_fds[0], False)
+            os.set_blocking(self.wakeup_fds[1], False)
+
+    def deliver(self, pkb: Packetbuffer) -> None:
+        # 把网卡收到的报文交给协议栈
+        if self.rx_batch_queue != None:
+            # 流水线模式下只有环回报文走这里, 发送者通常就是协议处理线程(队列唯一的消费者)或者定时器/应用线程,
+            # 阻塞等待会死锁, 所以队列满时和网卡一样丢弃
+            if not self.rx_batch_queue.try_put([pkb]):
+                assert pkb.indev != None
+                pkb.indev.netstats.rx_dropped += 1
+            return
+        self.rcvd_pkb_queue.put(pkb)
+        if self.wakeup_fds[1] != -1:
+            try:
+                os.write(self.wakeup_fds[1], b"\x00")
+            except BlockingIOError: # 管道满了, 说明已经有足够的唤醒
+                pass
     
     def add_veth_device(self, dev: VethNetDevice) -> None:
         if self.route_cache_manager == None:
@@ -63,6 +95,49 @@ class NetDeviceManageThread(Thread):
         
         return False
 
+    def poll_devices(self, pkbs: List[Packetbuffer]) -> int:
+        # 非阻塞地读取所有网卡(每个网卡最多POLL_WEIGHT个报文)和环回的报文, 返回读到的报文数
+        received = len(pkbs)
+        for dev in self.veth_devices:
+            for _ in range(self.POLL_WEIGHT):
+                pkb = dev.read_pkb()
+                if pkb == None:
+                    break
+                pkbs.append(pkb)
+        try:
+            while True:
+                pkbs.append(self.rcvd_pkb_queue.get_nowait())
+        except Empty:
+            pass
+        return len(pkbs) - received
+
+    def busy_poll_loop(self, handler: Callable[[List[Packetbuffer]], None]) -> None:
+        """
+        忙轮询模式下由以太网线程调用: 在同一个线程中轮询网卡并直接调用handler处理报文(和NAPI一样run-to-completion),
+        报文不经过接收队列, 也就没有线程切换。预算用完还没有报文时睡眠在select上。
+        """
+        assert self.busy_poll != None
+        busy_poll = self.busy_poll
+        wakeup = self.wakeup_fds[0]
+        nonblocking: List[int] = []
+        pkbs: List[Packetbuffer] = []
+        while True:
+            for dev in self.veth_devices:
+                if dev.tap.fileno() not in nonblocking:
+                    os.set_blocking(dev.tap.fileno(), False)
+                    nonblocking.append(dev.tap.fileno())
+            if self.poll_devices(pkbs) != 0 or busy_poll.spin(lambda: self.poll_devices(pkbs) != 0):
+                handler(pkbs)
+                pkbs = []
+                continue
+            rlist: List[Union[TapDevice, int]] = [dev.tap for dev in self.veth_devices]
+            rlist, _, _ = select(rlist + [wakeup], [], [])
+            if wakeup in rlist:
+                try:
+                    os.read(wakeup, 4096)
+                except BlockingIOError:
+                    pass
+
     def run(self) -> None:
         while True:
             rlist: List[TapDevice] = [dev.tap for dev in self.veth_devices]
@@ -29,7 +29,7 @@ class LoopNetDevice(NetDevice):
         self.netstats.rx_bytes += len(pkb.data)
         pkb.indev = self
         if self.netdev_manager != None:
-            self.netdev_manager.rcvd_pkb_queue.put(pkb)
+            self.netdev_manager.deliver(pkb)
     
     def change_ip_address(self, ipaddress: IPAddress, mask: int) -> None:
         return super().change_ip_address(ipaddress, mask)
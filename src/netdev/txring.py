@@ -0,0 +1,124 @@
+from threading import Thread, Condition
+from collections import deque
+from time import perf_counter
+from typing import Deque, List, Union, TYPE_CHECKING
+from ..stats import StageStats
+if TYPE_CHECKING:
+    from .vethdev import VethNetDevice
+
+"""
+网卡的发送环:
+  所有线程(以太网线程, tcp/arp定时器, 调用send_text的应用线程)发送报文时只是把报文放入发送环, 立即返回,
+  由每个网卡唯一的写线程从环中一次取出最多burst个报文, 批量写到tap。
+  这样多个线程不会同时写同一个fd, 应用线程也不会因为内核的背压而阻塞在write上。
+
+  环满时的策略:
+    DROP_TAIL: 丢弃新的报文, send返回-1, 计入tx_dropped(和linux网卡队列满时一样)
+    BLOCK:     调用者等待写线程腾出空间(背压)
+  stop()以后不再接收新的报文, 包括正在等待空间的调用者, 没有放入环中的报文计入dropped。
+
+  报文在写线程中才真正写出, 所以放入环中的数据不能再被修改: bytearray在入环时拷贝成bytes。
+"""
+
+class TxRingPolicy(object):
+    DROP_TAIL = 0
+    BLOCK = 1
+
+class TxRing(Thread):
+    DEPTH = 1024
+    BURST = 64
+
+    def __init__(self, dev: 'VethNetDevice', depth: int = DEPTH, policy: int = TxRingPolicy.DROP_TAIL, burst: int = BURST) -> None:
+        super().__init__()
+        self.setDaemon(True)
+        self.name = "tx-" + dev.name
+        self.dev = dev
+        self.depth = depth
+        self.policy = policy
+        self.burst = burst
+        self.ring: Deque[List[Union[bytes, memoryview]]] = deque()
+        self.cond = Condition()
+        self.running = True
+        self.stats = StageStats()
+        self.enqueued = 0   # 放入环中的报文数
+        self.dropped = 0    # 环满丢弃的报文数
+        self.full_waits = 0 # 环满导致调用者等待的次数
+        self.max_used = 0   # 环中最多的报文数
+
+    def enqueue(self, frames: List[List[Union[bytes, memoryview]]]) -> int:
+        # 返回放入环中的报文数
+        frames = [[bytes(buf) if isinstance(buf, bytearray) else buf for buf in iov] for iov in frames]
+        with self.cond:
+            if not self.running:
+                self.dropped += len(frames)
+                return 0
+            ring = self.ring
+            room = self.depth - len(ring)
+            if room < len(frames):
+                if self.policy == TxRingPolicy.DROP_TAIL:
+                    self.dropped += len(frames) - max(room, 0)
+                    frames = frames[:max(room, 0)]
+                else:
+                    self.full_waits += 1
+                    start = perf_counter()
+                    sent = 0
+                    for iov in frames:
+                        while len(ring) >= self.depth and self.running:
+                            self.cond.wait()
+                        if not self.running: # 等待期间网卡被停止, 写线程可能已经退出
+                            break
+                        ring.append(iov)
+                        sent += 1
+                        self.cond.notify_all()
+                    self.stats.blocked += perf_counter() - start
+                    self.enqueued += sent
+                    self.dropped += len(frames) - sent
+                    self.max_used = max(self.max_used, len(ring))
+                    return sent
+            ring.extend(frames)
+            self.enqueued += len(frames)
+            if len(ring) > self.max_used:
+                self.max_used = len(ring)
+            self.cond.notify_all()
+        return len(frames)
+
+    def run(self) -> None:
+        stats = self.stats
+        ring = self.ring
+        while True:
+            start = perf_counter()
+            with self.cond:
+                while len(ring) == 0 and self.running:
+                    self.cond.wait()
+                if len(ring) == 0: # 停止
+                    return
+                frames = [ring.popleft() for _ in range(min(self.burst, len(ring)))]
+                self.cond.notify_all() # 唤醒等待空间的调用者和flush
+            busy = perf_counter()
+            stats.idle += busy - start
+            self.dev.xmit_burst(frames)
+            stats.busy += perf_counter() - busy
+            stats.batches += 1
+            stats.packets += len(frames)
+
+    def qsize(self) -> int:
+        return len(self.ring)
+
+    def flush(self, timeout: Union[float, None] = None) -> bool:
+        # 等待环中的报文全部被取走
+        with self.cond:
+            return self.cond.wait_for(lambda: len(self.ring) == 0, timeout)
+
+    def stop(self) -> None:
+        # 写完环中剩余的报文以后退出
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+    def show(self) -> None:
+        print("%s: depth %d, used %d (max %d), policy %s, burst %d" % (self.name, self.depth, len(self.ring), self.max_used,
+            "block" if self.policy == TxRingPolicy.BLOCK else "drop-tail", self.burst))
+        print("%-10s%-10s%-10s%-10s%-10s%-10s" % ("Enqueued", "Dropped", "FullWaits", "Bursts", "Sent", "AvgBurst"))
+        stats = self.stats
+        print("%-10d%-10d%-10d%-10d%-10d%-10.1f" % (self.enqueued, self.dropped, self.full_waits, stats.batches, stats.packets,
+            stats.packets / stats.batches if stats.batches else 0))
@@ -7,10 +7,11 @@ import ctypes
 import subprocess
 
 
-from ..eth import MacAddress
-from typing import Union, TYPE_CHECKING
+from ..eth import MacAddress, EtherHdr
+from typing import List, Union, TYPE_CHECKING
 from ..ip import IPAddress, IPNetwork
 from .dev import NetDevice
+from .txring import TxRing, TxRingPolicy
 from ..pkb import Packetbuffer
 if TYPE_CHECKING:
     from ..logger_manager import Logger
@@ -20,6 +21,7 @@ class IOCTL_CMD(object):
     SIOCSIFFLAGS = 0x8914
     SIOCSIFADDR = 0x8916
     SIOCSIFNETMASK = 0x891C
+    SIOCSIFMTU = 0x8922
     TUNSETIFF = 0x400454CA
 
 class IFF(object):
@@ -80,6 +82,13 @@ class TapDevice():
             raise Exception("Failed to write all data")
         return l
 
+    def writev(self, iov: List[Union[bytes, memoryview]]) -> int:
+        # tap设备的一次write就是一个报文, writev同样把多段数据作为一个报文写入
+        l = os.writev(self.fileno(), iov)
+        if l < sum(len(buf) for buf in iov):
+            raise Exception("Failed to write all data")
+        return l
+
     def fileno(self) -> int:
         return self.fd
 
@@ -114,6 +123,13 @@ class TapDevice():
         self.mask = netmask
         return self
 
+    def set_mtu(self, mtu: int) -> TapDevice:
+        ifreq = struct.pack("16si", self.name.encode(), mtu)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            fcntl.ioctl(s, IOCTL_CMD.SIOCSIFMTU, ifreq)
+        self.mtu = mtu
+        return self
+
     def up(self) -> TapDevice:
         flags = self._get_if_flags()
         flags = flags | IFF.IFF_UP
@@ -130,40 +146,59 @@ class TapDevice():
 
 class VethNetDevice(NetDevice):
 
-    def __init__(self, name: str, logger_manager: 'Logger', ipaddress: Union[IPAddress, None], mask: int, tap_ipaddress: Union[IPAddress, None], tap_ip_mask: int = 32) -> None:
+    def __init__(self, name: str, logger_manager: 'Logger', ipaddress: Union[IPAddress, None], mask: int, tap_ipaddress: Union[IPAddress, None], tap_ip_mask: int = 32,
+                 tx_ring_depth: int = TxRing.DEPTH, tx_policy: int = TxRingPolicy.DROP_TAIL, mtu: int = 1500) -> None:
         super().__init__(name, logger_manager)
         self.tap = TapDevice("tap-"+name, self)
+        self.change_mtu(mtu)
         if tap_ipaddress != None:
             self.tap.set_ip(tap_ipaddress).set_netmask(tap_ip_mask)
         self.tap.up()
         self.ipaddr, self.mask = ipaddress, mask
         self.stream = self.tap.fileno()
+        # 发送环, 由写线程批量写到tap, tx_ring_depth为0时在调用者的线程中直接写
+        self.tx_ring: Union[TxRing, None] = None
+        if tx_ring_depth > 0:
+            self.tx_ring = TxRing(self, tx_ring_depth, tx_policy)
+            self.tx_ring.start()
 
     def change_ip_address(self, ipaddress: Union[IPAddress, None], mask: int) -> None:
         if self.netdev_manager != None:
             # 判断IP地址是否和其他设备冲突
             if ipaddress != None:
                 for dev in self.netdev_manager.veth_devices:
-                    if dev == self:
+                    if dev == self or dev.ipaddr == None:
                         continue
-                    if dev.ipaddr in IPNetwork(str(dev.ipaddr) + "/" + str(dev.mask), strict=False):
+                    if ipaddress in IPNetwork(str(dev.ipaddr) + "/" + str(dev.mask), strict=False):
                         raise Exception("IP address conflict")
 
-            # 存在路由则重置路由
-            if self.ipaddr != None:
-                assert self.netdev_manager.route_cache_manager != None
-                entry = self.netdev_manager.route_cache_manager.lookup_entry(self.ipaddr)
-                if entry != None:
-                    self.netdev_manager.route_cache_manager.remove_entry(entry)
-                self.netdev_manager.route_cache_manager.add_veth_routes(self)
+            # 删除旧地址的路由, 添加新地址的路由(同时使目的地址缓存失效)
+            route_cache_manager = self.netdev_manager.route_cache_manager
+            assert route_cache_manager != None
+            route_cache_manager.remove_veth_routes(self)
+            self.ipaddr, self.mask = ipaddress, mask
+            route_cache_manager.add_veth_routes(self)
+            return
         self.ipaddr, self.mask = ipaddress, mask
     
     def change_mac_address(self, mac: MacAddress) -> None:
         return super().change_mac_address(mac)
 
+    def change_mtu(self, mtu: int) -> None:
+        # 同时修改内核中tap网卡的MTU, 否则内核发过来的报文还是按原来的MTU分片
+        if mtu < self.MIN_MTU or mtu > self.MAX_MTU:
+            raise ValueError("invalid mtu %d" % mtu)
+        self.tap.set_mtu(mtu)
+        super().change_mtu(mtu)
+
     def send(self, pkb:Packetbuffer) ->int:
+        self.debug(pkb)
+        if self.tx_ring != None:
+            if self.tx_ring.enqueue([[pkb.data]]) == 0:
+                self.netstats.tx_dropped += 1
+                return -1
+            return len(pkb.data)
         try:
-            self.debug(pkb)
             length = self.tap.write(pkb.data)
         except:
             self.netstats.tx_errors += 1
@@ -172,23 +207,68 @@ class VethNetDevice(NetDevice):
         self.netstats.tx_bytes += length
         return length
 
-    def recv(self, pkb: Union[Packetbuffer, None] = None) -> Union[Packetbuffer, None]:
+    def sendv(self, iov: List[Union[bytes, memoryview]]) -> int:
+        if self.tx_ring != None:
+            if self.tx_ring.enqueue([iov]) == 0:
+                self.netstats.tx_dropped += 1
+                return -1
+            return sum(len(buf) for buf in iov)
+        try:
+            length = self.tap.writev(iov)
+        except:
+            self.netstats.tx_errors += 1
+            return -1
+        self.netstats.tx_packets += 1
+        self.netstats.tx_bytes += length
+        return length
+
+    def send_burst(self, frames: List[List[Union[bytes, memoryview]]]) -> int:
+        if self.tx_ring != None:
+            sent = self.tx_ring.enqueue(frames)
+            self.netstats.tx_dropped += len(frames) - sent
+            return sent
+        return self.xmit_burst(frames)
+
+    def xmit_burst(self, frames: List[List[Union[bytes, memoryview]]]) -> int:
+        # tap设备没有批量写的接口, 每个报文还是一次writev, 但统计信息只更新一次
+        writev = self.tap.writev
+        sent = length = 0
+        for iov in frames:
+            try:
+                length += writev(iov)
+                sent += 1
+            except:
+                self.netstats.tx_errors += 1
+        self.netstats.tx_packets += sent
+        self.netstats.tx_bytes += length
+        return sent
+
+    def read_pkb(self) -> Union[Packetbuffer, None]:
         try:
             pkb = Packetbuffer()
-            data = self.tap.read(self.mtu + 14) # TODO: 14 is ethernet header size
+            data = self.tap.read(self.mtu + EtherHdr.ETH_HDR_SIZE)
             self.netstats.rx_packets += 1
             self.netstats.rx_bytes += len(data)
+        except BlockingIOError: # 忙轮询时tap是非阻塞的, 没有报文
+            return None
         except:
             self.netstats.rx_errors += 1
             return None
         pkb.data = data
         pkb.indev = self
-        if self.netdev_manager != None:
-            self.netdev_manager.rcvd_pkb_queue.put(pkb)
+        return pkb
+
+    def recv(self, pkb: Union[Packetbuffer, None] = None) -> Union[Packetbuffer, None]:
+        pkb = self.read_pkb()
+        if pkb != None and self.netdev_manager != None:
+            self.netdev_manager.deliver(pkb)
         # self.debug(pkb, False)
         return pkb
 
     def exit(self):
+        if self.tx_ring != None:
+            self.tx_ring.stop()
+            self.tx_ring.join(1)
         self.tap.close()
 
 
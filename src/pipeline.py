@@ -0,0 +1,163 @@
+from threading import Thread
+from queue import Queue, Empty, Full
+from select import select
+from time import perf_counter
+from typing import Any, Dict, List, Union, TYPE_CHECKING
+from .pkb import Packetbuffer
+from .stats import StageStats
+if TYPE_CHECKING:
+    from .eth.ether import EthernetThread
+    from .netdev.dev_manager import NetDeviceManageThread
+    from .netdev.dev import NetDevice
+    from .netdev.txring import TxRing
+    from .logger_manager import Logger
+
+"""
+流水线模式: 接收, 协议处理, 发送分别在不同的线程中完成, 线程之间通过有界的批量队列(BatchQueue)传递报文
+
+    RxStage  --rx_queue-->  ProtoStage  --tx_ring-->  TxRing(每个网卡一个写线程, 见netdev/txring.py)
+    select/read tap         EthernetThread.process_batch    xmit_burst写tap
+
+  这样阻塞的系统调用(tap的读写)和python的协议处理可以重叠执行, 一个网卡写得慢也不会阻塞接收。
+  队列满时上游阻塞等待(背压), 不丢弃报文。
+
+  每个阶段记录处理的批次数/报文数, 以及忙(处理报文), 空闲(等待输入), 阻塞(等待下游队列)的时间,
+  通过show()可以看出哪个阶段是瓶颈: 利用率接近100%的阶段就是瓶颈, 它的上游会阻塞, 下游会空闲。
+"""
+
+class BatchQueue(object):
+    # 有界队列, 每个元素是一批报文(列表), depth是最多缓存的批次数
+
+    def __init__(self, depth: int) -> None:
+        self.depth = depth
+        self.queue: Queue[List[Any]] = Queue(depth)
+        self.full_waits = 0 # 队列满导致put等待的次数
+        self.dropped = 0    # 队列满时try_put丢弃的批次数
+
+    def put(self, batch: List[Any], stats: Union[StageStats, None] = None) -> None:
+        try:
+            self.queue.put_nowait(batch)
+            return
+        except Full:
+            pass
+        self.full_waits += 1
+        start = perf_counter()
+        self.queue.put(batch)
+        if stats != None:
+            stats.blocked += perf_counter() - start
+
+    def try_put(self, batch: List[Any]) -> bool:
+        # 不阻塞, 队列满时丢弃
+        try:
+            self.queue.put_nowait(batch)
+            return True
+        except Full:
+            self.dropped += 1
+            return False
+
+    def get(self, max_size: int, stats: Union[StageStats, None] = None) -> List[Any]:
+        # 阻塞等待第一批, 然后合并队列中已有的批次, 最多max_size个元素
+        start = perf_counter()
+        batch = self.queue.get()
+        if stats != None:
+            stats.idle += perf_counter() - start
+        try:
+            while len(batch) < max_size:
+                batch = batch + self.queue.get_nowait()
+        except Empty:
+            pass
+        return batch
+
+    def qsize(self) -> int:
+        return self.queue.qsize()
+
+class RxStage(Thread):
+    def __init__(self, netdev_manager: 'NetDeviceManageThread', out_queue: BatchQueue, batch_size: int) -> None:
+        super().__init__()
+        self.setDaemon(True)
+        self.name = "rx"
+        self.netdev_manager = netdev_manager
+        self.out_queue = out_queue
+        self.batch_size = batch_size
+        self.stats = StageStats()
+
+    def run(self) -> None:
+        stats = self.stats
+        while True:
+            devs = {dev.tap: dev for dev in self.netdev_manager.veth_devices}
+            start = perf_counter()
+            rlist, _, _ = select(list(devs), [], [])
+            busy = perf_counter()
+            stats.idle += busy - start
+            # 每个可读的tap读一个报文, 然后不阻塞地再select, 直到没有报文或者攒够一批
+            batch: List[Packetbuffer] = []
+            while len(rlist) != 0 and len(batch) < self.batch_size:
+                for tap in rlist:
+                    pkb = devs[tap].read_pkb()
+                    if pkb != None:
+                        batch.append(pkb)
+                rlist, _, _ = select(list(devs), [], [], 0)
+            stats.busy += perf_counter() - busy
+            if len(batch) != 0:
+                stats.batches += 1
+                stats.packets += len(batch)
+                self.out_queue.put(batch, stats)
+
+class ProtoStage(Thread):
+    def __init__(self, ether: 'EthernetThread', in_queue: BatchQueue, batch_size: int) -> None:
+        super().__init__()
+        self.setDaemon(True)
+        self.name = "proto"
+        self.ether = ether
+        self.in_queue = in_queue
+        self.batch_size = batch_size
+        self.stats = StageStats()
+
+    def run(self) -> None:
+        stats = self.stats
+        while True:
+            batch = self.in_queue.get(self.batch_size, stats)
+            start = perf_counter()
+            self.ether.process_batch(batch)
+            stats.busy += perf_counter() - start
+            stats.batches += 1
+            stats.packets += len(batch)
+
+class Pipeline(object):
+    BATCH_SIZE = 64
+    QUEUE_DEPTH = 64
+
+    def __init__(self, ether: 'EthernetThread', netdev_manager: 'NetDeviceManageThread', logger_manager: 'Logger',
+                 batch_size: int = BATCH_SIZE, queue_depth: int = QUEUE_DEPTH) -> None:
+        self.logger = logger_manager.get_logger("netdev")
+        self.netdev_manager = netdev_manager
+        self.batch_size = batch_size
+        self.queue_depth = queue_depth
+        self.rx_queue = BatchQueue(queue_depth)
+        self.rx = RxStage(netdev_manager, self.rx_queue, batch_size)
+        self.proto = ProtoStage(ether, self.rx_queue, batch_size)
+        self.tx: Dict['NetDevice', 'TxRing'] = {}
+
+    def start(self) -> None:
+        # 发送阶段就是每个网卡的发送环
+        self.netdev_manager.rx_batch_queue = self.rx_queue
+        for dev in self.netdev_manager.veth_devices:
+            if dev.tx_ring != None:
+                self.tx[dev] = dev.tx_ring
+        self.proto.start()
+        self.rx.start()
+        self.logger.info("pipeline started, batch size: %d, queue depth: %d" % (self.batch_size, self.queue_depth))
+
+    def show(self) -> None:
+        # InQueue是阶段的输入队列, FullWaits是上游因为该队列满而等待的次数, Dropped是队列满丢弃的批次数(环回报文)或报文数(发送环)
+        stages: List[Any] = [(self.rx, None), (self.proto, self.rx_queue)] + [(ring, ring) for ring in self.tx.values()]
+        print("%-12s%-10s%-10s%-10s%-8s%-8s%-8s%-12s%-10s%-10s" % ("Stage", "Batches", "Packets", "AvgBatch", "Busy%", "Idle%", "Block%", "InQueue", "FullWaits", "Dropped"))
+        for stage, in_queue in stages:
+            stats = stage.stats
+            elapsed = perf_counter() - stats.started
+            print("%-12s%-10d%-10d%-10.1f%-8.1f%-8.1f%-8.1f%-12s%-10s%-10s" % (stage.name, stats.batches, stats.packets,
+                stats.packets / stats.batches if stats.batches else 0,
+                stats.utilization() * 100, stats.idle / elapsed * 100, stats.blocked / elapsed * 100,
+                "%d/%d" % (in_queue.qsize(), in_queue.depth) if in_queue != None else "-",
+                in_queue.full_waits if in_queue != None else "-",
+                in_queue.dropped if in_queue != None else "-"))
@@ -1,9 +1,10 @@
 from queue import Queue
 from ..eth import MacAddressType, EtherType
-from typing import TYPE_CHECKING, Any, Union
+from typing import TYPE_CHECKING, Any, Tuple, Union
 if TYPE_CHECKING:
     from ..netdev.dev import NetDevice
     from ..ip.route import RouteEntry
+    from ..ip.route.dst import DstEntry
 
 class Packetbuffer(object):
     def __init__(self, data: bytes = b'', indev: Union['NetDevice', None] = None) -> None:
@@ -13,7 +14,10 @@ class Packetbuffer(object):
         self.protocol: EtherType = EtherType.UNKNOWN
         self.mac_type: MacAddressType = MacAddressType.NONE
         self.rtdst: Union['RouteEntry', None] = None
+        self.dst_entry: Union['DstEntry', None] = None
         self.sock: Any = None
+        # tcp四元组(本端地址, 本端端口, 对端地址, 对端端口), 由BatchClassifier填写, 用于按流分组
+        self.flow: Union[Tuple[int, int, int, int], None] = None
 
 class PKBQueue(Queue): # type: ignore
     def __init__(self, maxsize: int = 0) -> None:
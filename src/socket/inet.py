@@ -90,8 +90,8 @@ class InetSocket(Socket):
 
     def connect(self, sock_addr: SockAddr) -> None:
         assert self.sock != None
-        if self.sock.addr == None:
-            raise ValueError("socket is not bind")
+        if self.sock.addr == None: # 没有bind, connect时选择本地地址和端口
+            self.sock.addr = SockAddr()
         
         if self.sock.addr.dst_port != 0:
             raise Exception("can not connect twice")
@@ -115,6 +115,21 @@ class InetSocket(Socket):
         assert self.sock != None
         self.sock.send_buf(data)
 
+    def set_congestion(self, name: str) -> None:
+        if not isinstance(self.sock, TCPSock):
+            raise ValueError("socket is not tcp socket")
+        self.sock.set_congestion(name)
+
+    def set_timestamps(self, enable: bool) -> None:
+        if not isinstance(self.sock, TCPSock):
+            raise ValueError("socket is not tcp socket")
+        self.sock.set_timestamps(enable)
+
+    def info(self) -> Dict[str, Any]:
+        if not isinstance(self.sock, TCPSock):
+            raise ValueError("socket is not tcp socket")
+        return self.sock.info()
+
     def send(self):
         "send"
 
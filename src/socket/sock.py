@@ -1,11 +1,13 @@
 from abc import ABC, abstractmethod
-from typing import Union, TYPE_CHECKING
-from .. import HashBucket, Wait
+from typing import Any, Union, TYPE_CHECKING
+from .. import Wait
 from . import SockAddr
 from ..ip import IPAddress
 from ..ip import IPProto
 from ..pkb import PKBQueue, Packetbuffer
 from ..ip.route import RouteEntry
+from ..ip.route.dst import DstEntry
+from ..netdev.busypoll import BusyPoll
 if TYPE_CHECKING:
     from . import Socket
     from ..stack import TeeceepeeStack
@@ -19,11 +21,13 @@ class Sock(ABC):
         self.addr: Union[SockAddr, None] = None
         self.socket: Union['Socket', None] = None 
         self.rtdst: Union[RouteEntry, None] = None
+        self.dst_entry: Union[DstEntry, None] = None # 路由变化后通过generation失效
         self.recv_queue = PKBQueue()
         self.recv_wait = Wait()
+        # 接收时没有数据, 先忙轮询再睡眠(SO_BUSY_POLL)
+        self.busy_poll: Union[BusyPoll, None] = BusyPoll(stack.busy_poll) if stack.busy_poll > 0 else None
 
-        self.hash_num: int = -1
-        self.hash_bucket: Union[HashBucket, None] = None
+        self.hash_key: Any = None # 在协议的查找表中的键, 没有加入查找表时为None
 
     @abstractmethod
     def recv_notify(self) -> None:
@@ -1,4 +1,4 @@
-from typing import Union, Tuple
+from typing import Any, Dict, Union, Tuple
 from . import SockAddr, Socket
 from . import SocketFamily, SocketState
 from ..ip import IPAddress, IPProto
@@ -85,6 +85,27 @@ class socket(object):
             raise Exception("socket was closed!")
         self.socket.write(data)
     
+    def set_congestion(self, name: str) -> None:
+        # 设置拥塞控制算法(linux的TCP_CONGESTION选项)
+        if self.socket == None:
+            raise Exception("socket was closed!")
+        assert isinstance(self.socket, InetSocket)
+        self.socket.set_congestion(name)
+
+    def set_timestamps(self, enable: bool) -> None:
+        # 是否使用RFC 7323的时间戳选项, 在connect或者listen之前设置
+        if self.socket == None:
+            raise Exception("socket was closed!")
+        assert isinstance(self.socket, InetSocket)
+        self.socket.set_timestamps(enable)
+
+    def info(self) -> Dict[str, Any]:
+        # 连接的统计信息(linux的TCP_INFO选项)
+        if self.socket == None:
+            raise Exception("socket was closed!")
+        assert isinstance(self.socket, InetSocket)
+        return self.socket.info()
+
     def close(self):
         if self.socket != None:
             self.socket.close()
@@ -5,17 +5,22 @@ from .netdev.vethdev import VethNetDevice
 from .ip import IPAddress
 from .ip.route.cache import RouteCacheManager
 from .logger_manager import Logger
+from .tcp.cong import CongestionControlTable
 
 class TeeceepeeStack():
     
-    def __init__(self):
+    def __init__(self, vector_size: int = 0, pipelined: bool = False, busy_poll: int = 0, mtu: int = 1500, congestion: str = "cubic"):
+        if CongestionControlTable.get(congestion) == None:
+            raise ValueError("unknown congestion control: %s (available: %s)" % (congestion, CongestionControlTable.names()))
         self.logger_manager = Logger()
+        self.busy_poll = busy_poll # 忙轮询的预算(微秒), 用于网卡接收和socket接收
+        self.congestion = congestion # tcp套接字默认的拥塞控制算法
         self.arp_cache_manager = ArpCacheManager(self.logger_manager)
-        self.netdev_manager = NetDeviceManageThread(self.logger_manager)
+        self.netdev_manager = NetDeviceManageThread(self.logger_manager, busy_poll)
         self.route_cache_manager = RouteCacheManager(self.netdev_manager, self.logger_manager)
-        self.ether = EthernetThread(self.arp_cache_manager, self.netdev_manager, self.route_cache_manager, self.logger_manager)
-        veth0 = VethNetDevice("veth0", self.logger_manager, IPAddress("10.0.0.1"), 24, IPAddress("10.0.0.2"), 24)
-        veth1 = VethNetDevice("veth1", self.logger_manager, IPAddress("10.1.1.1"), 24, None)
+        self.ether = EthernetThread(self.arp_cache_manager, self.netdev_manager, self.route_cache_manager, self.logger_manager, vector_size, pipelined)
+        veth0 = VethNetDevice("veth0", self.logger_manager, IPAddress("10.0.0.1"), 24, IPAddress("10.0.0.2"), 24, mtu=mtu)
+        veth1 = VethNetDevice("veth1", self.logger_manager, IPAddress("10.1.1.1"), 24, None, mtu=mtu)
         self.ether.netdev_manager.add_veth_device(veth0)
         self.ether.netdev_manager.add_veth_device(veth1)
         self.ether.start()
@@ -0,0 +1,18 @@
+from time import perf_counter
+
+"""
+处理阶段的统计信息, 流水线的各个阶段(pipeline.py)和网卡的发送环(netdev/txring.py)共用
+"""
+
+class StageStats(object):
+    def __init__(self) -> None:
+        self.batches = 0
+        self.packets = 0
+        self.busy = 0.0    # 处理报文的时间(秒)
+        self.idle = 0.0    # 等待输入的时间
+        self.blocked = 0.0 # 下游队列满, 等待的时间
+        self.started = perf_counter()
+
+    def utilization(self) -> float:
+        elapsed = perf_counter() - self.started
+        return self.busy / elapsed if elapsed > 0 else 0.0
@@ -1,6 +1,8 @@
 import struct
 from typing import Union
 from ..ip import IPAddress, IPHdr, IPProto
+from ..checksum import csum_fold, csum_partial
+from .options import TCPOptions
 from enum import Enum
 
 class TCPState(Enum):
@@ -52,8 +54,15 @@ class TCPHdr(object):
         self.checksum = checksum
         self.urgptr = urgptr
         self.options = options
+        self.opts: Union[TCPOptions, None] = None # 解析以后的选项, 没有选项时是None
         self.data = data
 
+    def set_options(self, opts: TCPOptions) -> None:
+        # 头部长度包括选项
+        self.opts = opts
+        self.options = opts.to_bytes()
+        self.data_offset = self.TCP_HDR_LEN + len(self.options)
+
     """
     TCP Pseudo Header:(用于计算校验和)
      ________________________________________________
@@ -64,9 +73,9 @@ class TCPHdr(object):
     """
     @staticmethod
     def tcp_hdr_checksum(data: bytes, src_ipaddr: IPAddress, dst_ipaddr: IPAddress) -> int:
+        # 伪头部和tcp报文分别求反码和再相加, 不用把报文拷贝到伪头部后面
         tcp_presudo_hdr = struct.pack("!IIBBH", int(src_ipaddr), int(dst_ipaddr), 0, IPProto.TCP.value, len(data))
-        tcp_presudo_hdr += data
-        return IPHdr.checksum(tcp_presudo_hdr)
+        return csum_fold(csum_partial(data, csum_partial(tcp_presudo_hdr)))
     
 
     @classmethod
@@ -85,7 +94,10 @@ class TCPHdr(object):
             fin = True if flags & 0b00000001 == 0b00000001 else False
             option = data[cls.TCP_HDR_LEN:data_offset]
             data = data[data_offset:]
-            return cls(src_port, dst_port, seqn, ackn, data_offset, cwr, ece, urg, ack, psh, rst, syn, fin, window, checksum, urgptr, option, data)
+            tcp_hdr = cls(src_port, dst_port, seqn, ackn, data_offset, cwr, ece, urg, ack, psh, rst, syn, fin, window, checksum, urgptr, option, data)
+            if option:
+                tcp_hdr.opts = TCPOptions.from_bytes(option)
+            return tcp_hdr
         except:
             return None
 
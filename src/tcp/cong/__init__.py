@@ -0,0 +1,110 @@
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Type, Union, TYPE_CHECKING
+if TYPE_CHECKING:
+    from ..sock import TCPSock
+
+"""
+拥塞控制:
+  每个套接字有一个拥塞控制算法的实例(sock.cong), 维护sock.cwnd和sock.ssthresh(单位是字节),
+  发送时在飞行中的数据(snd_nxt - snd_una)不能超过min(cwnd, snd_wnd)。
+  算法有pacing_rate时(字节/秒), 发送还要按这个速率平滑, 而不是一次把窗口发完。
+
+  协议栈在下面的时候调用算法:
+    init:             连接建立, 知道了mss
+    on_ack:           收到确认了新数据的ack(带RTT样本和发送速率样本)
+    on_dupack:        快速恢复中收到重复ack
+    on_loss:          收到3个重复ack, 进入快速恢复
+    on_partial_ack:   快速恢复中收到部分确认
+    on_recovery_exit: 快速恢复结束
+    on_rto:           重传超时
+  基类按RFC 5681和RFC 6582(NewReno)实现快速恢复期间的窗口膨胀和收缩, 算法只需要实现拥塞避免的窗口增长和ssthresh。
+
+  算法通过CongestionControlTable.register注册, 按名字选择: 协议栈的默认算法(TeeceepeeStack(congestion=...)),
+  或者每个套接字单独设置(socket.set_congestion)。
+"""
+
+class CongestionControl(ABC):
+    name = ""
+    INFINITE_SSTHRESH = 0x7fffffff
+
+    def __init__(self, sock: 'TCPSock') -> None:
+        self.sock = sock
+        self.mss = 536 # 连接建立以后更新
+        sock.cwnd = self.initial_window()
+        sock.ssthresh = self.INFINITE_SSTHRESH
+
+    def initial_window(self) -> int:
+        # RFC 6928
+        return min(10 * self.mss, max(2 * self.mss, 14600))
+
+    def init(self, mss: int) -> None:
+        self.mss = mss
+        self.sock.cwnd = self.initial_window()
+        self.sock.ssthresh = self.INFINITE_SSTHRESH
+
+    def flight_size(self) -> int:
+        return self.sock.snd_nxt - self.sock.snd_una
+
+    def cwnd_limited(self, acked: int) -> bool:
+        # 发送受对端窗口或者应用层限制时cwnd没有被用满, 不应该继续增长(和linux的tcp_is_cwnd_limited类似)
+        return 2 * (self.flight_size() + acked) >= self.sock.cwnd
+
+    @abstractmethod
+    def on_ack(self, acked: int, rtt: Union[float, None], rate: Union[float, None]) -> None:
+        "on_ack"
+
+    @abstractmethod
+    def ssthresh(self) -> int:
+        "丢包以后的ssthresh"
+
+    def on_loss(self) -> None:
+        sock = self.sock
+        sock.ssthresh = self.ssthresh()
+        sock.cwnd = sock.ssthresh + 3 * self.mss
+
+    def on_dupack(self) -> None:
+        # 每个重复ack说明有一个报文段离开了网络, 可以再发送一个
+        self.sock.cwnd += self.mss
+
+    def on_partial_ack(self, acked: int) -> None:
+        sock = self.sock
+        sock.cwnd = max(sock.cwnd - acked, self.mss)
+        if acked >= self.mss:
+            sock.cwnd += self.mss
+
+    def on_recovery_exit(self) -> None:
+        sock = self.sock
+        sock.cwnd = min(sock.ssthresh, max(self.flight_size(), self.mss) + self.mss)
+
+    def on_rto(self) -> None:
+        sock = self.sock
+        sock.ssthresh = self.ssthresh()
+        sock.cwnd = self.mss
+
+    def pacing_rate(self) -> Union[float, None]:
+        return None
+
+    def info(self) -> Dict[str, Any]:
+        return {}
+
+class CongestionControlTable(object):
+    cong_table: Dict[str, Type[CongestionControl]] = {}
+
+    @classmethod
+    def register(cls, name: str) -> Callable[[Type[CongestionControl]], Type[CongestionControl]]:
+        def wrapper(cong_class: Type[CongestionControl]) -> Type[CongestionControl]:
+            cong_class.name = name
+            cls.cong_table[name] = cong_class
+            return cong_class
+        return wrapper
+
+    @classmethod
+    def get(cls, name: str) -> Union[Type[CongestionControl], None]:
+        return cls.cong_table.get(name, None)
+
+    @classmethod
+    def names(cls) -> str:
+        return " ".join(cls.cong_table.keys())
+
+# 注册算法
+from . import reno, cubic, bbr
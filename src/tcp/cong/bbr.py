@@ -0,0 +1,179 @@
+from time import perf_counter
+from typing import Any, Dict, List, Union, TYPE_CHECKING
+from . import CongestionControl, CongestionControlTable
+if TYPE_CHECKING:
+    from ..sock import TCPSock
+
+"""
+类似BBR(v1)的算法: 不把丢包当作拥塞信号, 而是测量网络的模型:
+  btl_bw:  瓶颈带宽, 最近10轮(每轮约一个RTT)发送速率样本的最大值
+  min_rtt: 最近10秒RTT样本的最小值
+  BDP = btl_bw * min_rtt
+  按 pacing_gain * btl_bw 的速率平滑发送(pacing), cwnd = cwnd_gain * BDP 只是飞行中数据的上限。
+
+  STARTUP:   pacing_gain = 2/ln2, 每轮发送速率翻倍, 连续3轮带宽增长不到25%说明管道满了
+  DRAIN:     pacing_gain = ln2/2, 排空STARTUP在瓶颈队列中积累的数据, 飞行中的数据不超过BDP时进入PROBE_BW
+  PROBE_BW:  每个min_rtt切换一次pacing_gain: 1.25(探测更多带宽), 0.75(排空探测产生的队列), 然后6个1
+  PROBE_RTT: min_rtt 10秒没有更新时, cwnd降到4个mss并保持200毫秒, 排空队列测量真实的min_rtt
+
+  简化: 没有区分受应用层限制的速率样本, 丢包恢复只做报文守恒(cwnd不小于飞行中的数据)。
+"""
+
+class BBRMode(object):
+    STARTUP = "startup"
+    DRAIN = "drain"
+    PROBE_BW = "probe_bw"
+    PROBE_RTT = "probe_rtt"
+
+@CongestionControlTable.register("bbr")
+class BBR(CongestionControl):
+    HIGH_GAIN = 2.885 # 2/ln2
+    DRAIN_GAIN = 1 / HIGH_GAIN
+    CWND_GAIN = 2.0
+    PACING_GAIN_CYCLE = [1.25, 0.75, 1, 1, 1, 1, 1, 1]
+    BW_FILTER_ROUNDS = 10
+    MIN_RTT_WINDOW = 10.0 # 秒
+    PROBE_RTT_TIME = 0.2  # 秒
+    FULL_BW_THRESH = 1.25
+    FULL_BW_ROUNDS = 3
+    MIN_CWND_SEGMENTS = 4
+
+    def __init__(self, sock: 'TCPSock') -> None:
+        super().__init__(sock)
+        self.mode = BBRMode.STARTUP
+        self.pacing_gain = self.HIGH_GAIN
+        self.cwnd_gain = self.HIGH_GAIN
+        self.bw_samples: List[float] = [] # 最近每一轮的最大速率样本
+        self.round_bw = 0.0       # 当前这一轮的最大速率样本
+        self.round_count = 0
+        self.next_round_seq = 0   # snd_una越过这里时一轮结束
+        self.min_rtt: Union[float, None] = None
+        self.min_rtt_stamp = perf_counter()
+        self.full_bw = 0.0
+        self.full_bw_count = 0
+        self.filled_pipe = False
+        self.cycle_index = 0
+        self.cycle_stamp = 0.0
+        self.probe_rtt_done = 0.0
+        self.prior_cwnd = 0
+
+    def btl_bw(self) -> float:
+        return max(self.bw_samples + [self.round_bw])
+
+    def bdp(self) -> int:
+        if self.min_rtt == None:
+            return self.initial_window()
+        return int(self.btl_bw() * self.min_rtt)
+
+    def min_cwnd(self) -> int:
+        return self.MIN_CWND_SEGMENTS * self.mss
+
+    def pacing_rate(self) -> Union[float, None]:
+        bw = self.btl_bw()
+        if bw == 0:
+            return None
+        return self.pacing_gain * bw
+
+    def new_round(self) -> None:
+        self.round_count += 1
+        self.bw_samples.append(self.round_bw)
+        if len(self.bw_samples) > self.BW_FILTER_ROUNDS:
+            self.bw_samples.pop(0)
+        self.round_bw = 0.0
+        self.next_round_seq = self.sock.snd_nxt
+        # 管道满了没有: 连续几轮带宽增长都不到25%
+        if not self.filled_pipe:
+            bw = self.btl_bw()
+            if bw >= self.full_bw * self.FULL_BW_THRESH:
+                self.full_bw = bw
+                self.full_bw_count = 0
+            else:
+                self.full_bw_count += 1
+                if self.full_bw_count >= self.FULL_BW_ROUNDS:
+                    self.filled_pipe = True
+
+    def enter_probe_bw(self, now: float) -> None:
+        self.mode = BBRMode.PROBE_BW
+        self.cwnd_gain = self.CWND_GAIN
+        self.cycle_index = 2 # 从增益为1的阶段开始
+        self.cycle_stamp = now
+        self.pacing_gain = self.PACING_GAIN_CYCLE[self.cycle_index]
+
+    def update_mode(self, now: float, filter_expired: bool) -> None:
+        sock = self.sock
+        if self.mode == BBRMode.STARTUP and self.filled_pipe:
+            self.mode = BBRMode.DRAIN
+            self.pacing_gain = self.DRAIN_GAIN
+        if self.mode == BBRMode.DRAIN and self.flight_size() <= self.bdp():
+            self.enter_probe_bw(now)
+        if self.mode == BBRMode.PROBE_BW and self.min_rtt != None and now - self.cycle_stamp > self.min_rtt:
+            self.cycle_index = (self.cycle_index + 1) % len(self.PACING_GAIN_CYCLE)
+            self.cycle_stamp = now
+            self.pacing_gain = self.PACING_GAIN_CYCLE[self.cycle_index]
+        # min_rtt很久没有更新, 排空队列重新测量
+        if self.mode != BBRMode.PROBE_RTT and filter_expired:
+            self.mode = BBRMode.PROBE_RTT
+            self.pacing_gain = 1.0
+            self.prior_cwnd = max(self.prior_cwnd, sock.cwnd)
+            self.probe_rtt_done = now + self.PROBE_RTT_TIME
+        if self.mode == BBRMode.PROBE_RTT and now >= self.probe_rtt_done:
+            self.min_rtt_stamp = now
+            sock.cwnd = max(sock.cwnd, self.prior_cwnd)
+            self.prior_cwnd = 0
+            if self.filled_pipe:
+                self.enter_probe_bw(now)
+            else:
+                self.mode = BBRMode.STARTUP
+                self.pacing_gain = self.cwnd_gain = self.HIGH_GAIN
+
+    def on_ack(self, acked: int, rtt: Union[float, None], rate: Union[float, None]) -> None:
+        sock = self.sock
+        now = perf_counter()
+        if rate != None and rate > self.round_bw:
+            self.round_bw = rate
+        # 必须在更新min_rtt之前判断, 否则过期时的样本会刷新min_rtt_stamp, 永远进不了PROBE_RTT(同linux的bbr_update_min_rtt)
+        filter_expired = now - self.min_rtt_stamp > self.MIN_RTT_WINDOW
+        if rtt != None and (self.min_rtt == None or rtt <= self.min_rtt or filter_expired):
+            self.min_rtt = rtt
+            self.min_rtt_stamp = now
+        if sock.snd_una >= self.next_round_seq:
+            self.new_round()
+        self.update_mode(now, filter_expired)
+
+        if self.mode == BBRMode.PROBE_RTT:
+            sock.cwnd = self.min_cwnd()
+            return
+        if sock.in_recovery: # 报文守恒
+            sock.cwnd = max(sock.cwnd, self.flight_size() + acked)
+            return
+        # 同linux的bbr_set_cwnd: 管道满了以后不超过target, 之前只在低于target(或者还没有确认完初始窗口)时增长
+        target = max(int(self.cwnd_gain * self.bdp()), self.min_cwnd())
+        if self.filled_pipe:
+            sock.cwnd = min(sock.cwnd + acked, target)
+        elif sock.cwnd < target or sock.delivered < self.initial_window():
+            sock.cwnd += acked
+        sock.cwnd = max(sock.cwnd, self.min_cwnd())
+
+    def ssthresh(self) -> int:
+        # 不用ssthresh, 只记录丢包前的窗口, 恢复结束以后还原
+        self.prior_cwnd = max(self.prior_cwnd, self.sock.cwnd)
+        return self.sock.ssthresh
+
+    def on_loss(self) -> None:
+        self.ssthresh()
+        self.sock.cwnd = max(self.flight_size(), self.mss)
+
+    def on_partial_ack(self, acked: int) -> None:
+        # 恢复期间只做报文守恒(on_ack中已经处理), 不像NewReno那样减小cwnd
+        pass
+
+    def on_recovery_exit(self) -> None:
+        self.sock.cwnd = max(self.sock.cwnd, self.prior_cwnd)
+        self.prior_cwnd = 0
+
+    def on_rto(self) -> None:
+        self.ssthresh()
+        self.sock.cwnd = self.mss
+
+    def info(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "btl_bw": int(self.btl_bw()), "min_rtt": self.min_rtt, "pacing_gain": self.pacing_gain}
@@ -0,0 +1,80 @@
+from time import perf_counter
+from typing import Any, Dict, Union, TYPE_CHECKING
+from . import CongestionControlTable
+from .reno import Reno
+if TYPE_CHECKING:
+    from ..sock import TCPSock
+
+"""
+CUBIC(RFC 9438), linux的默认算法:
+  拥塞避免阶段cwnd按距离上一次丢包的时间t的三次函数增长(单位是报文段):
+    W_cubic(t) = C * (t - K)^3 + W_max,  K = cbrt(W_max * (1 - beta) / C)
+  丢包前的窗口W_max附近增长很慢, 离开W_max以后越来越快, 和RTT无关, 适合长肥网络。
+  同时按Reno的速度估计W_est, cwnd不小于W_est(在小BDP的网络中和Reno一样公平)。
+  丢包: W_max = cwnd, ssthresh = cwnd * beta;
+       快速收敛: 这次丢包时的窗口比上一次小, 说明有新的流加入, W_max再减小一些让出带宽
+  慢启动和Reno一样。
+"""
+
+@CongestionControlTable.register("cubic")
+class Cubic(Reno):
+    C = 0.4
+    BETA = 0.7
+    FAST_CONVERGENCE = True
+
+    def __init__(self, sock: 'TCPSock') -> None:
+        super().__init__(sock)
+        self.w_max = 0.0      # 上一次丢包时的窗口(报文段)
+        self.k = 0.0
+        self.epoch_start: Union[float, None] = None # 这一次拥塞避免开始的时间
+        self.origin = 0.0     # 三次函数的原点(报文段)
+        self.w_est = 0.0      # Reno的窗口估计(报文段)
+        self.min_rtt: Union[float, None] = None
+        self.frac = 0.0       # 不到一个字节的窗口增量
+
+    def on_ack(self, acked: int, rtt: Union[float, None], rate: Union[float, None]) -> None:
+        sock = self.sock
+        if rtt != None and (self.min_rtt == None or rtt < self.min_rtt):
+            self.min_rtt = rtt
+        if sock.in_recovery or not self.cwnd_limited(acked):
+            return
+        if sock.cwnd < sock.ssthresh:
+            acked = self.slow_start(acked)
+            if acked == 0:
+                return
+        mss = self.mss
+        cwnd = sock.cwnd / mss
+        now = perf_counter()
+        if self.epoch_start == None:
+            self.epoch_start = now
+            if cwnd < self.w_max:
+                self.k = ((self.w_max - cwnd) / self.C) ** (1 / 3)
+                self.origin = self.w_max
+            else:
+                self.k = 0.0
+                self.origin = cwnd
+            self.w_est = cwnd
+        rtt = self.min_rtt if self.min_rtt != None else 0.0
+        t = now - self.epoch_start + rtt
+        target = self.origin + self.C * (t - self.k) ** 3
+        target = min(max(target, cwnd), 1.5 * cwnd)
+        # Reno友好: 每个RTT增加 3 * (1 - beta) / (1 + beta) 个报文段
+        self.w_est += 3 * (1 - self.BETA) / (1 + self.BETA) * (acked / mss) / cwnd
+        target = max(target, self.w_est)
+        self.frac += (target - cwnd) / cwnd * acked
+        increase = int(self.frac)
+        if increase > 0:
+            sock.cwnd += increase
+            self.frac -= increase
+
+    def ssthresh(self) -> int:
+        cwnd = self.sock.cwnd / self.mss
+        self.epoch_start = None
+        if self.FAST_CONVERGENCE and cwnd < self.w_max:
+            self.w_max = cwnd * (1 + self.BETA) / 2
+        else:
+            self.w_max = cwnd
+        return max(int(self.sock.cwnd * self.BETA), 2 * self.mss)
+
+    def info(self) -> Dict[str, Any]:
+        return {"w_max": int(self.w_max * self.mss), "k": self.k}
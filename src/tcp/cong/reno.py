@@ -0,0 +1,40 @@
+from typing import Union, TYPE_CHECKING
+from . import CongestionControl, CongestionControlTable
+if TYPE_CHECKING:
+    from ..sock import TCPSock
+
+"""
+Reno(RFC 5681):
+  慢启动:   cwnd < ssthresh时, 每个ack增加确认的字节数(最多2个mss, RFC 3465)
+  拥塞避免: 每确认一个cwnd的数据, cwnd增加一个mss
+  丢包:     ssthresh = max(飞行中的数据 / 2, 2 * mss)
+"""
+
+@CongestionControlTable.register("reno")
+class Reno(CongestionControl):
+    def __init__(self, sock: 'TCPSock') -> None:
+        super().__init__(sock)
+        self.acked_bytes = 0 # 拥塞避免阶段累计确认的字节数
+
+    def slow_start(self, acked: int) -> int:
+        # 返回慢启动以后剩下的确认字节数
+        sock = self.sock
+        increase = min(acked, 2 * self.mss, sock.ssthresh - sock.cwnd)
+        sock.cwnd += increase
+        return acked - increase
+
+    def on_ack(self, acked: int, rtt: Union[float, None], rate: Union[float, None]) -> None:
+        sock = self.sock
+        if sock.in_recovery or not self.cwnd_limited(acked):
+            return
+        if sock.cwnd < sock.ssthresh:
+            acked = self.slow_start(acked)
+            if acked == 0:
+                return
+        self.acked_bytes += acked
+        if self.acked_bytes >= sock.cwnd:
+            self.acked_bytes -= sock.cwnd
+            sock.cwnd += self.mss
+
+    def ssthresh(self) -> int:
+        return max(self.flight_size() // 2, 2 * self.mss)
@@ -0,0 +1,104 @@
+import struct
+from typing import List, Tuple, Union
+
+"""
+TCP选项(RFC 9293, RFC 7323):
+  kind=0(EOL)表示选项结束, kind=1(NOP)用来对齐, 其他选项都是:
+   ____________________________________
+  | kind  | len   | value              |
+  |_______|_______|____________________|
+  | 8bits | 8bits | (len - 2) bytes    |
+  |_______|_______|____________________|
+  len包括kind和len两个字节
+
+  MSS(kind=2, len=4):        本端能接收的最大报文段(不包括IP和TCP头部), 只在SYN中
+  WSCALE(kind=3, len=3):     窗口扩大因子, 双方的SYN中都有时, SYN以外报文段的窗口字段都要左移这个值, 只在SYN中
+  TIMESTAMP(kind=8, len=10): TSval(32bits, 发送时的时间戳) | TSecr(32bits, 回显对端最近的TSval)
+                             双方的SYN中都有时, 之后所有的报文段都带这个选项:
+                             RTTM: 收到ack时 now - TSecr 就是一个RTT样本(重传的报文段也可以)
+                             PAWS: TSval比之前收到的小的报文段是序号回绕以前的旧报文段, 丢弃
+  SACK_PERMITTED(kind=4, len=2): 可以使用SACK, 只在SYN中
+  SACK(kind=5, len=2+8n):    n个已经收到的乱序数据块, 每个块是 左边界(32bits) | 右边界(32bits, 块之后的第一个序号)
+                             选项最长40字节, 有时间戳选项时最多3个块, 否则最多4个块
+
+  选项总长度必须是4字节的整数倍(头部长度的单位是4字节), 编码时在选项前面加NOP对齐
+"""
+
+class TCPOptionKind(object):
+    EOL = 0
+    NOP = 1
+    MSS = 2
+    WSCALE = 3
+    SACK_PERMITTED = 4
+    SACK = 5
+    TIMESTAMP = 8
+
+def ts_before(a: int, b: int) -> bool:
+    # 32位的时间戳会回绕, 按差值的符号比较
+    return (a - b) & 0xffffffff >= 0x80000000
+
+class TCPOptions(object):
+    TCP_MAX_WSCALE = 14 # 窗口最大是1GB
+    TCP_TIMESTAMP_LEN = 12 # 时间戳选项对齐以后的长度
+    TCP_MAX_SACK_BLOCKS = 4
+
+    def __init__(self, mss: Union[int, None] = None, wscale: Union[int, None] = None,
+        ts_val: Union[int, None] = None, ts_ecr: int = 0,
+        sack_ok: bool = False, sack: Union[List[Tuple[int, int]], None] = None) -> None:
+        self.mss = mss
+        self.wscale = wscale
+        self.ts_val = ts_val # 没有时间戳选项时是None
+        self.ts_ecr = ts_ecr
+        self.sack_ok = sack_ok
+        self.sack: List[Tuple[int, int]] = sack if sack != None else [] # (左边界, 右边界)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'TCPOptions':
+        # 长度不对的选项和它之后的选项都忽略
+        opts = cls()
+        i = 0
+        n = len(data)
+        while i < n:
+            kind = data[i]
+            if kind == TCPOptionKind.EOL:
+                break
+            if kind == TCPOptionKind.NOP:
+                i += 1
+                continue
+            if i + 1 >= n:
+                break
+            length = data[i + 1]
+            if length < 2 or i + length > n:
+                break
+            if kind == TCPOptionKind.MSS and length == 4:
+                opts.mss = struct.unpack("!H", data[i + 2:i + 4])[0]
+            elif kind == TCPOptionKind.WSCALE and length == 3:
+                opts.wscale = min(data[i + 2], cls.TCP_MAX_WSCALE)
+            elif kind == TCPOptionKind.TIMESTAMP and length == 10:
+                opts.ts_val, opts.ts_ecr = struct.unpack("!II", data[i + 2:i + 10])
+            elif kind == TCPOptionKind.SACK_PERMITTED and length == 2:
+                opts.sack_ok = True
+            elif kind == TCPOptionKind.SACK and (length - 2) % 8 == 0:
+                for j in range(i + 2, i + length, 8):
+                    opts.sack.append(struct.unpack("!II", data[j:j + 8]))
+            i += length
+        return opts
+
+    def to_bytes(self) -> bytes:
+        data = b""
+        if self.mss != None:
+            data += struct.pack("!BBH", TCPOptionKind.MSS, 4, self.mss)
+        if self.wscale != None:
+            data += struct.pack("!BBBB", TCPOptionKind.NOP, TCPOptionKind.WSCALE, 3, self.wscale)
+        if self.ts_val != None:
+            data += struct.pack("!BBBBII", TCPOptionKind.NOP, TCPOptionKind.NOP, TCPOptionKind.TIMESTAMP, 10, self.ts_val, self.ts_ecr)
+        if self.sack_ok:
+            data += struct.pack("!BBBB", TCPOptionKind.NOP, TCPOptionKind.NOP, TCPOptionKind.SACK_PERMITTED, 2)
+        if self.sack:
+            data += struct.pack("!BBBB", TCPOptionKind.NOP, TCPOptionKind.NOP, TCPOptionKind.SACK, 2 + 8 * len(self.sack))
+            for start, end in self.sack:
+                data += struct.pack("!II", start, end)
+        return data
+
+    def __str__(self) -> str:
+        return "mss: %s wscale: %s ts_val: %s ts_ecr: %s sack_ok: %s sack: %s" % (self.mss, self.wscale, self.ts_val, self.ts_ecr, self.sack_ok, self.sack)
@@ -0,0 +1,116 @@
+import os
+import hashlib
+from threading import Lock
+from typing import Callable, Dict, Tuple
+
+"""
+端口分配:
+  bind:    bind指定端口(或者端口为0时分配一个临时端口)是独占的, 每个本地地址一个端口位图记录被bind的端口。
+           绑定0.0.0.0的端口和所有本地地址冲突。
+  connect: 没有bind端口时, 按RFC 6056 Algorithm 3选择临时端口:
+             offset = F(本端地址, 对端地址, 对端端口, secret)
+             port = low + (offset + next_ephemeral + i) % num_ephemeral, i = 0, 1, 2...
+           只要求四元组不重复, 同一个端口可以连接不同的对端, 所以一个客户端可以建立远多于64k个连接。
+           不同的对端从不同的偏移开始查找(不可预测), 同一个对端依次使用下一个端口(避免很快重用同一个四元组)。
+"""
+
+class PortAllocator(object):
+    EPHEMERAL_LOW = 32768 # 和linux的ip_local_port_range一样
+    EPHEMERAL_HIGH = 60999
+    MAX_PORT = 65535
+
+    def __init__(self, low: int = EPHEMERAL_LOW, high: int = EPHEMERAL_HIGH) -> None:
+        if not (0 < low <= high <= self.MAX_PORT):
+            raise ValueError("invalid ephemeral port range %d-%d" % (low, high))
+        self.low = low
+        self.high = high
+        self.secret = os.urandom(16)
+        self.next_ephemeral = 0
+        self.bound: Dict[int, bytearray] = {} # 本地地址 -> 端口位图(每个端口一个字节), 1表示被bind独占
+        self.conn_refs: Dict[Tuple[int, int], int] = {} # (本地地址, 端口) -> 使用该端口的主动连接数
+        self.conn_ports: Dict[int, int] = {} # 端口 -> 所有本地地址上使用该端口的主动连接数
+        self.lock = Lock()
+
+    def _bound(self, addr: int, port: int) -> bool:
+        if addr == 0: # 0.0.0.0和任何地址上的同一个端口冲突
+            return any(ports[port] for ports in self.bound.values())
+        ports = self.bound.get(addr)
+        wildcard = self.bound.get(0)
+        return (ports is not None and ports[port] != 0) or (wildcard is not None and wildcard[port] != 0)
+
+    def _conn_used(self, addr: int, port: int) -> bool:
+        if addr == 0:
+            return port in self.conn_ports
+        return (addr, port) in self.conn_refs
+
+    def _set_bound(self, addr: int, port: int) -> None:
+        ports = self.bound.get(addr)
+        if ports is None:
+            ports = self.bound[addr] = bytearray(self.MAX_PORT + 1)
+        ports[port] = 1
+
+    def port_used(self, addr: int, port: int) -> bool:
+        with self.lock:
+            return self._bound(addr, port) or self._conn_used(addr, port)
+
+    def bind(self, addr: int, port: int) -> int:
+        # 返回绑定的端口, port为0时分配临时端口, 没有可用端口时返回0
+        with self.lock:
+            if port != 0:
+                if self._bound(addr, port) or self._conn_used(addr, port):
+                    return 0
+                self._set_bound(addr, port)
+                return port
+            # 从随机位置开始, 在位图中查找第一个空闲的端口
+            ports = self.bound.get(addr)
+            if ports is None:
+                ports = self.bound[addr] = bytearray(self.MAX_PORT + 1)
+            num = self.high - self.low + 1
+            start = self.low + int.from_bytes(os.urandom(4), "big") % num
+            for first, last in ((start, self.high + 1), (self.low, start)):
+                port = ports.find(0, first, last)
+                while port != -1:
+                    if not self._bound(addr, port) and not self._conn_used(addr, port):
+                        ports[port] = 1
+                        return port
+                    port = ports.find(0, port + 1, last)
+            return 0
+
+    def connect(self, addr: int, dst_addr: int, dst_port: int, in_use: Callable[[int], bool]) -> int:
+        # in_use(port)判断四元组是否已经被使用, 返回选择的端口, 没有可用端口时返回0
+        num = self.high - self.low + 1
+        digest = hashlib.blake2b(addr.to_bytes(4, "big") + dst_addr.to_bytes(4, "big") + dst_port.to_bytes(2, "big"),
+            key=self.secret, digest_size=4).digest()
+        offset = int.from_bytes(digest, "big")
+        with self.lock:
+            for i in range(num):
+                port = self.low + (offset + self.next_ephemeral + i) % num
+                if self._bound(addr, port) or in_use(port):
+                    continue
+                self.next_ephemeral += i + 1
+                key = (addr, port)
+                self.conn_refs[key] = self.conn_refs.get(key, 0) + 1
+                self.conn_ports[port] = self.conn_ports.get(port, 0) + 1
+                return port
+        return 0
+
+    def release(self, addr: int, port: int, exclusive: bool) -> None:
+        with self.lock:
+            if exclusive:
+                ports = self.bound.get(addr)
+                if ports is not None:
+                    ports[port] = 0
+                return
+            key = (addr, port)
+            if key not in self.conn_refs:
+                return
+            count = self.conn_refs[key] - 1
+            if count > 0:
+                self.conn_refs[key] = count
+            else:
+                del self.conn_refs[key]
+            count = self.conn_ports[port] - 1
+            if count > 0:
+                self.conn_ports[port] = count
+            else:
+                del self.conn_ports[port]
@@ -0,0 +1,143 @@
+from collections import deque
+from time import perf_counter
+from typing import Deque, List, Tuple, Union
+
+"""
+重传队列:
+  已经发送但是还没有被确认的报文段按序号顺序保存在队列中, 数据是应用层写入的bytes的memoryview(只是引用, 不拷贝)。
+  收到ack时从队头删除被完全确认的报文段, 部分确认的报文段只是移动memoryview的起点。
+  使用SACK时队列也是记分板: 被对端sack的报文段标记为sacked, 重传时跳过, 只重传空洞。
+
+RTO计算(RFC 6298):
+  第一个RTT样本R:  SRTT = R, RTTVAR = R / 2
+  之后的样本:      RTTVAR = 3/4 * RTTVAR + 1/4 * |SRTT - R|
+                  SRTT = 7/8 * SRTT + 1/8 * R
+  RTO = SRTT + max(G, 4 * RTTVAR), G是定时器的精度
+  Karn算法: 被重传过的报文段的ack有二义性(不知道确认的是哪一次发送), 不作为RTT样本;
+           超时以后RTO加倍(退避), 直到收到没有重传过的报文段的ack得到新的样本才重新计算。
+"""
+
+class RetransSegment(object):
+    __slots__ = ("seqn", "data", "fin", "sent", "retrans", "delivered", "delivered_time", "sacked")
+
+    def __init__(self, seqn: int, data: memoryview, fin: bool = False) -> None:
+        self.seqn = seqn
+        self.data = data
+        self.fin = fin
+        self.sent = 0.0   # 最近一次发送的时间
+        self.retrans = 0  # 重传的次数
+        self.delivered = 0 # 发送时已经确认的字节数和时间, 用于计算发送速率样本
+        self.delivered_time = 0.0
+        self.sacked = False # 对端已经收到(乱序)
+
+    @property
+    def end(self) -> int:
+        # 报文段之后的第一个序号, fin占一个序号
+        return self.seqn + len(self.data) + int(self.fin)
+
+class RetransQueue(object):
+    def __init__(self) -> None:
+        self.queue: Deque[RetransSegment] = deque()
+        self.bytes = 0 # 队列中的数据字节数
+        self.last_acked: Union[RetransSegment, None] = None # 最近一次ack确认的最后一个报文段
+        self.sacked_bytes = 0 # 队列中被sack的数据字节数
+        self.high_sacked = 0 # 被sack的最大序号
+        self.sacked_sent = 0.0 # 被sack的报文段最晚的发送时间
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+    def head(self) -> Union[RetransSegment, None]:
+        return self.queue[0] if self.queue else None
+
+    def add(self, seg: RetransSegment) -> None:
+        self.queue.append(seg)
+        self.bytes += len(seg.data)
+
+    def ack(self, ackn: int) -> Tuple[int, Union[float, None]]:
+        # 删除ackn之前的数据, 返回(确认的数据字节数, RTT样本), 有重传过的报文段被确认时没有RTT样本
+        queue = self.queue
+        acked = 0
+        last: Union[RetransSegment, None] = None
+        ambiguous = False
+        while queue and queue[0].end <= ackn:
+            seg = queue.popleft()
+            acked += len(seg.data)
+            if seg.sacked:
+                self.sacked_bytes -= len(seg.data)
+            last = seg
+            if seg.retrans:
+                ambiguous = True
+        if queue and queue[0].seqn < ackn: # 部分确认
+            seg = queue[0]
+            n = ackn - seg.seqn
+            if seg.sacked:
+                self.sacked_bytes -= n
+            seg.data = seg.data[n:]
+            seg.seqn = ackn
+            acked += n
+        self.bytes -= acked
+        self.last_acked = last
+        rtt = None
+        if last is not None and not ambiguous:
+            rtt = perf_counter() - last.sent
+        return acked, rtt
+
+    def sack(self, start: int, end: int) -> int:
+        # 标记完全在[start, end)中的报文段, 返回新被sack的数据字节数
+        sacked = 0
+        for seg in self.queue:
+            if seg.seqn >= end:
+                break
+            if not seg.sacked and seg.seqn >= start and seg.end <= end:
+                seg.sacked = True
+                sacked += len(seg.data)
+                self.high_sacked = max(self.high_sacked, seg.end)
+                self.sacked_sent = max(self.sacked_sent, seg.sent)
+        self.sacked_bytes += sacked
+        return sacked
+
+    def reset_sacked(self) -> None:
+        # 对端丢弃了sack过的数据(reneging), 之前的sack信息都不能用了
+        for seg in self.queue:
+            seg.sacked = False
+        self.sacked_bytes = 0
+        self.high_sacked = 0
+        self.sacked_sent = 0.0
+
+    def segments(self) -> List[RetransSegment]:
+        return list(self.queue)
+
+    def clear(self) -> None:
+        self.queue.clear()
+        self.bytes = 0
+        self.sacked_bytes = 0
+        self.high_sacked = 0
+        self.sacked_sent = 0.0
+
+class RTOEstimator(object):
+    RTO_INIT = 1.0
+    RTO_MIN = 0.2 # 和linux一样(RFC 6298要求1秒, 对本地网络太长)
+    RTO_MAX = 60.0
+    CLOCK_GRANULARITY = 0.001 # 定时器的精度(时间轮的tick)
+
+    def __init__(self) -> None:
+        self.srtt: Union[float, None] = None
+        self.rttvar = 0.0
+        self.rto = self.RTO_INIT
+        self.backoff = 0 # 连续超时的次数
+
+    def sample(self, rtt: float) -> None:
+        if self.srtt == None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.backoff = 0
+        self.rto = min(max(self.srtt + max(self.CLOCK_GRANULARITY, 4 * self.rttvar), self.RTO_MIN), self.RTO_MAX)
+
+    def timeout(self) -> None:
+        # 超时退避
+        self.backoff += 1
+        self.rto = min(self.rto * 2, self.RTO_MAX)
@@ -5,12 +5,18 @@ from ..socket.sock import Sock
 from ..ip import IPAddress, IPProto
 from ..pkb import Packetbuffer
 from queue import Queue
-from typing import Union, TYPE_CHECKING, List
-from .. import HashBucket, Wait
-from threading import Lock
+from collections import deque
+from typing import Any, Deque, Dict, Tuple, Union, TYPE_CHECKING, List
+from .. import Wait
+from .port import PortAllocator
+from .retrans import RetransQueue, RTOEstimator
+from .tcp_timer import TCPTimer, TCPTimerType
+from .cong import CongestionControl, CongestionControlTable
+from threading import Lock, RLock
 if TYPE_CHECKING:
     from ..tcp.tcp import TCP
     from ..stack import TeeceepeeStack
+    from ..timer.wheel import WheelTimer
 
 class ByteBuffer(object):
     
@@ -38,65 +44,98 @@ class ByteBuffer(object):
             l = len(self.data)
         return l
 
+EHashKey = Tuple[int, int, int, int] # (本端地址, 本端端口, 对端地址, 对端端口)
+LHashKey = Tuple[int, int]           # (本端地址, 本端端口), 地址为0表示监听所有地址
+
 class TCPSockManager(object):
-    TCP_EHASH_SIZE = 0x40
-    TCP_LHASH_SIZE = 0x20
-    TCP_BHASH_SIZE = 0x100
+    """
+    收到tcp报文时按四元组查找established表(包括SYN_RECV等所有非监听状态的套接字),
+    找不到再按(地址, 端口)查找listen表, 最后查找监听0.0.0.0的套接字。
+    两个表都是dict, 地址转换成int以后和端口组成元组作为键, 查找只需要一次dict.get。
+    查找不加锁(dict的单个操作在GIL下是原子的), lock只用于串行化插入和删除。
+    """
     def __init__(self, tcp: 'TCP') -> None:
-        self.listening_socks = HashBucket(self.TCP_EHASH_SIZE)
-        self.bind_socks = HashBucket(self.TCP_EHASH_SIZE)
-        self.estabilished_socks = HashBucket(self.TCP_EHASH_SIZE)
+        self.listening_socks: Dict[LHashKey, 'TCPSock'] = {}
+        self.ports = PortAllocator() # bind和connect的端口分配
+        self.estabilished_socks: Dict[EHashKey, 'TCPSock'] = {}
+        self.lock = Lock()
         self.tcp = tcp
         self.tcp_id: int = 0
 
     def lookup(self, src_ipaddr: IPAddress, dst_ipaddr: IPAddress, src_port: int, dst_port: int) -> Union['TCPSock', None]:
-        sock = self.lookup_estabilished(src_ipaddr, dst_ipaddr, src_port, dst_port)
-        if sock == None:
-            sock = self.lookup_listen(src_ipaddr, src_port)
+        src = int(src_ipaddr)
+        sock = self.estabilished_socks.get((src, src_port, int(dst_ipaddr), dst_port))
+        if sock is None:
+            sock = self.listening_socks.get((src, src_port))
+            if sock is None:
+                sock = self.listening_socks.get((0, src_port))
         return sock
 
     def lookup_estabilished(self, src_ipaddr: IPAddress, dst_ipaddr: IPAddress, src_port: int, dst_port: int) -> Union['TCPSock', None]:
-        hash = self.estabilished_socks.hash(src_ipaddr, src_port, dst_ipaddr, dst_port)
-        for sock in self.estabilished_socks.get(hash):
-            assert isinstance(sock, TCPSock)
-            assert sock.addr is not None
-            if sock.addr.src_ipaddr == src_ipaddr and sock.addr.src_port == src_port and sock.addr.dst_ipaddr == dst_ipaddr and sock.addr.dst_port == dst_port:
-                return sock
-        return None
+        return self.estabilished_socks.get((int(src_ipaddr), src_port, int(dst_ipaddr), dst_port))
     
     def lookup_listen(self, ipaddr: IPAddress, port: int) -> Union['TCPSock', None]:
-        hash = self.listening_socks.hash(ipaddr, port)
-        for sock in self.listening_socks.get(hash):
-            assert isinstance(sock, TCPSock)
-            assert sock.addr is not None
-            if sock.addr.src_ipaddr == ipaddr and sock.addr.src_port == port:
-                return sock
-        return None
+        sock = self.listening_socks.get((int(ipaddr), port))
+        if sock is None:
+            sock = self.listening_socks.get((0, port))
+        return sock
+
+    def hash(self, sock: 'TCPSock') -> bool:
+        # 监听的套接字加入listen表, 其他的加入established表, 已经存在相同的键时返回False
+        assert sock.addr is not None
+        addr = sock.addr
+        key: Union[EHashKey, LHashKey]
+        if sock.state == TCPState.LISTEN:
+            key = (int(addr.src_ipaddr), addr.src_port)
+            table: Dict[Any, 'TCPSock'] = self.listening_socks
+        else:
+            key = (int(addr.src_ipaddr), addr.src_port, int(addr.dst_ipaddr), addr.dst_port)
+            table = self.estabilished_socks
+        with self.lock:
+            if key in table:
+                return False
+            table[key] = sock
+            sock.hash_key = key
+        return True
+
+    def unhash(self, sock: 'TCPSock') -> None:
+        with self.lock:
+            key = sock.hash_key
+            if key is None:
+                return
+            table: Dict[Any, 'TCPSock'] = self.listening_socks if len(key) == 2 else self.estabilished_socks
+            if table.get(key) is sock:
+                del table[key]
+            sock.hash_key = None
 
     def show(self):
         print("ESTABLISHED SOCKETS")
-        for bucket in self.estabilished_socks.hash_bucket.values():
-            for sock in bucket:
-                assert isinstance(sock, TCPSock)
-                assert sock.addr is not None
-                print(sock.addr.src_ipaddr, sock.addr.src_port, sock.addr.dst_ipaddr, sock.addr.dst_port, sock.state)
+        for sock in list(self.estabilished_socks.values()):
+            assert sock.addr is not None
+            print(sock.addr.src_ipaddr, sock.addr.src_port, sock.addr.dst_ipaddr, sock.addr.dst_port, sock.state,
+                "%s cwnd %d ssthresh %d" % (sock.cong.name, sock.cwnd, sock.ssthresh))
         
         print("LISTENING SOCKETS")
-        for bucket in self.listening_socks.hash_bucket.values():
-            for sock in bucket:
-                assert isinstance(sock, TCPSock)
-                assert sock.addr is not None
-                print(sock.addr.src_ipaddr, sock.addr.src_port, sock.state)
+        for sock in list(self.listening_socks.values()):
+            assert sock.addr is not None
+            print(sock.addr.src_ipaddr, sock.addr.src_port, sock.state)
 
 class TCPSockFlag():
     UNSET = 0
     PUSH = 0x01
     ACK_NOW = 0x02
     ACK_LATER = 0x04
+    FIN_PENDING = 0x08 # close以后fin等待发送缓冲区中的数据发送完再发送
+    FIN_SENT = 0x10
 
 class TCPSock(Sock):
     TCP_MAX_BACKLOG = 128
-    TCP_DEFAULT_WINDOW_SIZE = 4096
+    TCP_MAX_WINDOW = 0xffff # 头部中窗口字段的最大值, 更大的窗口需要窗口扩大选项
+    TCP_RCVBUF = 256 * 1024 # 接收缓冲区的大小(接收窗口的最大值)
+    TCP_DEFAULT_MSS = 536 # 对端没有通告mss时使用(RFC 9293)
+    TCP_TIMESTAMPS = True # 默认使用时间戳选项
+    TCP_SACK = True
+    TCP_SNDBUF = 256 * 1024 # 发送缓冲区(没有发送的和没有确认的数据)的大小
     def __init__(self, stack: 'TeeceepeeStack', proto: IPProto = IPProto.TCP) -> None:
         super().__init__(stack, proto)
         self.backlog = 0
@@ -105,11 +144,14 @@ class TCPSock(Sock):
         self.parent: Union['TCPSock', None] = None
         self.flag = TCPSockFlag.UNSET
         self.state: TCPState = TCPState.CLOSED
-        self.bhash_bucket: Union[HashBucket, None] = None
-        self.bhash_num = -1
+        self.port_key: Union[Tuple[int, int], None] = None # 占用的(本地地址, 端口)
+        self.port_exclusive = False # bind独占端口, 否则是connect选择的临时端口
 
         self.wait_accept = Wait() # 用于等待accept
         self.wait_connect = Wait() # 用于等待连接建立
+        self.send_wait = Wait() # 用于等待发送缓冲区有空间
+        # 协议栈线程(收到报文), 定时器线程和应用层线程都会修改套接字的状态
+        self.lock = RLock()
 
         self.rcv_buf = ByteBuffer()
         # 保存乱序的tcp segment
@@ -138,6 +180,27 @@ class TCPSock(Sock):
         self.snd_wl1 = 0 # 上一次更新发送窗口的seq
         self.snd_wl2 = 0 # 上一次更新发送窗口的ack
         self.iss = 0 # 初始化的发送序列号
+
+        self.snd_queue: Deque[memoryview] = deque() # 发送缓冲区中还没有发送的数据
+        self.snd_queued = 0
+        self.retrans_queue = RetransQueue() # 已经发送但是没有确认的报文段
+        self.rto = RTOEstimator()
+        self.dupacks = 0 # 连续收到的重复ack数
+        self.in_recovery = False # 快速恢复中
+        self.rto_recovery = False # 超时重传以后, 重传recover之前的报文段
+        self.recover = 0 # 进入恢复时的snd_nxt, 确认到这里时退出恢复
+        self.retrans_next = 0 # 超时重传以后下一个要重传的序号
+        self.retransmits = 0
+        self.fast_retransmits = 0
+        self.timeouts = 0
+
+        # 拥塞控制, 单位都是字节
+        self.cwnd = 0
+        self.ssthresh = 0
+        self.delivered = 0 # 被确认的总字节数
+        self.delivered_time = 0.0
+        self.pacing_next = 0.0 # pacing时下一个报文段最早的发送时间
+        self.cong: CongestionControl = self.new_cong(stack.congestion)
         """
                            rcv_nxt(TCP_HDR.ack)
                               ↓
@@ -148,14 +211,85 @@ class TCPSock(Sock):
                             
         """
         self.rcv_nxt = 0 # 等待接收的下一个字节
-        self.rcv_wnd = self.TCP_DEFAULT_WINDOW_SIZE # 接收窗口大小
+        self.rcv_wnd = self.TCP_RCVBUF # 接收窗口大小
         self.rcv_up = 0
         self.irs = 0 # 初始化的接收序列号
 
+        # SYN中协商的选项
+        self.mss = self.TCP_DEFAULT_MSS # 对端通告的mss, 发送的报文段不超过这个大小
+        self.wscale_ok = False # 双方都带了窗口扩大选项
+        self.snd_wscale = 0 # 对端的窗口扩大因子, 收到的窗口左移snd_wscale
+        self.rcv_wscale = 0 # 本端的窗口扩大因子, 通告的窗口右移rcv_wscale
+        while self.TCP_RCVBUF >> self.rcv_wscale > self.TCP_MAX_WINDOW:
+            self.rcv_wscale += 1
+        self.timestamps = self.TCP_TIMESTAMPS # 本端是否使用时间戳选项(socket.set_timestamps)
+        self.ts_ok = False # 双方都带了时间戳选项
+        self.ts_recent = 0 # 要回显给对端的TSval
+        self.ts_recent_stamp = 0.0 # 更新ts_recent的时间
+        self.last_ack_sent = 0 # 最近发送的ack序号
+        self.sack_ok = False # 双方都带了SACK_PERMITTED选项
+        self.sack_last = 0 # 最近收到的乱序报文段的序号, 包含它的块放在SACK选项的第一个
+
         self.tcp_sock_manager.tcp_id += 1
 
-        self.timeout = 0.0
+        self.timers: Dict['TCPTimerType', 'WheelTimer'] = {} # 每种定时器一个, 第一次设置时创建
     
+    def rcv_window(self, syn: bool = False) -> int:
+        # 头部中通告的窗口, SYN中的窗口不扩大
+        shift = 0 if syn else self.rcv_wscale
+        return min(max(self.rcv_wnd, 0) >> shift, self.TCP_MAX_WINDOW)
+
+    def set_timestamps(self, enable: bool) -> None:
+        # 只影响之后的握手, 连接建立以后不能改变
+        with self.lock:
+            if self.state not in [TCPState.CLOSED, TCPState.LISTEN]:
+                raise Exception("timestamps can only be set before connect or listen")
+            self.timestamps = enable
+
+    def new_cong(self, name: str) -> CongestionControl:
+        cong_class = CongestionControlTable.get(name)
+        if cong_class == None:
+            raise ValueError("unknown congestion control: %s (available: %s)" % (name, CongestionControlTable.names()))
+        return cong_class(self)
+
+    def set_congestion(self, name: str) -> None:
+        # 和TCP_CONGESTION选项一样, 连接建立以后切换算法时按当前的mss重新初始化
+        with self.lock:
+            mss = self.cong.mss
+            self.cong = self.new_cong(name)
+            if self.state not in [TCPState.CLOSED, TCPState.LISTEN, TCPState.SYN_SENT, TCPState.SYN_RECV]:
+                self.cong.init(mss)
+
+    def info(self) -> Dict[str, Any]:
+        # 和linux的TCP_INFO类似
+        assert self.addr is not None
+        info: Dict[str, Any] = {
+            "state": self.state.name,
+            "congestion": self.cong.name,
+            "mss": self.cong.mss,
+            "cwnd": self.cwnd,
+            "ssthresh": self.ssthresh,
+            "snd_wnd": self.snd_wnd,
+            "rcv_wnd": self.rcv_wnd,
+            "snd_mss": self.mss,
+            "snd_wscale": self.snd_wscale,
+            "rcv_wscale": self.rcv_wscale,
+            "timestamps": self.ts_ok,
+            "sack": self.sack_ok,
+            "sacked": self.retrans_queue.sacked_bytes,
+            "bytes_in_flight": self.snd_nxt - self.snd_una,
+            "bytes_acked": self.delivered,
+            "srtt": self.rto.srtt,
+            "rttvar": self.rto.rttvar,
+            "rto": self.rto.rto,
+            "pacing_rate": self.cong.pacing_rate(),
+            "retransmits": self.retransmits,
+            "fast_retransmits": self.fast_retransmits,
+            "timeouts": self.timeouts,
+        }
+        info.update(self.cong.info())
+        return info
+
     def recv_notify(self) -> None:
         self.recv_wait.wake_up()
 
@@ -189,7 +323,19 @@ class TCPSock(Sock):
         ]:
             pass
 
-        return self.stack.ether.ip.tcp.tcp_text.send_text(self, data)
+        # 数据只是被引用(bytes不可变), 直到被确认才释放
+        buf = memoryview(data if isinstance(data, bytes) else bytes(data))
+        tcp_text = self.stack.ether.ip.tcp.tcp_text
+        sent = 0
+        while sent < len(buf):
+            with self.lock:
+                if self.state not in [TCPState.ESTABLISHED, TCPState.CLOSE_WAIT]:
+                    raise Exception("socket is closed")
+                n = tcp_text.send_text(self, buf[sent:])
+            sent += n
+            if n == 0 and self.send_wait.sleep_on() == False: # 发送缓冲区满, 等待对端确认
+                raise Exception("reset by peer")
+        return sent
 
     def recv(self) -> Packetbuffer:
         raise NotImplementedError() # for udp
@@ -218,49 +364,37 @@ class TCPSock(Sock):
         
         data = b""
         while len(data) == 0:
+            if len(self.rcv_buf) == 0 and self.busy_poll != None:
+                self.busy_poll.spin(lambda: len(self.rcv_buf) != 0)
             if len(self.rcv_buf) == 0:
                 if self.recv_wait.sleep_on() == False:
                     raise Exception("reset by peer")
-            data = self.rcv_buf.read(size)
-            self.rcv_wnd += len(data)
+            with self.lock:
+                data = self.rcv_buf.read(size)
+                rcv_wnd = self.rcv_wnd
+                self.rcv_wnd += len(data)
+                # 接收窗口重新打开时马上通知对端, 不用等对端的零窗口探测
+                max_wnd = min(self.TCP_RCVBUF, self.TCP_MAX_WINDOW << self.rcv_wscale) # 能通告的最大窗口
+                if rcv_wnd < max_wnd // 2 <= self.rcv_wnd and self.state == TCPState.ESTABLISHED:
+                    self.stack.ether.ip.tcp.tcp_out.send_ack(self, None)
         
         return data
 
     def hash(self) -> bool:
         if self.state == TCPState.CLOSED:
             return False
-        assert self.addr is not None
-        if self.state == TCPState.LISTEN: # 监听状态, 套接字移动到listening hash表中
-            self.hash_num = self.tcp_sock_manager.listening_socks.hash(self.addr.src_ipaddr, self.addr.src_port)
-            bucket = self.tcp_sock_manager.listening_socks.get(self.hash_num)
-
-        else: # 非监听状态, 套接字移动到established hash表中
-            hash_num = self.tcp_sock_manager.estabilished_socks.hash(self.addr.src_ipaddr, self.addr.src_port, self.addr.dst_ipaddr, self.addr.dst_port)
-            bucket = self.tcp_sock_manager.estabilished_socks.get(hash_num)
-            # check whether the socket is already in estabilished_socks
-            for sock in bucket:
-                if sock.addr.src_ipaddr == self.addr.src_ipaddr and \
-                     sock.addr.src_port == self.addr.src_port and \
-                     sock.addr.dst_ipaddr == self.addr.dst_ipaddr and \
-                     sock.addr.dst_port == self.addr.dst_port:
-                    return False
-            self.hash_num = hash_num
-        bucket.append(self)
-        return True
+        # 监听状态加入listen表, 其他状态加入established表
+        return self.tcp_sock_manager.hash(self)
         
     def unhash(self) -> None:
-        if self.hash_bucket == None:
-            return
-        self.hash_bucket.remove(self.hash_num, self)
-        self.hash_bucket = None
-        self.hash_num = -1
+        self.tcp_sock_manager.unhash(self)
 
     def unbhash(self) -> None:
-        if self.bhash_bucket == None:
+        # 释放占用的端口
+        if self.port_key == None:
             return
-        self.bhash_bucket.remove(self.bhash_num, self)
-        self.bhash_bucket = None
-        self.hash_num = -1
+        self.tcp_sock_manager.ports.release(self.port_key[0], self.port_key[1], self.port_exclusive)
+        self.port_key = None
         
     # tcp和udp的bind是一样的，因此bind函数在inet_socket中实现
     def bind(self) -> int:
@@ -268,20 +402,54 @@ class TCPSock(Sock):
 
     def connect(self, sock_addr: SockAddr)  -> None:
         assert self.addr is not None
+        assert sock_addr.dst_ipaddr is not None
         self.addr.dst_ipaddr = sock_addr.dst_ipaddr
         self.addr.dst_port = sock_addr.dst_port
-
-        self.state = TCPState.SYN_SENT
-        self.iss = self.stack.ether.ip.tcp.tcp_state.tcp_gen_iss()
-        # send syn
-        self.snd_una = self.iss
-        self.snd_nxt = self.iss + 1
-        if self.hash() == False:
-            self.state = TCPState.CLOSED
-            raise Exception("already connected")
-        
-        assert self.socket is not None
-        self.stack.ether.ip.tcp.tcp_out.send_syn(self)
+        dst = int(sock_addr.dst_ipaddr)
+
+        # 没有bind地址时使用出口网卡的地址, 没有bind端口时选择临时端口
+        # 多路径路由的下一跳可能在不同的网卡上, 源地址要用选中的下一跳的网卡地址, 选中的路由缓存在socket中,
+        # 这时源地址和源端口还没有确定, 只能用已知的部分计算流哈希
+        if self.addr.src_ipaddr == None or int(self.addr.src_ipaddr) == 0:
+            route_cache_manager = self.stack.ether.ip.route_cache_manager
+            dst_entry = route_cache_manager.lookup_dst(dst)
+            if dst_entry == None:
+                raise Exception("network is unreachable")
+            route = route_cache_manager.select_output(dst_entry.route,
+                route_cache_manager.tuple_hash(0, dst, IPProto.TCP.value, 0, sock_addr.dst_port))
+            if route.netdev.ipaddr == None:
+                raise Exception("network is unreachable")
+            self.addr.src_ipaddr = route.netdev.ipaddr
+            self.rtdst = route
+            self.dst_entry = dst_entry
+        if self.addr.src_port == 0:
+            src = int(self.addr.src_ipaddr)
+            established = self.tcp_sock_manager.estabilished_socks
+            port = self.tcp_sock_manager.ports.connect(src, dst, sock_addr.dst_port,
+                lambda port: (src, port, dst, sock_addr.dst_port) in established)
+            if port == 0:
+                raise Exception("No port available")
+            self.addr.src_port = port
+            self.port_key = (src, port)
+            self.port_exclusive = False
+
+        tcp_state = self.stack.ether.ip.tcp.tcp_state
+        with self.lock:
+            self.state = TCPState.SYN_SENT
+            self.iss = tcp_state.tcp_gen_iss()
+            # send syn
+            self.snd_una = self.iss
+            self.snd_nxt = self.iss + 1
+            if self.hash() == False:
+                self.state = TCPState.CLOSED
+                if not self.port_exclusive:
+                    self.unbhash()
+                raise Exception("already connected")
+            
+            assert self.socket is not None
+            self.stack.ether.ip.tcp.tcp_out.send_syn(self)
+            # syn丢失时重传
+            tcp_state.tcp_timer.set_timer(self, TCPTimerType.CONNECTION_ESTABLISH, TCPTimer.TCP_CONNECTION_ESTABLISH_TIMEOUT)
         if not self.wait_connect.sleep_on(): # 等待三次握手成功
             self.unhash()
             self.unbhash()
@@ -294,34 +462,22 @@ class TCPSock(Sock):
             self.state = TCPState.CLOSED
             raise Exception("unexpected error")
 
-    def port_used(self, ipaddr:IPAddress, port: int) -> bool:
-        hash = self.tcp_sock_manager.bind_socks.hash(ipaddr, port)
-        for sock in self.tcp_sock_manager.bind_socks.get(hash):
-            assert isinstance(sock, Sock)
-            assert sock.addr is not None
-            if sock.addr.src_ipaddr == ipaddr and sock.addr.src_port == port:
-                return True
-        return False
-
     def set_port(self, src_ipaddr: IPAddress, src_port: int = 0) -> None:
+        # bind: 独占端口, src_port为0时分配一个临时端口
         assert self.addr is not None
-        if src_port == 0:
-            src_port = self.get_port(src_ipaddr)
-        elif self.port_used(src_ipaddr, src_port):
-            raise Exception("Port already used")
-        self.addr.src_port = src_port
-        self.bhash_num = self.tcp_sock_manager.bind_socks.hash(src_ipaddr, src_port)
-        self.tcp_sock_manager.bind_socks.get(self.bhash_num).append(self)
-        self.bhash_bucket = self.tcp_sock_manager.bind_socks # 添加bind的socket到bind_socks中
-
-    def get_port(self, ipaddr: IPAddress) -> int:
-        for port in range(1024, 65535):
-            if not self.port_used(ipaddr, port):
-                return port
-        raise Exception("No port available")
+        port = self.tcp_sock_manager.ports.bind(int(src_ipaddr), src_port)
+        if port == 0:
+            raise Exception("Port already used" if src_port != 0 else "No port available")
+        self.addr.src_port = port
+        self.port_key = (int(src_ipaddr), port)
+        self.port_exclusive = True
 
     def close(self) -> None:
-        tcp_out = self.stack.ether.ip.tcp.tcp_out
+        with self.lock:
+            self._close()
+
+    def _close(self) -> None:
+        tcp_text = self.stack.ether.ip.tcp.tcp_text
         if self.state == TCPState.CLOSED: # 已经关闭了的套接字，不用再关闭了
             return
 
@@ -339,13 +495,13 @@ class TCPSock(Sock):
 
         elif self.state == TCPState.ESTABLISHED: # 主动关闭
             self.state = TCPState.FIN_WAIT1
-            self.stack.ether.ip.tcp.tcp_out.send_fin(self)
-            self.snd_nxt += 1
+            self.flag |= TCPSockFlag.FIN_PENDING # 发送缓冲区中的数据发送完以后发送fin
+            tcp_text.push(self)
 
         elif self.state == TCPState.CLOSE_WAIT: # 表示对方已经关闭连接，close是关闭本端
-            tcp_out.send_fin(self) # 发送fin
             self.state = TCPState.LAST_ACK # 等待对方的ack
-            self.snd_nxt += 1
+            self.flag |= TCPSockFlag.FIN_PENDING
+            tcp_text.push(self)
 
     def listen(self, backlog: int) -> None:
         if self.addr == None:
@@ -1,4 +1,4 @@
-from typing import TYPE_CHECKING
+from typing import Dict, List, Tuple, Union, TYPE_CHECKING
 from src.tcp.tcp_state import TCPStateProcess
 from . import TCPHdr
 from .sock import TCPSockManager
@@ -21,18 +21,55 @@ class TCP():
         self.tcp_text = TCPText(self.tcp_out, logger_manager)
         self.tcp_state = TCPStateProcess(self.tcp_out, self.tcp_text, self.tcp_sock_manager, logger_manager)
 
-    def tcp_recv(self, pkb: Packetbuffer):
+    def parse_segment(self, pkb: Packetbuffer) -> Union[Tuple[IPHdr, TCPHdr], None]:
         eth_hdr = EtherHdr.from_bytes(pkb.data)
         if eth_hdr == None:
-            return
+            return None
 
         ip_hdr = IPHdr.from_bytes(eth_hdr.data)
         if ip_hdr == None:
-            return
+            return None
 
         tcp_hdr = TCPHdr.from_bytes(ip_hdr.data)
         if tcp_hdr == None:
+            return None
+        return ip_hdr, tcp_hdr
+
+    def tcp_recv_batch(self, pkbs: List[Packetbuffer]) -> None:
+        """
+        pkb.flow是BatchClassifier按列取出的四元组(不带SYN/RST的报文), 按流分组以后,
+        每个流只查找一次established表, 只加一次socket的锁, 同一个流的报文保持原来的顺序。
+        找不到established的socket(需要查listen表)或者处理过程中socket被移出了established表, 剩下的报文逐个交给tcp_recv。
+        """
+        flows: Dict[Tuple[int, int, int, int], List[Packetbuffer]] = {}
+        for pkb in pkbs:
+            assert pkb.flow != None
+            group = flows.get(pkb.flow)
+            if group is None:
+                group = flows[pkb.flow] = []
+            group.append(pkb)
+
+        established = self.tcp_sock_manager.estabilished_socks
+        for key, group in flows.items():
+            tcp_sock = established.get(key)
+            done = 0
+            if tcp_sock != None:
+                with tcp_sock.lock:
+                    for pkb in group:
+                        if tcp_sock.hash_key != key:
+                            break
+                        hdrs = self.parse_segment(pkb)
+                        done += 1
+                        if hdrs != None:
+                            self.tcp_state.tcp_process(pkb, TCPSegment(hdrs[0], hdrs[1]), tcp_sock)
+            for pkb in group[done:]:
+                self.tcp_recv(pkb)
+
+    def tcp_recv(self, pkb: Packetbuffer):
+        hdrs = self.parse_segment(pkb)
+        if hdrs == None:
             return
+        ip_hdr, tcp_hdr = hdrs
 
         tcp_sock = self.tcp_sock_manager.lookup(ip_hdr.dst_ipaddr, ip_hdr.src_ipaddr, tcp_hdr.dst_port, tcp_hdr.src_port)
         self.logger.debug("recv: src:%s:%d, dst:%s:%d seqn %d, ackn %d, win: %d" % (ip_hdr.src_ipaddr, tcp_hdr.src_port, ip_hdr.dst_ipaddr, tcp_hdr.dst_port, tcp_hdr.seqn, tcp_hdr.ackn, tcp_hdr.window))
@@ -43,5 +80,6 @@ class TCP():
         
         tcp_segment = TCPSegment(ip_hdr, tcp_hdr)
 
-        self.tcp_state.tcp_process(pkb, tcp_segment, tcp_sock) 
+        with tcp_sock.lock:
+            self.tcp_state.tcp_process(pkb, tcp_segment, tcp_sock) 
 
@@ -1,8 +1,10 @@
 from ..logger_manager import Logger
 from .sock import TCPSock, TCPSockFlag, TCPSockManager
 from . import TCPHdr
+from .options import TCPOptions
 from .segment import TCPSegment
-from typing import Union, TYPE_CHECKING
+from time import perf_counter
+from typing import List, Tuple, Union, TYPE_CHECKING
 from ..ip import IPAddress, IPHdr, IPProtoVer, IPTOS, IPProto
 from ..eth import EtherHdr, MacAddress, EtherType
 from ..pkb import Packetbuffer
@@ -17,32 +19,59 @@ class TCPout(object):
         self.logger_manager = logger_manager
         self.logger = logger_manager.get_logger("tcp") 
 
+    @staticmethod
+    def tcp_time_stamp() -> int:
+        # 时间戳选项的时钟, 1毫秒一个tick
+        return int(perf_counter() * 1000) & 0xffffffff
+
+    def sack_blocks(self, sock: TCPSock) -> List[Tuple[int, int]]:
+        # 乱序队列中相邻的报文段合并成一个块, 包含最近收到的报文段的块放在第一个(RFC 2018)
+        blocks: List[Tuple[int, int]] = []
+        for seg in sock.rcv_reass:
+            if blocks and blocks[-1][1] == seg.seqn:
+                blocks[-1] = (blocks[-1][0], seg.seqn + seg.dlen)
+            else:
+                blocks.append((seg.seqn, seg.seqn + seg.dlen))
+        for i, (start, end) in enumerate(blocks):
+            if start <= sock.sack_last < end:
+                blocks.insert(0, blocks.pop(i))
+                break
+        return blocks[:TCPOptions.TCP_MAX_SACK_BLOCKS - int(sock.ts_ok)]
+
+    def set_options(self, sock: TCPSock, tcp_hdr: TCPHdr, sack: bool = False) -> None:
+        # 连接建立以后的报文段有时间戳选项, 纯ack还有SACK选项(数据报文段不带, 不然会超过mss)
+        sock.last_ack_sent = tcp_hdr.ackn
+        blocks = self.sack_blocks(sock) if sack and sock.sack_ok and sock.rcv_reass else None
+        if sock.ts_ok or blocks:
+            tcp_hdr.set_options(TCPOptions(ts_val=self.tcp_time_stamp() if sock.ts_ok else None, ts_ecr=sock.ts_recent, sack=blocks))
+
+    def advertised_mss(self, sock: TCPSock) -> int:
+        # 通告出口网卡的MTU减去IP和TCP头部
+        assert sock.addr != None
+        route_cache_manager = self.ip.route_cache_manager
+        dst_entry = route_cache_manager.lookup_dst(int(sock.addr.dst_ipaddr))
+        if dst_entry == None:
+            return TCPSock.TCP_DEFAULT_MSS
+        src = int(sock.addr.src_ipaddr) if sock.addr.src_ipaddr != None else None
+        route = route_cache_manager.select_output(dst_entry.route, 0, src)
+        return route.netdev.mtu - IPHdr.IP_HDR_SIZE - TCPHdr.TCP_HDR_LEN
+
     def send_synack(self, sock: TCPSock, segment: TCPSegment) -> None:
         assert sock.addr != None
         out_tcp_hdr = TCPHdr()
         out_tcp_hdr.src_port = sock.addr.src_port
         out_tcp_hdr.dst_port = sock.addr.dst_port
-        out_tcp_hdr.data_offset = TCPHdr.TCP_HDR_LEN
         out_tcp_hdr.seqn = sock.iss
         out_tcp_hdr.ackn = sock.rcv_nxt
         out_tcp_hdr.syn = True
         out_tcp_hdr.ack = True
-        out_tcp_hdr.window = sock.rcv_wnd
+        out_tcp_hdr.window = sock.rcv_window(syn=True)
+        # 对端的SYN中有窗口扩大, 时间戳和SACK_PERMITTED选项时才回复这些选项
+        sock.last_ack_sent = sock.rcv_nxt
+        out_tcp_hdr.set_options(TCPOptions(self.advertised_mss(sock), sock.rcv_wscale if sock.wscale_ok else None,
+            self.tcp_time_stamp() if sock.ts_ok else None, sock.ts_recent, sock.sack_ok))
         self.send_out(sock, out_tcp_hdr, segment)
 
-    def send_fin(self, sock: TCPSock):
-        assert sock.addr != None
-        out_tcp_hdr = TCPHdr()
-        out_tcp_hdr.src_port = sock.addr.src_port
-        out_tcp_hdr.dst_port = sock.addr.dst_port
-        out_tcp_hdr.data_offset = TCPHdr.TCP_HDR_LEN
-        out_tcp_hdr.seqn = sock.snd_nxt
-        out_tcp_hdr.window = sock.rcv_wnd
-        out_tcp_hdr.fin = True
-        out_tcp_hdr.ack = True
-        out_tcp_hdr.ackn = sock.rcv_nxt
-        self.send_out(sock, out_tcp_hdr, None)
-
     def send_ack(self, sock: TCPSock, segment: Union[TCPSegment, None]) -> None:
         assert sock.addr is not None
         out_tcp_hdr = TCPHdr()
@@ -52,7 +81,8 @@ class TCPout(object):
         out_tcp_hdr.seqn = sock.snd_nxt
         out_tcp_hdr.ackn = sock.rcv_nxt
         out_tcp_hdr.ack = True
-        out_tcp_hdr.window = sock.rcv_wnd
+        out_tcp_hdr.window = sock.rcv_window()
+        self.set_options(sock, out_tcp_hdr, sack=True)
         sock.flag &= ~TCPSockFlag.ACK_NOW
         sock.flag &= ~TCPSockFlag.ACK_LATER
         self.send_out(sock, out_tcp_hdr, segment)
@@ -94,13 +124,15 @@ class TCPout(object):
         src_ipaddr, dst_ipaddr, b'', data, 0)
         eth_hdr = EtherHdr(MacAddress(), MacAddress(), EtherType.IP, ip_hdr.to_bytes())
         pkb = Packetbuffer(eth_hdr.to_bytes())
-        if sock and sock.rtdst:
+        if sock and self.ip.route_cache_manager.dst_cache.valid(sock.dst_entry):
             pkb.rtdst = sock.rtdst
+            pkb.dst_entry = sock.dst_entry
         else:
-            if not self.ip.route_cache_manager.route_output(pkb):
+            if not self.ip.route_cache_manager.route_output(pkb, True): # 源地址属于socket的四元组, 不能改写
                 return
             if sock:
                 sock.rtdst = pkb.rtdst
+                sock.dst_entry = pkb.dst_entry
         self.logger.debug("send: src:%s:%d, dst:%s:%d seqn %d, ackn %d, win: %d" % (ip_hdr.src_ipaddr, tcp_hdr.src_port, ip_hdr.dst_ipaddr, tcp_hdr.dst_port, tcp_hdr.seqn, tcp_hdr.ackn, tcp_hdr.window))
         self.logger.debug("      %s", tcp_hdr.get_flags())
         self.ip.ip_send_out(pkb)
@@ -110,9 +142,10 @@ class TCPout(object):
         assert sock.addr != None
         out_tcp_hdr.src_port = sock.addr.src_port
         out_tcp_hdr.dst_port = sock.addr.dst_port
-        out_tcp_hdr.data_offset = TCPHdr.TCP_HDR_LEN
         out_tcp_hdr.syn = True
         out_tcp_hdr.seqn = sock.iss
-        out_tcp_hdr.window = sock.rcv_wnd
+        out_tcp_hdr.window = sock.rcv_window(syn=True)
+        out_tcp_hdr.set_options(TCPOptions(self.advertised_mss(sock), sock.rcv_wscale,
+            self.tcp_time_stamp() if sock.timestamps else None, sack_ok=sock.TCP_SACK))
         self.send_out(sock, out_tcp_hdr, None)
         
\ No newline at end of file
@@ -8,9 +8,12 @@ from . import TCPState
 from ..socket import SockAddr
 from typing import Union
 from .tcp_text import TCPText
+from .options import ts_before
+from time import perf_counter
 
 
 class TCPStateProcess(object):
+    TCP_PAWS_IDLE = 24 * 24 * 3600 # ts_recent超过24天没有更新时失效(RFC 7323)
 
     def __init__(self, tcp_out: TCPout, tcp_text: TCPText, sock_manager: TCPSockManager, logger_manager: Logger) -> None:
         self.tcp_out = tcp_out
@@ -40,6 +43,7 @@ class TCPStateProcess(object):
             return
 
         new_sock = self.tcp_listen_child_sock(sock, segment)
+        self.tcp_syn_options(new_sock, segment)
         new_sock.irs = segment.seqn
         new_sock.iss = self.tcp_gen_iss()
         new_sock.rcv_nxt = segment.seqn + 1 # 为什么要加1：因为这个报文是SYN报文，所以seqn指向的是SYN报文的数据部分，而不是SYN报文的头部
@@ -49,6 +53,8 @@ class TCPStateProcess(object):
 
     def tcp_listen_child_sock(self, sock: TCPSock, segment: TCPSegment) -> TCPSock:
         new_sock = TCPSock(sock.stack, sock.protocol)
+        new_sock.cong = new_sock.new_cong(sock.cong.name) # 继承监听套接字的拥塞控制算法
+        new_sock.timestamps = sock.timestamps
         new_sock.state = TCPState.SYN_RECV
         new_sock.addr = SockAddr()
         new_sock.addr.src_ipaddr = segment.ip_hdr.dst_ipaddr
@@ -56,9 +62,8 @@ class TCPStateProcess(object):
         new_sock.addr.dst_ipaddr = segment.ip_hdr.src_ipaddr
         new_sock.addr.dst_port = segment.tcp_hdr.src_port
 
-        # 保存新的sock到established队列
-        hash_num = self.sock_manager.estabilished_socks.hash(new_sock.addr.src_ipaddr, new_sock.addr.src_port, new_sock.addr.dst_ipaddr, new_sock.addr.dst_port)
-        self.sock_manager.estabilished_socks.get(hash_num).append(new_sock)
+        # 保存新的sock到established表
+        self.sock_manager.hash(new_sock)
 
         new_sock.parent = sock
         sock.listen_list.append(new_sock)
@@ -79,6 +84,7 @@ class TCPStateProcess(object):
                 return
 
         if tcp_hdr.syn:
+            self.tcp_syn_options(sock, segment)
             sock.irs = segment.seqn
             sock.rcv_nxt = segment.seqn + 1
             # if send SYN, recv SYN ACK
@@ -89,6 +95,8 @@ class TCPStateProcess(object):
             # SYN_SENT ------(recv SYN ACK, send ACK)----------> ESTABILISHED
             if sock.snd_una > sock.iss:
                 sock.state = TCPState.ESTABLISHED # 在connect函数中：判断是estabilished的时候向应用层返回成功
+                self.tcp_timer.unset_timer(sock, TCPTimerType.CONNECTION_ESTABLISH)
+                sock.cong.init(self.tcp_text.segment_size(sock))
                 sock.snd_wnd = segment.wnd
                 sock.snd_wl1 = segment.seqn
                 sock.snd_wl2 = segment.ackn
@@ -104,6 +112,26 @@ class TCPStateProcess(object):
                 sock.state = TCPState.SYN_RECV
                 self.tcp_out.send_synack(sock, segment)
         
+    def tcp_syn_options(self, sock: TCPSock, segment: TCPSegment) -> None:
+        # SYN中对端通告的mss和窗口扩大因子, 双方都带了窗口扩大(时间戳, SACK)选项时才扩大窗口(使用时间戳, SACK)
+        opts = segment.tcp_hdr.opts
+        if opts != None and opts.mss:
+            sock.mss = opts.mss
+        if opts != None and opts.wscale != None:
+            sock.wscale_ok = True
+            sock.snd_wscale = opts.wscale
+        else:
+            sock.wscale_ok = False
+            sock.snd_wscale = 0
+            sock.rcv_wscale = 0
+        if sock.timestamps and opts != None and opts.ts_val != None:
+            sock.ts_ok = True
+            sock.ts_recent = opts.ts_val
+            sock.ts_recent_stamp = perf_counter()
+        else:
+            sock.ts_ok = False
+        sock.sack_ok = sock.TCP_SACK and opts != None and opts.sack_ok
+
     def tcp_synrecv_ack(self, sock: TCPSock) -> bool:
         assert sock.parent != None
         if sock.parent.state != TCPState.LISTEN:
@@ -126,7 +154,31 @@ class TCPStateProcess(object):
         if sock == None:
             self.tcp_out.send_reset(sock, segment)
 
+    def tcp_paws_check(self, sock: TCPSock, segment: TCPSegment) -> bool:
+        # PAWS: TSval比ts_recent小的报文段是旧的重复报文段(序号可能已经回绕了), rst不检查
+        opts = segment.tcp_hdr.opts
+        if not sock.ts_ok or opts == None or opts.ts_val == None or segment.tcp_hdr.rst:
+            return True
+        if not ts_before(opts.ts_val, sock.ts_recent):
+            return True
+        # 连接空闲太久时ts_recent失效
+        if perf_counter() - sock.ts_recent_stamp > self.TCP_PAWS_IDLE:
+            return True
+        self.logger.debug("tcp paws check failed: ts_val=%d, ts_recent=%d" % (opts.ts_val, sock.ts_recent))
+        return False
+
+    def tcp_update_ts_recent(self, sock: TCPSock, segment: TCPSegment) -> None:
+        # RFC 7323: 只记录覆盖了last_ack_sent的报文段的TSval, 这样回显的是最早的还没有确认的报文段的时间戳
+        opts = segment.tcp_hdr.opts
+        if not sock.ts_ok or opts == None or opts.ts_val == None:
+            return
+        if segment.seqn <= sock.last_ack_sent and not ts_before(opts.ts_val, sock.ts_recent):
+            sock.ts_recent = opts.ts_val
+            sock.ts_recent_stamp = perf_counter()
+
     def tcp_seq_check(self, sock: TCPSock, segment: TCPSegment) -> bool:
+        if not self.tcp_paws_check(sock, segment):
+            return False
         rcv_end = sock.rcv_nxt + sock.rcv_wnd
         # 保证接收到的数据在接收窗口内
         """
@@ -139,7 +191,10 @@ class TCPStateProcess(object):
         """
         if segment.seqn < rcv_end and sock.rcv_nxt <= segment.lastseqn:
             return True
-        self.logger.warning("tcp seq check failed: seqn=%d, rcv_end=%d, rcv_nxt=%d, rcv_wnd=%d, lastseqn: %d" % (segment.seqn, rcv_end, sock.rcv_nxt, sock.rcv_wnd, segment.lastseqn))
+        # 接收窗口为0时也要能收到对端的ack
+        if segment.len == 0 and segment.seqn == sock.rcv_nxt:
+            return True
+        self.logger.debug("tcp seq check failed: seqn=%d, rcv_end=%d, rcv_nxt=%d, rcv_wnd=%d, lastseqn: %d" % (segment.seqn, rcv_end, sock.rcv_nxt, sock.rcv_wnd, segment.lastseqn))
         return False
     
     # gen init seq number
@@ -152,6 +207,19 @@ class TCPStateProcess(object):
         sock.snd_wl1 = segment.seqn
         sock.snd_wl2 = segment.ackn
 
+    def tcp_abort(self, sock: TCPSock) -> None:
+        # 收到rst或者重传次数太多, 关闭连接并且唤醒所有阻塞的调用
+        sock.state = TCPState.CLOSED
+        self.tcp_timer.unset_timer(sock, TCPTimerType.ANY)
+        sock.retrans_queue.clear()
+        sock.snd_queue.clear()
+        sock.snd_queued = 0
+        sock.recv_wait.wait_exit()
+        sock.send_wait.wait_exit()
+        sock.wait_connect.wait_exit()
+        sock.unbhash()
+        sock.unhash()
+
     # tcp 状态转移
     def tcp_process(self, pkb: Packetbuffer, segment: TCPSegment, sock: TCPSock) -> None:
         tcp_hdr = segment.tcp_hdr
@@ -167,14 +235,23 @@ class TCPStateProcess(object):
         if sock.state == TCPState.SYN_SENT: # 处理tcp主动连接第二次握手 | 处理同时连接
             return self.tcp_synsent(sock, segment)
 
+        # syn ack丢失, 对端重传了syn
+        if sock.state == TCPState.SYN_RECV and tcp_hdr.syn and not tcp_hdr.ack and segment.seqn == sock.irs:
+            return self.tcp_out.send_synack(sock, segment)
+
+        # SYN以外的报文段中的窗口要按对端的窗口扩大因子左移
+        if not tcp_hdr.syn:
+            segment.wnd <<= sock.snd_wscale
+
 ################ 检查序列号 ###############
         if not self.tcp_seq_check(sock, segment):
             # 接收到的数据不在接收窗口内
-            self.logger.warning("tcp seq check failed!")
+            self.logger.debug("tcp seq check failed!")
             if tcp_hdr.rst:
                 return
-            # 表示对端发送的数据不在本端接收窗口内，向对端更新本端的接收窗口
-            sock.flag &= TCPSockFlag.ACK_NOW
+            # 表示对端发送的数据不在本端接收窗口内(比如重传的已经收到的数据)，向对端更新本端的接收窗口
+            return self.tcp_out.send_ack(sock, segment)
+        self.tcp_update_ts_recent(sock, segment)
             
 ################ 处理RST报文 ###############
         if tcp_hdr.rst:
@@ -201,9 +278,8 @@ class TCPStateProcess(object):
             ]:
                 pass
 
-            sock.state = TCPState.CLOSED
-            sock.unbhash()
-            sock.unhash()
+            self.tcp_abort(sock)
+            return
         
 ############### 处理ACK报文 ################
 
@@ -227,6 +303,7 @@ class TCPStateProcess(object):
 
                 # 修改状态
                 sock.state = TCPState.ESTABLISHED
+                sock.cong.init(self.tcp_text.segment_size(sock))
             else:
                 self.tcp_out.send_reset(sock, segment)
                 return
@@ -236,6 +313,7 @@ class TCPStateProcess(object):
             TCPState.CLOSE_WAIT, # 更新接收窗口
             TCPState.LAST_ACK, # LAST_ACK -> CLOSED
             TCPState.FIN_WAIT1, # FIN_WAIT1 -> FIN_WAIT2
+            TCPState.FIN_WAIT2,
             TCPState.CLOSING # TCP_CLOSING -> TIME_WAIT
         ]:
             """
@@ -249,18 +327,23 @@ class TCPStateProcess(object):
             """
             # 在ACK发送了但未ACK的内容
             if sock.snd_una < segment.ackn and segment.ackn <= sock.snd_nxt:
-                if sock.state == TCPState.FIN_WAIT1:
+                # 从重传队列中删除被确认的报文段
+                self.tcp_text.ack_text(sock, segment)
+                # fin是最后一个序号, 所有的序号都被确认时fin也被确认了
+                fin_acked = sock.flag & TCPSockFlag.FIN_SENT and sock.snd_una == sock.snd_nxt
+                if sock.state == TCPState.FIN_WAIT1 and fin_acked:
                     sock.state = TCPState.FIN_WAIT2
                     self.tcp_timer.set_timer(sock, TCPTimerType.FIN_WAIT_2, TCPTimer.TCP_FIN_WAIT2_TIMEOUT)
                     # 处理了ACK报文后，后续继续处理FIN报文： TCP_FIN_WAIT2 -> TCP_TIME_WAIT
 
-                if sock.state == TCPState.CLOSING:
+                if sock.state == TCPState.CLOSING and fin_acked:
                     sock.state = TCPState.TIME_WAIT
                     self.tcp_timer.set_timer(sock, TCPTimerType.TIME_WAIT, TCPTimer.TCP_TIMEWAIT_TIMEOUT)
                     return
 
-                if sock.state == TCPState.LAST_ACK:
+                if sock.state == TCPState.LAST_ACK and fin_acked:
                     sock.state = TCPState.CLOSED
+                    self.tcp_timer.unset_timer(sock, TCPTimerType.ANY)
                     sock.unhash()
                     sock.unbhash()
                     return
@@ -268,22 +351,19 @@ class TCPStateProcess(object):
             # 在ACK没有发送的内容
             elif segment.ackn > sock.snd_nxt:
                 self.logger.warning("ackn > snd_nxt %d > %d" % (segment.ackn, sock.snd_nxt))
-                return
+                return self.tcp_out.send_ack(sock, segment)
 
-            # 在ACK已经ACK的内容
-            elif segment.ackn < sock.snd_una:
-                return
-            
             elif segment.ackn == sock.snd_una:
-                # 当snd_una == snd_nxt的时候
-                pass
+                # 可能是重复ack
+                self.tcp_text.dupack(sock, segment)
 
-            # 更新发送窗口
-            self.tcp_update_window(sock, segment)
+            # 在ACK已经ACK的内容(乱序到达的旧ack), 不更新发送窗口, 继续处理数据
+            if segment.ackn >= sock.snd_una:
+                # 更新发送窗口
+                self.tcp_update_window(sock, segment)
+                # 窗口打开或者有数据被确认, 继续发送发送缓冲区中的数据
+                self.tcp_text.push(sock)
 
-        elif sock.state == TCPState.FIN_WAIT2:
-            return
-    
         elif sock.state == TCPState.TIME_WAIT:
             return
 
@@ -313,12 +393,15 @@ class TCPStateProcess(object):
             TCPState.FIN_WAIT1,
             TCPState.FIN_WAIT2
         ]:
-            if tcp_hdr.psh and segment.dlen > 0:
+            if segment.dlen > 0:
                 self.logger.debug("text: recv data")
                 self.tcp_text.recv_text(sock, segment, pkb)
 
 ################# 处理FIN报文 ##################
-        if tcp_hdr.fin:
+        # fin之前的数据没有全部收到时不处理fin(fin的序号是数据之后的第一个序号), 等待对端重传
+        if tcp_hdr.fin and segment.seqn + segment.dlen != sock.rcv_nxt:
+            sock.flag |= TCPSockFlag.ACK_NOW
+        elif tcp_hdr.fin:
             # 通知应用层套接字删除了
             # 从established状态转换到close_wait状态
             if sock.state in [
@@ -330,9 +413,8 @@ class TCPStateProcess(object):
                 sock.flag |= TCPSockFlag.PUSH # 表示需要将数据发送给应用层
                 sock.recv_notify()
             
-            elif sock.state == TCPState.FIN_WAIT1:
+            elif sock.state == TCPState.FIN_WAIT1: # 同时关闭
                 sock.state = TCPState.CLOSING
-                return
 
             elif sock.state in [
                 TCPState.CLOSE_WAIT,
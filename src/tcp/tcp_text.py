@@ -1,3 +1,5 @@
+from time import perf_counter
+from typing import Union
 from .tcp_out import TCPout
 from .tcp_timer import TCPTimer, TCPTimerType
 from ..ip import  IPHdr
@@ -7,8 +9,12 @@ from ..pkb import Packetbuffer
 from .segment import TCPSegment
 from .sock import TCPSockFlag
 from .sock import TCPSock
+from .retrans import RetransSegment
+from .options import TCPOptions
 
 class TCPText(object):
+    TCP_DUPACK_THRESHOLD = 3
+    TCP_PACING_QUANTUM = 0.002 # pacing允许的突发(秒), 定时器的精度是1毫秒, 不能每个报文段都等定时器
 
     def __init__(self, tcp_out: TCPout, logger_manager: Logger) -> None:
         self.logger = logger_manager.get_logger("tcp")
@@ -47,11 +53,12 @@ class TCPText(object):
         l = len(data)
         sock.rcv_wnd -= l
         sock.rcv_nxt += l
+        sock.flag |= TCPSockFlag.PUSH # 有新的数据, 唤醒读数据的应用层
 
     def reass_text(self, sock: 'TCPSock', segment: TCPSegment, pkb:Packetbuffer) -> None:
-        
-        insert_pos = index = len(sock.rcv_reass)
         """
+        乱序的报文段按序号插入rcv_reass, rcv_reass中的报文段互不重叠:
+          和前一个报文段重叠的部分从头部裁掉, 和后一个报文段重叠的部分从尾部裁掉
                           |<-------------------dlen---------------->|
                           |seq                                      |
                           | ↓                                       |
@@ -59,16 +66,7 @@ class TCPText(object):
             | ↑                 |                             | ↑                     |
             | prv_seq           |                             | nxt_seq               |
             |<--------- dlen--->|                             |<--------- dlen------->|
-        
         转换为：
-                                |<-------------dlen---------------->|
-                                |seq                                |
-                                | ↓                                 |
-         ..|12|13|14|15|16|17|18|19|20|21|22|23|24|25|26|27|28|29|30|31|32|33|34|35|36|..
-            | ↑                 |                             | ↑                     |
-            | prv_seq           |                             | nxt_seq               |
-            |<--------- dlen--->|                             |<--------- dlen------->|
-        再转换为：
                                 |<----------dlen------------->|
                                 |seq                          |
                                 | ↓                           |
@@ -76,78 +74,318 @@ class TCPText(object):
             | ↑                 |                             | ↑                     |
             | prv_seq           |                             | nxt_seq               |
             |<--------- dlen--->|                             |<--------- dlen------->|
+        然后把从rcv_nxt开始连续的报文段写入rcv_buf
         """
-        for i in range(index):
-            if sock.rcv_reass[i].seqn > segment.seqn:
-                insert_pos = i
-                if i != 0:
-                    prev_seg = sock.rcv_reass[i-1]
-                    self.adjacent_segment_head(prev_seg.seqn + prev_seg.dlen, prev_seg)        
-        for i in range(index):
-            if sock.rcv_reass[i].seqn + sock.rcv_reass[i].dlen > segment.seqn + segment.dlen:
-                if sock.rcv_reass[i].seqn < sock.rcv_reass[i].seqn + sock.rcv_reass[i].dlen:
-                    segment.dlen = sock.rcv_reass[i].seqn - segment.seqn
-                    break
-        sock.rcv_reass.insert(insert_pos, segment)
+        reass = sock.rcv_reass
+        i = 0
+        while i < len(reass) and reass[i].seqn + reass[i].dlen <= segment.seqn:
+            i += 1
+        if i < len(reass) and reass[i].seqn <= segment.seqn:
+            prev_seg = reass[i]
+            if prev_seg.seqn + prev_seg.dlen >= segment.seqn + segment.dlen: # 重复的报文段
+                return
+            self.adjacent_segment_head(prev_seg.seqn + prev_seg.dlen, segment)
+            i += 1
+        if i < len(reass) and reass[i].seqn < segment.seqn + segment.dlen:
+            segment.dlen = reass[i].seqn - segment.seqn
+            segment.text = segment.text[:segment.dlen]
+        reass.insert(i, segment)
+        sock.sack_last = segment.seqn
         # 合并相邻的segment并且写入rcv_buf
-        while True:
-            seg = sock.rcv_reass[0]
-            if seg.seqn != sock.rcv_nxt:
-                break
-            self.write_buf(sock, seg.text)
-            sock.rcv_reass.remove(seg)
-            if len(sock.rcv_reass) == 0:
-                break
+        while len(reass) != 0 and reass[0].seqn == sock.rcv_nxt:
+            self.write_buf(sock, reass.pop(0).text)
 
     def recv_text(self, sock: 'TCPSock', segment: TCPSegment, pkb:Packetbuffer):
-        if sock.rcv_wnd == 0:
+        if sock.rcv_wnd <= 0:
             self.logger.debug("recv_text: rcv_wnd == 0")
+            sock.flag |= TCPSockFlag.ACK_NOW # 通知对端窗口为0
             return
         
         self.adjacent_segment_head(sock.rcv_nxt, segment)
+        # 超出接收窗口的部分丢弃
+        rcv_end = sock.rcv_nxt + sock.rcv_wnd
+        if segment.seqn + segment.dlen > rcv_end:
+            segment.dlen = max(rcv_end - segment.seqn, 0)
+            segment.text = segment.text[:segment.dlen]
         # 表示没有待重组报文，且本次收到的报文就是第一个报文。直接写到读buffer中
         if sock.rcv_nxt == segment.seqn and len(sock.rcv_reass) == 0:
             self.logger.debug("recv_text: dirrectly")
             self.write_buf(sock, segment.text)
-            if segment.tcp_hdr.psh:
-                sock.flag |= TCPSockFlag.PUSH
-                sock.flag |= TCPSockFlag.ACK_LATER
+            sock.flag |= TCPSockFlag.ACK_LATER
         # 否则走重组过程的函数
         else:
             self.logger.debug("recv_text: reassemble")
             self.reass_text(sock, segment, pkb)
+            # 乱序的报文段马上回复ack(重复ack), 对端收到3个重复ack后快速重传
+            sock.flag |= TCPSockFlag.ACK_NOW
         if sock.flag & TCPSockFlag.PUSH:
+            sock.flag &= ~TCPSockFlag.PUSH
             sock.recv_notify()
 
-    def init_text(self, sock: 'TCPSock', data: bytes) -> TCPHdr:
+    def init_text(self, sock: 'TCPSock', seg: RetransSegment) -> TCPHdr:
         assert sock.addr is not None
         tcp_hdr = TCPHdr()
         tcp_hdr.src_port = sock.addr.src_port
         tcp_hdr.dst_port = sock.addr.dst_port
-        tcp_hdr.seqn = sock.snd_nxt
+        tcp_hdr.seqn = seg.seqn
         tcp_hdr.ackn = sock.rcv_nxt
-        sock.snd_nxt += len(data)
-        sock.snd_wnd -= len(data)
         tcp_hdr.data_offset = TCPHdr.TCP_HDR_LEN
         tcp_hdr.ack = True
-        tcp_hdr.psh = True
-        tcp_hdr.window = sock.rcv_wnd
-        tcp_hdr.data = data
+        tcp_hdr.psh = len(seg.data) > 0
+        tcp_hdr.fin = seg.fin
+        tcp_hdr.window = sock.rcv_window()
+        tcp_hdr.data = seg.data # type: ignore
+        self.tcp_out.set_options(sock, tcp_hdr)
         return tcp_hdr
 
-    def send_text(self, sock: 'TCPSock', data: bytes) -> int:
-        assert sock.rtdst is not None
-        sgement_max_size = sock.rtdst.netdev.mtu - IPHdr.IP_HDR_SIZE - TCPHdr.TCP_HDR_LEN
-        data_len = len(data[0:sock.snd_wnd])
-        snd_len = 0
-        while (snd_len < data_len):
-            send_len_once = min(data_len, sgement_max_size)
-            snd_len += send_len_once
-            sock.tcp_sock_manager.tcp_id += 1
-            tcp_hdr = self.init_text(sock, data[0:send_len_once])
-            self.tcp_out.send_out(sock, tcp_hdr, None)
-            data = data[send_len_once:]
-        # update snd_wnd
-        if data_len < len(data):
-            sock.stack.ether.ip.tcp.tcp_state.tcp_timer.set_timer(sock, TCPTimerType.PERSIST,TCPTimer.TCP_PERSIST_TIMEOUT)
-        return snd_len
+    def segment_size(self, sock: 'TCPSock') -> int:
+        # 按路径MTU分段, 避免在本地或者中间路由器上分片, 并且不超过对端通告的mss
+        # 每个报文段都有的选项(时间戳)也占用mss
+        assert sock.addr is not None
+        path_mtu = self.tcp_out.ip.route_cache_manager.path_mtu(int(sock.addr.dst_ipaddr), sock.rtdst)
+        size = min(path_mtu - IPHdr.IP_HDR_SIZE - TCPHdr.TCP_HDR_LEN, sock.mss)
+        if sock.ts_ok:
+            size -= TCPOptions.TCP_TIMESTAMP_LEN
+        return size
+
+    def take_text(self, sock: 'TCPSock', size: int) -> memoryview:
+        # 从发送缓冲区取出size字节, 只有多次小的写入合并成一个报文段时才拷贝
+        head = sock.snd_queue[0]
+        if len(head) >= size:
+            if len(head) == size:
+                sock.snd_queue.popleft()
+            else:
+                sock.snd_queue[0] = head[size:]
+            sock.snd_queued -= size
+            return head[:size]
+        pieces = []
+        left = size
+        while left > 0:
+            head = sock.snd_queue[0]
+            if len(head) > left:
+                sock.snd_queue[0] = head[left:]
+                head = head[:left]
+            else:
+                sock.snd_queue.popleft()
+            pieces.append(head)
+            left -= len(head)
+        sock.snd_queued -= size
+        return memoryview(b"".join(pieces))
+
+    def send_segment(self, sock: 'TCPSock', seg: RetransSegment) -> None:
+        seg.sent = perf_counter()
+        self.tcp_out.send_out(sock, self.init_text(sock, seg), None)
+
+    def queue_segment(self, sock: 'TCPSock', seg: RetransSegment) -> None:
+        # 第一次发送的报文段放入重传队列
+        if len(sock.retrans_queue) == 0: # 空闲以后重新开始计算发送速率
+            sock.delivered_time = perf_counter()
+        seg.delivered = sock.delivered
+        seg.delivered_time = sock.delivered_time
+        sock.snd_nxt = seg.end
+        sock.retrans_queue.add(seg)
+        self.send_segment(sock, seg)
+
+    def push(self, sock: 'TCPSock') -> None:
+        # 在发送窗口内发送发送缓冲区中的数据, 发送缓冲区空了以后发送排队的fin
+        # 飞行中的数据不超过min(拥塞窗口, 对端的接收窗口), 拥塞控制算法有pacing_rate时按速率发送
+        tcp_timer = sock.stack.ether.ip.tcp.tcp_state.tcp_timer
+        sent = False
+        if sock.rto_recovery:
+            # 超时以后recover之前的报文段都当作丢失, 按拥塞窗口(慢启动)依次重传
+            for seg in sock.retrans_queue.segments():
+                if seg.seqn >= sock.recover or sock.retrans_next - sock.snd_una >= sock.cwnd:
+                    break
+                if seg.seqn >= sock.retrans_next:
+                    if not seg.sacked: # 对端已经收到的报文段不用重传
+                        self.retransmit(sock, seg)
+                    sock.retrans_next = seg.end
+            if sock.retrans_next < sock.recover: # 重传完以后才发送新的数据
+                return
+        if sock.snd_queue:
+            mss = self.segment_size(sock)
+            rate = sock.cong.pacing_rate()
+            while sock.snd_queue:
+                available = sock.snd_una + min(sock.snd_wnd, sock.cwnd) - sock.snd_nxt
+                if available <= 0:
+                    break
+                if rate != None:
+                    now = perf_counter()
+                    if sock.pacing_next > now:
+                        if not tcp_timer.timer_pending(sock, TCPTimerType.PACING):
+                            tcp_timer.set_timer(sock, TCPTimerType.PACING, sock.pacing_next - now)
+                        break
+                seg = RetransSegment(sock.snd_nxt, self.take_text(sock, min(mss, available, sock.snd_queued)))
+                self.queue_segment(sock, seg)
+                sent = True
+                if rate != None:
+                    sock.pacing_next = max(sock.pacing_next, now - self.TCP_PACING_QUANTUM) + len(seg.data) / rate
+        if not sock.snd_queue and sock.flag & TCPSockFlag.FIN_PENDING:
+            sock.flag &= ~TCPSockFlag.FIN_PENDING
+            sock.flag |= TCPSockFlag.FIN_SENT
+            self.queue_segment(sock, RetransSegment(sock.snd_nxt, memoryview(b""), True))
+            sent = True
+        if sent and not tcp_timer.timer_pending(sock, TCPTimerType.RETRANSMISSION):
+            tcp_timer.set_timer(sock, TCPTimerType.RETRANSMISSION, sock.rto.rto)
+        # 对端窗口为0并且没有等待确认的数据(不会再收到ack), 启动坚持定时器探测窗口
+        if sock.snd_queue and len(sock.retrans_queue) == 0 and not tcp_timer.timer_pending(sock, TCPTimerType.PERSIST):
+            tcp_timer.set_timer(sock, TCPTimerType.PERSIST, TCPTimer.TCP_PERSIST_TIMEOUT)
+
+    def retransmit(self, sock: 'TCPSock', seg: Union[RetransSegment, None] = None) -> None:
+        # 重传报文段, 默认是最早的没有被确认的报文段
+        if seg == None:
+            seg = sock.retrans_queue.head()
+        if seg == None:
+            return
+        seg.retrans += 1
+        sock.retransmits += 1
+        self.send_segment(sock, seg)
+
+    def sack_text(self, sock: 'TCPSock', segment: TCPSegment) -> int:
+        # 用ack中的SACK块更新记分板, 返回新被sack的字节数, 不在(snd_una, snd_nxt]中的块(比如D-SACK)忽略
+        opts = segment.tcp_hdr.opts
+        if not sock.sack_ok or opts == None or not opts.sack:
+            return 0
+        sacked = 0
+        for start, end in opts.sack:
+            if sock.snd_una <= start < end <= sock.snd_nxt:
+                sacked += sock.retrans_queue.sack(start, end)
+        return sacked
+
+    def next_hole(self, sock: 'TCPSock', head_lost: bool) -> Union[RetransSegment, None]:
+        # 这次恢复中还没有重传过(retrans_next之后), 没有被sack, 并且之后有被sack的数据(RFC 6675的IsLost)的报文段
+        # head_lost: 收到3个重复ack或者部分确认时, 即使之后没有sack信息, 队头的报文段也认为丢失了
+        queue = sock.retrans_queue
+        for i, seg in enumerate(queue.queue):
+            if seg.sacked:
+                continue
+            if seg.seqn < sock.retrans_next:
+                # 已经重传过的报文段: 在它之后发送的报文段被sack了, 说明重传的报文段也丢失了(和RACK类似), 不用等超时
+                if seg.sent < queue.sacked_sent:
+                    return seg
+                continue
+            if seg.end <= queue.high_sacked or (head_lost and i == 0):
+                return seg
+            return None
+        return None
+
+    def retransmit_hole(self, sock: 'TCPSock', head_lost: bool = False) -> bool:
+        seg = self.next_hole(sock, head_lost)
+        if seg == None:
+            return False
+        self.retransmit(sock, seg)
+        sock.retrans_next = max(sock.retrans_next, seg.end)
+        return True
+
+    def ack_text(self, sock: 'TCPSock', segment: TCPSegment) -> None:
+        # 收到确认了新数据的ack(snd_una < ackn <= snd_nxt)
+        tcp_timer = sock.stack.ether.ip.tcp.tcp_state.tcp_timer
+        acked, rtt = sock.retrans_queue.ack(segment.ackn)
+        sock.snd_una = segment.ackn
+        self.sack_text(sock, segment)
+        # 有时间戳时用回显的时间戳计算RTT, 重传的报文段被确认时也有样本
+        opts = segment.tcp_hdr.opts
+        if sock.ts_ok and opts != None and opts.ts_val != None and opts.ts_ecr:
+            ts_rtt = (self.tcp_out.tcp_time_stamp() - opts.ts_ecr) & 0xffffffff
+            if ts_rtt < sock.rto.RTO_MAX * 1000:
+                rtt = ts_rtt / 1000
+        if rtt != None:
+            sock.rto.sample(rtt)
+        # 发送速率样本: 从报文段发送到被确认期间确认的数据量 / 时间
+        now = perf_counter()
+        sock.delivered += acked
+        rate = None
+        seg = sock.retrans_queue.last_acked
+        if seg != None and seg.retrans == 0 and now > seg.delivered_time:
+            rate = (sock.delivered - seg.delivered) / (now - seg.delivered_time)
+        sock.delivered_time = now
+        sock.dupacks = 0
+        sock.cong.on_ack(acked, rtt, rate)
+        if sock.rto_recovery:
+            sock.retrans_next = max(sock.retrans_next, sock.snd_una)
+            if segment.ackn >= sock.recover:
+                sock.rto_recovery = False
+        elif sock.in_recovery:
+            if segment.ackn >= sock.recover: # 恢复开始时发送的数据全部被确认, 退出恢复
+                sock.in_recovery = False
+                sock.cong.on_recovery_exit()
+            else: # NewReno: 部分确认说明下一个报文段也丢失了, 马上重传
+                sock.cong.on_partial_ack(acked)
+                if sock.sack_ok: # 只重传还没有重传过的空洞
+                    self.retransmit_hole(sock, True)
+                else:
+                    self.retransmit(sock)
+        if len(sock.retrans_queue) == 0:
+            tcp_timer.unset_timer(sock, TCPTimerType.RETRANSMISSION)
+        else:
+            tcp_timer.set_timer(sock, TCPTimerType.RETRANSMISSION, sock.rto.rto)
+        if acked:
+            sock.send_wait.wake_up()
+
+    def dupack(self, sock: 'TCPSock', segment: TCPSegment) -> None:
+        # 收到ackn == snd_una的ack, 没有数据并且窗口没有变化的才是重复ack
+        # 有SACK时带了新的sack信息的ack也是重复ack(对端收到乱序数据以后窗口可能会变小, RFC 6675)
+        if len(sock.retrans_queue) == 0 or segment.len != 0:
+            return
+        if not self.sack_text(sock, segment) and segment.wnd != sock.snd_wnd:
+            return
+        sock.dupacks += 1
+        # RFC 6675的IsLost: 队头之后被sack的数据超过(DupThresh - 1)个mss时, 不用等3个重复ack就认为队头丢失了
+        # RFC 5827(early retransmit): 窗口太小收不到3个重复ack, 没有新的数据要发送并且队头之后的数据都被sack了
+        queue = sock.retrans_queue
+        lost = sock.dupacks >= self.TCP_DUPACK_THRESHOLD or \
+            queue.sacked_bytes > (self.TCP_DUPACK_THRESHOLD - 1) * sock.cong.mss or \
+            (not sock.snd_queue and 0 < queue.sacked_bytes == queue.bytes - len(queue.queue[0].data))
+        if sock.in_recovery:
+            # 有SACK时每个重复ack(一个报文段离开了网络)重传一个空洞, 没有空洞了才发送新的数据
+            if sock.sack_ok and self.retransmit_hole(sock):
+                return
+            if sock.dupacks > self.TCP_DUPACK_THRESHOLD: # 窗口膨胀, 可以发送新的数据
+                sock.cong.on_dupack()
+        elif lost and not sock.rto_recovery:
+            # 快速重传, 进入快速恢复, 直到recover之前的数据全部被确认
+            sock.in_recovery = True
+            sock.recover = sock.snd_nxt
+            sock.retrans_next = sock.snd_una
+            sock.fast_retransmits += 1
+            sock.cong.on_loss()
+            if sock.sack_ok:
+                self.retransmit_hole(sock, True)
+            else:
+                self.retransmit(sock)
+
+    def retransmit_timeout(self, sock: 'TCPSock') -> None:
+        tcp_state = sock.stack.ether.ip.tcp.tcp_state
+        seg = sock.retrans_queue.head()
+        if seg == None:
+            return
+        if seg.retrans >= TCPTimer.TCP_MAX_RETRIES:
+            self.logger.warning("retransmission timeout, abort connection")
+            tcp_state.tcp_abort(sock)
+            return
+        if seg.sacked: # 队头的报文段不应该被sack, 对端丢弃了sack过的数据
+            sock.retrans_queue.reset_sacked()
+        if sock.rto.backoff == 0: # 连续超时只在第一次减小ssthresh
+            sock.cong.on_rto()
+        else:
+            sock.cwnd = sock.cong.mss
+        sock.rto.timeout()
+        sock.timeouts += 1
+        # 超时以后之前发送的数据都可能丢失了, 从snd_una开始慢启动重传(退出快速恢复)
+        sock.in_recovery = False
+        sock.rto_recovery = True
+        sock.recover = sock.snd_nxt
+        sock.retrans_next = sock.snd_una
+        sock.dupacks = 0
+        self.push(sock)
+        tcp_state.tcp_timer.set_timer(sock, TCPTimerType.RETRANSMISSION, sock.rto.rto)
+
+    def send_text(self, sock: 'TCPSock', data: memoryview) -> int:
+        # 数据放入发送缓冲区并尽可能发送, 返回放入的字节数
+        size = min(len(data), sock.TCP_SNDBUF - sock.snd_queued - sock.retrans_queue.bytes)
+        if size <= 0:
+            return 0
+        sock.snd_queue.append(data[:size])
+        sock.snd_queued += size
+        self.push(sock)
+        return size
@@ -1,7 +1,7 @@
 from enum import Enum
 from src.tcp import TCPState
-from ..timer.timer import ReapeatingTimer
-from typing import TYPE_CHECKING, List, Tuple
+from ..timer.wheel import TimingWheel, WheelTimer
+from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from .sock import TCPSock
 
@@ -14,83 +14,82 @@ class TCPTimerType(Enum):
     FIN_WAIT_2 = 6
     TIME_WAIT = 7
     ANY = 8
+    PACING = 9
 
-class TimeOut():
-    def __init__(self, timeout: float) -> None:
-        self.timeout = timeout
-
-class TCPTimer(ReapeatingTimer):
-    TCP_TIMER_DELTA = 0.2
+class TCPTimer(TimingWheel):
     TCP_MSL = 1
     TCP_TIMEWAIT_TIMEOUT = 2 * TCP_MSL
     TCP_FIN_WAIT2_TIMEOUT = 2 * TCP_MSL
     TCP_PERSIST_TIMEOUT = 2
     TCP_KEEPALIVE_TIMEOUT = 2 * 60 * 60
     TCP_CONNECTION_ESTABLISH_TIMEOUT = 3
+    TCP_MAX_RETRIES = 8 # 同一个报文段重传的最大次数, 超过以后断开连接
     def __init__(self) -> None:
-        super().__init__(self.TCP_TIMER_DELTA, self.timer_cb)
-        self.sock_timers: List[Tuple['TCPSock', 'TCPTimerType', 'TimeOut']] = []
-    
-    def timer_cb(self):
-        self.timewait_timer()
+        super().__init__("tcp-timer")
+
+    # 每个套接字的每种定时器是一个单独的WheelTimer(sock.timers), 设置和取消都是O(1)的
+    def timeout_cb(self, sock: 'TCPSock', type: TCPTimerType) -> None:
+        with sock.lock:
+            self.timeout(sock, type)
 
-    def timewait_timer(self):
-        for sock_timer in self.sock_timers:
-            sock, type, timeout = sock_timer
-            sock.timeout -= self.TCP_TIMER_DELTA
-            if sock.timeout <= 0:
-                if type == TCPTimerType.CONNECTION_ESTABLISH:
-                    sock.stack.ether.ip.tcp.tcp_out.send_syn(sock)
-                    timeout.timeout *= 2
-                    sock.timeout = timeout.timeout
-                    if timeout.timeout > 60:
-                        self.unset_timer(sock, TCPTimerType.CONNECTION_ESTABLISH)
-                        sock.wait_connect.wait_exit()     
-                    
-                elif type == TCPTimerType.TIME_WAIT:
-                    if sock.parent == None:
-                        sock.unbhash()
-                        sock.unhash()
-                    self.unset_timer(sock, TCPTimerType.ANY)
+    def timeout(self, sock: 'TCPSock', type: TCPTimerType) -> None:
+        timer = sock.timers[type]
+        if type == TCPTimerType.CONNECTION_ESTABLISH:
+            if sock.state != TCPState.SYN_SENT:
+                return
+            if timer.interval * 2 > 60:
+                sock.wait_connect.wait_exit()
+            else:
+                sock.stack.ether.ip.tcp.tcp_out.send_syn(sock)
+                self.add(timer, timer.interval * 2)
 
-                elif type == TCPTimerType.FIN_WAIT_2:
-                    if sock.parent == None:
-                        sock.unbhash()
-                        sock.unhash()
-                    self.unset_timer(sock, TCPTimerType.ANY)
+        elif type == TCPTimerType.TIME_WAIT:
+            if sock.parent == None:
+                sock.unbhash()
+                sock.unhash()
+            self.unset_timer(sock, TCPTimerType.ANY)
 
-                elif type == TCPTimerType.PERSIST:
-                    if sock.snd_wnd == 0:
-                        sock.stack.ether.ip.tcp.tcp_out.send_ack(sock, None)
-                        sock.timeout = timeout.timeout
-                    else:
-                        self.unset_timer(sock, TCPTimerType.PERSIST)
+        elif type == TCPTimerType.FIN_WAIT_2:
+            if sock.parent == None:
+                sock.unbhash()
+                sock.unhash()
+            self.unset_timer(sock, TCPTimerType.ANY)
 
-                elif type == TCPTimerType.KEEP_ALIVE:
-                    if sock.state == TCPState.ESTABLISHED:
-                        sock.stack.ether.ip.tcp.tcp_out.send_ack(sock, None)
-                        sock.timeout = timeout.timeout
-                    else:
-                        self.unset_timer(sock, TCPTimerType.KEEP_ALIVE)
+        elif type == TCPTimerType.PERSIST:
+            if sock.snd_wnd == 0:
+                sock.stack.ether.ip.tcp.tcp_out.send_ack(sock, None)
+                self.add(timer, timer.interval)
+            else:
+                sock.stack.ether.ip.tcp.tcp_text.push(sock)
 
-                elif type == TCPTimerType.DELAYED_ACK:
-                    pass
-                elif type == TCPTimerType.RETRANSMISSION:
-                    pass
+        elif type == TCPTimerType.KEEP_ALIVE:
+            if sock.state == TCPState.ESTABLISHED:
+                sock.stack.ether.ip.tcp.tcp_out.send_ack(sock, None)
+                self.add(timer, timer.interval)
 
-    def set_timer(self, sock: 'TCPSock', type: TCPTimerType, timeout: float):
-        self.sock_timers.append((sock, type, TimeOut(timeout)))
-        sock.timeout = timeout
+        elif type == TCPTimerType.DELAYED_ACK:
+            pass
+        elif type == TCPTimerType.RETRANSMISSION:
+            sock.stack.ether.ip.tcp.tcp_text.retransmit_timeout(sock)
+        elif type == TCPTimerType.PACING:
+            sock.stack.ether.ip.tcp.tcp_text.push(sock)
 
-    def unset_timer(self, sock: 'TCPSock', type: TCPTimerType):
-        for sock_timer in self.sock_timers:
-            if type == TCPTimerType.ANY and sock_timer[0] == sock:
-                self.sock_timers.remove(sock_timer)
-                continue
-            elif sock_timer[0] == sock and sock_timer[1] == type:
-                self.sock_timers.remove(sock_timer)
-                break
-            
+    def set_timer(self, sock: 'TCPSock', type: TCPTimerType, timeout: float) -> None:
+        # 定时器已经在运行时重新设置超时时间
+        timer = sock.timers.get(type)
+        if timer == None:
+            timer = sock.timers[type] = WheelTimer(self.timeout_cb, sock, type)
+        self.add(timer, timeout)
 
-    
+    def unset_timer(self, sock: 'TCPSock', type: TCPTimerType) -> None:
+        if type == TCPTimerType.ANY:
+            for timer in sock.timers.values():
+                self.cancel(timer)
+            return
+        timer = sock.timers.get(type)
+        if timer != None:
+            self.cancel(timer)
 
+    def timer_pending(self, sock: 'TCPSock', type: TCPTimerType) -> bool:
+        timer = sock.timers.get(type)
+        return timer != None and timer.pending()
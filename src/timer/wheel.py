@@ -0,0 +1,189 @@
+from threading import Thread, Condition
+from time import perf_counter
+from typing import Any, Callable, List, Set, Union
+
+"""
+分层时间轮(和linux 2.6的定时器一样):
+  4层, 每层64个槽, 第0层每个槽1个tick(1毫秒), 第n层每个槽64^n个tick, 最长能定时64^4毫秒(约4.6小时)。
+  定时器按到期时间和当前时间的差放入对应的层:
+    差 < 64:     第0层, 槽号为 expires & 63
+    差 < 64^2:   第1层, 槽号为 (expires >> 6) & 63
+    ...
+  每个tick执行第0层当前槽中的定时器; 第0层转完一圈时, 把第1层的下一个槽中的定时器重新放入第0层(级联),
+  第1层转完一圈时再级联第2层, 以此类推。
+  添加和删除定时器都是O(1)的(每个槽是一个集合), 每个tick只处理一个槽, 和定时器的总数无关。
+
+  线程不是每毫秒都醒来: 第0层为空时直接跳到下一次级联, 整个时间轮为空时一直睡眠到有定时器加入。
+  到期的定时器在释放锁以后执行, 回调中可以重新添加或者删除定时器。
+"""
+
+class WheelTimer(object):
+    __slots__ = ("callback", "args", "expires", "interval", "level", "slot")
+
+    def __init__(self, callback: Callable[..., Any], *args: Any) -> None:
+        self.callback = callback
+        self.args = args
+        self.expires = 0      # 到期的tick
+        self.interval = 0.0   # 最近一次添加时的定时时间(秒)
+        self.level = -1       # 所在的层, -1表示没有在时间轮中
+        self.slot = 0
+
+    def pending(self) -> bool:
+        return self.level != -1
+
+class TimingWheel(Thread):
+    TICK = 0.001 # 1毫秒
+    LEVEL_BITS = 6
+    LEVELS = 4
+    SLOTS = 1 << LEVEL_BITS
+    SLOT_MASK = SLOTS - 1
+    MAX_TICKS = (1 << (LEVEL_BITS * LEVELS)) - 1
+
+    def __init__(self, name: str = "timer-wheel") -> None:
+        super().__init__()
+        self.setDaemon(True)
+        self.name = name
+        self.wheel: List[List[Set[WheelTimer]]] = [[set() for _ in range(self.SLOTS)] for _ in range(self.LEVELS)]
+        self.counts = [0] * self.LEVELS # 每层的定时器数
+        self.cond = Condition()
+        self.running = True
+        self.start_time = perf_counter()
+        self.current = 0                 # 下一个要处理的tick
+        self.wake_tick: Union[int, None] = None # 线程睡眠到的tick, None表示一直睡眠
+        self.fired = 0    # 到期执行的定时器数
+        self.cascaded = 0 # 级联移动的定时器数
+        self.ticks = 0    # 处理过的tick数(跳过的不算)
+
+    def now(self) -> int:
+        return int((perf_counter() - self.start_time) / self.TICK)
+
+    def _enqueue(self, timer: WheelTimer) -> None:
+        expires = timer.expires
+        delta = expires - self.current
+        if delta < 0: # 已经过期, 下一个tick执行
+            level, slot = 0, self.current & self.SLOT_MASK
+        else:
+            level = 0
+            while level < self.LEVELS - 1 and delta >= 1 << (self.LEVEL_BITS * (level + 1)):
+                level += 1
+            slot = (expires >> (self.LEVEL_BITS * level)) & self.SLOT_MASK
+        self.wheel[level][slot].add(timer)
+        self.counts[level] += 1
+        timer.level = level
+        timer.slot = slot
+
+    def _dequeue(self, timer: WheelTimer) -> None:
+        self.wheel[timer.level][timer.slot].discard(timer)
+        self.counts[timer.level] -= 1
+        timer.level = -1
+
+    def add(self, timer: WheelTimer, timeout: float) -> None:
+        # 添加定时器, 已经在时间轮中的定时器重新设置到期时间
+        ticks = min(max(int(timeout / self.TICK + 0.5), 1), self.MAX_TICKS)
+        with self.cond:
+            if timer.level != -1:
+                self._dequeue(timer)
+            timer.interval = timeout
+            # 时间轮可能落后于当前时间(线程还没有处理), 按当前时间计算到期时间
+            timer.expires = max(self.now(), self.current) + ticks
+            self._enqueue(timer)
+            if self.wake_tick == None or timer.expires < self.wake_tick:
+                self.cond.notify()
+
+    def cancel(self, timer: WheelTimer) -> bool:
+        # 返回定时器是否还没有到期
+        with self.cond:
+            if timer.level == -1:
+                return False
+            self._dequeue(timer)
+            return True
+
+    def _cascade(self, level: int) -> int:
+        # 把level层的当前槽中的定时器重新放入低层, 返回槽号
+        slot = (self.current >> (self.LEVEL_BITS * level)) & self.SLOT_MASK
+        timers = self.wheel[level][slot]
+        if timers:
+            self.wheel[level][slot] = set()
+            self.counts[level] -= len(timers)
+            self.cascaded += len(timers)
+            for timer in timers:
+                self._enqueue(timer)
+        return slot
+
+    def _advance(self, target: int) -> List[WheelTimer]:
+        # 处理到target(包括target)为止的tick, 返回到期的定时器
+        expired: List[WheelTimer] = []
+        counts = self.counts
+        while self.current <= target:
+            # 低层都为空时, 直接跳到下一次需要级联的tick
+            empty = 0
+            while empty < self.LEVELS and counts[empty] == 0:
+                empty += 1
+            if empty == self.LEVELS:
+                self.current = target + 1
+                break
+            if empty > 0:
+                step = 1 << (self.LEVEL_BITS * empty)
+                next_tick = (self.current | (step - 1)) + 1
+                if self.current & (step - 1) != 0:
+                    if next_tick > target:
+                        self.current = target + 1
+                        break
+                    self.current = next_tick
+
+            index = self.current & self.SLOT_MASK
+            if index == 0:
+                level = 1
+                while level < self.LEVELS and self._cascade(level) == 0:
+                    level += 1
+            timers = self.wheel[0][index]
+            if timers:
+                self.wheel[0][index] = set()
+                counts[0] -= len(timers)
+                for timer in timers:
+                    timer.level = -1
+                expired.extend(timers)
+            self.current += 1
+            self.ticks += 1
+        return expired
+
+    def _next_wake(self) -> Union[int, None]:
+        # 下一个需要处理的tick
+        if self.counts[0] > 0:
+            for i in range(self.SLOTS):
+                tick = self.current + i
+                if self.wheel[0][tick & self.SLOT_MASK]:
+                    return tick
+        for level in range(1, self.LEVELS):
+            if self.counts[level] > 0:
+                # 下一次级联的时候
+                return (self.current | self.SLOT_MASK) + 1 if self.current & self.SLOT_MASK else self.current
+        return None
+
+    def run(self) -> None:
+        while True:
+            with self.cond:
+                if not self.running:
+                    return
+                expired = self._advance(self.now())
+                if not expired:
+                    self.wake_tick = self._next_wake()
+                    timeout = None
+                    if self.wake_tick != None:
+                        timeout = max(self.wake_tick * self.TICK - (perf_counter() - self.start_time), 0)
+                    self.cond.wait(timeout)
+                    self.wake_tick = None
+                    continue
+                self.fired += len(expired)
+            for timer in expired:
+                timer.callback(*timer.args)
+
+    def stop(self) -> None:
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def show(self) -> None:
+        print("%s: tick %d ms, current %d, processed ticks %d" % (self.name, int(self.TICK * 1000), self.current, self.ticks))
+        print("%-10s%-10s%-10s%-10s%-10s%-10s" % ("Level0", "Level1", "Level2", "Level3", "Fired", "Cascaded"))
+        print("%-10d%-10d%-10d%-10d%-10d%-10d" % (*self.counts, self.fired, self.cascaded))